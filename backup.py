@@ -0,0 +1,294 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Deduplicating snapshots of server directories.
+#
+# Files are cut into content-defined chunks (a gear rolling hash, so an
+# insert early in a file only changes the chunks around it), and every chunk
+# is stored once, zlib-compressed, under chunks/<aa>/<sha256>. A snapshot is
+# a JSON manifest mapping each path to its size, mtime and chunk list. Files
+# whose size and mtime match the previous snapshot reuse its chunk list
+# without being read; everything else is chunked, hashed and compressed in
+# a process pool.
+
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK_MASK = (1 << 16) - 1
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+
+def _gear_table():
+    # Fixed pseudo-random table; it must never change or chunk boundaries
+    # (and so deduplication against older snapshots) would shift
+    table = []
+    for i in range(256):
+        digest = hashlib.sha256(b'gear%d' % i).digest()
+        table.append(int.from_bytes(digest[:4], 'little'))
+    return table
+
+
+GEAR = _gear_table()
+
+
+def chunk_boundary(data, start, end):
+    # Returns the end of the chunk starting at `start`, given data[start:end]
+    limit = min(end, start + MAX_CHUNK)
+    if limit - start <= MIN_CHUNK:
+        return limit
+    gear = GEAR
+    h = 0
+    for i in range(start + MIN_CHUNK, limit):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & AVG_CHUNK_MASK:
+            return i + 1
+    return limit
+
+
+def chunk_path(chunks_dir, digest):
+    return os.path.join(chunks_dir, digest[:2], digest)
+
+
+def store_chunk(chunks_dir, data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = chunk_path(chunks_dir, digest)
+    if os.path.exists(path):
+        return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = zlib.compress(data, COMPRESS_LEVEL)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    return digest, len(payload)
+
+
+def chunk_file(path, chunks_dir):
+    # Runs in a pool worker: returns the chunk list and bytes newly stored
+    chunks = []
+    stored = 0
+    buffer = b''
+    with open(path, 'rb') as f:
+        eof = False
+        while not eof or buffer:
+            if not eof and len(buffer) < MAX_CHUNK:
+                block = f.read(READ_SIZE)
+                eof = not block
+                buffer += block
+                continue
+            pos = 0
+            # Keep a full MAX_CHUNK of lookahead until EOF so boundaries
+            # do not depend on how the file happened to be read
+            while pos < len(buffer) and (eof or len(buffer) - pos >= MAX_CHUNK):
+                end = chunk_boundary(buffer, pos, len(buffer))
+                digest, written = store_chunk(chunks_dir, buffer[pos:end])
+                chunks.append([digest, end - pos])
+                stored += written
+                pos = end
+            buffer = buffer[pos:]
+            if eof:
+                break
+    return chunks, stored
+
+
+class BackupError(Exception):
+    pass
+
+
+class BackupStore:
+    def __init__(self, root, workers=None):
+        self.root = root
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self.workers = workers or os.cpu_count() or 2
+        self.pool = None
+        self.lock = threading.Lock()
+        # Held by snapshot() and delete()/gc() across the whole store: a
+        # snapshot counts on chunks that already exist, which gc would
+        # otherwise remove before its manifest is written
+        self.store_lock = threading.Lock()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # The panel is multi-threaded, so never fork it directly
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self.pool
+
+    def manifest_path(self, server, snapshot_id):
+        return os.path.join(self.snapshots_dir, server, f'{snapshot_id}.json')
+
+    def list(self, server):
+        folder = os.path.join(self.snapshots_dir, server)
+        try:
+            names = sorted(n for n in os.listdir(folder) if n.endswith('.json'))
+        except FileNotFoundError:
+            return []
+        snapshots = []
+        for name in names:
+            manifest = self.load(server, name[:-5])
+            snapshots.append({'id': manifest['id'], 'created_at': manifest['created_at'], **manifest['stats']})
+        snapshots.sort(key=lambda s: s['created_at'])
+        return snapshots
+
+    def load(self, server, snapshot_id):
+        if not snapshot_id or '/' in snapshot_id or snapshot_id.startswith('.'):
+            raise BackupError("Snapshot not found")
+        try:
+            with open(self.manifest_path(server, snapshot_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BackupError("Snapshot not found")
+
+    def latest(self, server):
+        snapshots = self.list(server)
+        return self.load(server, snapshots[-1]['id']) if snapshots else None
+
+    def snapshot(self, server, source_dir, progress=None, exclude=('logs',)):
+        with self.store_lock:
+            return self._snapshot(server, source_dir, progress, exclude)
+
+    def _snapshot(self, server, source_dir, progress, exclude):
+        previous = self.latest(server)
+        previous_files = previous['files'] if previous else {}
+        files = {}
+        dirs = []
+        pending = {}
+        stats = {'files': 0, 'bytes': 0, 'reused_files': 0, 'read_bytes': 0, 'stored_bytes': 0}
+
+        for dirpath, dirnames, filenames in os.walk(source_dir):
+            rel_dir = os.path.relpath(dirpath, source_dir)
+            if rel_dir == '.':
+                dirnames[:] = [d for d in dirnames if d not in exclude]
+            else:
+                dirs.append([rel_dir, os.stat(dirpath).st_mode & 0o7777])
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                rel = os.path.normpath(os.path.join(rel_dir, filename))
+                st = os.lstat(path)
+                if os.path.islink(path):
+                    files[rel] = {'link': os.readlink(path)}
+                    continue
+                entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'mode': st.st_mode & 0o7777}
+                stats['files'] += 1
+                stats['bytes'] += st.st_size
+                old = previous_files.get(rel)
+                if old and old.get('size') == st.st_size and old.get('mtime_ns') == st.st_mtime_ns:
+                    entry['chunks'] = old['chunks']
+                    stats['reused_files'] += 1
+                else:
+                    pending[rel] = path
+                    stats['read_bytes'] += st.st_size
+                files[rel] = entry
+
+        if pending:
+            pool = self.get_pool()
+            futures = {rel: pool.submit(chunk_file, path, self.chunks_dir) for rel, path in pending.items()}
+            for done, (rel, future) in enumerate(futures.items(), 1):
+                files[rel]['chunks'], stored = future.result()
+                stats['stored_bytes'] += stored
+                if progress:
+                    progress(done / len(futures), f"Chunked {done}/{len(futures)} changed files")
+
+        snapshot_id = time.strftime('%Y%m%d-%H%M%S', time.gmtime()) + f'-{os.urandom(2).hex()}'
+        manifest = {
+            'id': snapshot_id,
+            'server': server,
+            'created_at': time.time(),
+            'parent': previous['id'] if previous else None,
+            'stats': stats,
+            'dirs': dirs,
+            'files': files,
+        }
+        path = self.manifest_path(server, snapshot_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(f'{path}.tmp', path)
+        return {'id': snapshot_id, **stats}
+
+    def restore(self, server, snapshot_id, target_dir, progress=None):
+        # Rebuilds the snapshot next to target_dir and swaps it in, so a
+        # failed restore leaves the current files untouched
+        manifest = self.load(server, snapshot_id)
+        parent = os.path.dirname(target_dir)
+        staging = os.path.join(parent, f'.restore-{server}-{snapshot_id}')
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            for rel, mode in manifest['dirs']:
+                os.makedirs(os.path.join(staging, rel), exist_ok=True)
+                os.chmod(os.path.join(staging, rel), mode)
+            total = len(manifest['files'])
+            for done, (rel, entry) in enumerate(manifest['files'].items(), 1):
+                path = os.path.join(staging, rel)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if 'link' in entry:
+                    os.symlink(entry['link'], path)
+                    continue
+                with open(path, 'wb') as f:
+                    for digest, size in entry['chunks']:
+                        with open(chunk_path(self.chunks_dir, digest), 'rb') as c:
+                            data = zlib.decompress(c.read())
+                        if len(data) != size or hashlib.sha256(data).hexdigest() != digest:
+                            raise BackupError(f"Chunk {digest} is corrupt")
+                        f.write(data)
+                os.chmod(path, entry['mode'])
+                os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+                if progress and done % 100 == 0:
+                    progress(done / total, f"Restored {done}/{total} files")
+            # Excluded directories (logs) are carried over from the live copy
+            if os.path.isdir(target_dir):
+                for name in ('logs',):
+                    if os.path.exists(os.path.join(target_dir, name)) and not os.path.exists(os.path.join(staging, name)):
+                        os.rename(os.path.join(target_dir, name), os.path.join(staging, name))
+            old = os.path.join(parent, f'.old-{server}-{snapshot_id}')
+            if os.path.exists(target_dir):
+                os.rename(target_dir, old)
+            os.rename(staging, target_dir)
+            shutil.rmtree(old, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return {'id': snapshot_id, 'files': len(manifest['files'])}
+
+    def delete(self, server, snapshot_id):
+        with self.store_lock:
+            self.load(server, snapshot_id)
+            os.remove(self.manifest_path(server, snapshot_id))
+            return self._gc()
+
+    def gc(self):
+        with self.store_lock:
+            return self._gc()
+
+    def _gc(self):
+        # Drop chunks no manifest refers to any more
+        referenced = set()
+        if os.path.isdir(self.snapshots_dir):
+            for server in os.listdir(self.snapshots_dir):
+                for snapshot in self.list(server):
+                    for entry in self.load(server, snapshot['id'])['files'].values():
+                        referenced.update(digest for digest, _size in entry.get('chunks', []))
+        removed = 0
+        freed = 0
+        if os.path.isdir(self.chunks_dir):
+            for prefix in os.listdir(self.chunks_dir):
+                folder = os.path.join(self.chunks_dir, prefix)
+                for digest in os.listdir(folder):
+                    # .tmp files are chunks still being written
+                    if digest not in referenced and not digest.endswith('.tmp'):
+                        path = os.path.join(folder, digest)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                        removed += 1
+        return {'removed_chunks': removed, 'freed_bytes': freed}
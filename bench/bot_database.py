@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bot.utils import database  # noqa: E402
+
+# Micro-benchmark for bot/utils/database.py:
+#
+#     python bench/bot_database.py --ops 20000
+#
+# Runs the same mix of calls against the original per-call implementation
+# (reproduced below: schema setup and a new connection on every call) and
+# against the current module, each on a fresh database in a temp dir, and
+# prints ops/sec for both.
+
+
+class Legacy:
+    def __init__(self, path):
+        self.path = path
+
+    def ensure_db(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with sqlite3.connect(self.path) as conn:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS kv_store (key TEXT PRIMARY KEY, value TEXT)")
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS game_stats (user_id INTEGER, game TEXT, wins INTEGER DEFAULT 0, "
+                "losses INTEGER DEFAULT 0, draws INTEGER DEFAULT 0, PRIMARY KEY (user_id, game))"
+            )
+            conn.commit()
+
+    @contextmanager
+    def connect(self):
+        self.ensure_db()
+        conn = sqlite3.connect(self.path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_value(self, key):
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM kv_store WHERE key=?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_value(self, key, value):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO kv_store(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, value),
+            )
+            conn.commit()
+
+    def bump_game_stat(self, user_id, game, result):
+        col = {"win": "wins", "loss": "losses", "draw": "draws"}[result]
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO game_stats(user_id, game, wins, losses, draws) VALUES (?, ?, 0, 0, 0) "
+                "ON CONFLICT(user_id, game) DO NOTHING",
+                (user_id, game),
+            )
+            conn.execute(f"UPDATE game_stats SET {col} = {col} + 1 WHERE user_id = ? AND game = ?", (user_id, game))
+            conn.commit()
+
+    def get_game_stats(self, user_id, game):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT wins, losses, draws FROM game_stats WHERE user_id = ? AND game = ?", (user_id, game)
+            ).fetchone()
+            return tuple(row) if row else (0, 0, 0)
+
+
+def workload(ops, seed):
+    rng = random.Random(seed)
+    calls = {'get_value': [], 'set_value': [], 'bump_game_stat': [], 'get_game_stats': []}
+    for _ in range(ops):
+        user = rng.randrange(500)
+        calls['get_value'].append((f'key{user}',))
+        calls['set_value'].append((f'key{user}', str(rng.random())))
+        calls['bump_game_stat'].append((user, 'rps', rng.choice(('win', 'loss', 'draw'))))
+        calls['get_game_stats'].append((user, 'rps'))
+    return calls
+
+
+def run(impl, calls):
+    rates = {}
+    for name, args_list in calls.items():
+        func = getattr(impl, name)
+        started = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        rates[name] = len(args_list) / (time.perf_counter() - started)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bot database micro-benchmark')
+    parser.add_argument('--ops', type=int, default=5000, help='calls per operation')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bot-db-')
+    try:
+        calls = workload(args.ops, args.seed)
+        before = run(Legacy(os.path.join(root, 'legacy', 'bot.db')), calls)
+        database.init_db(os.path.join(root, 'current', 'bot.db'))
+        after = run(database, calls)
+        database.close()
+        print(f"{'operation':<16} {'before ops/s':>13} {'after ops/s':>13} {'speedup':>8}")
+        for name in calls:
+            print(f"{name:<16} {before[name]:>13.0f} {after[name]:>13.0f} {after[name] / before[name]:>7.1f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from panel_load import PANEL, percentile, request, stop_servers, stub_bin, wait_until
+
+# Several agents and a central panel on localhost, all offline:
+#
+#     python bench/cluster_local.py --agents 3 --servers 9
+#
+# Each agent is panel.py in agent mode with its own PANEL_BASE_DIR and
+# port, and a stub Paper API serves the server jar. Servers are created
+# through the central panel, which places them, then started through its
+# node proxy. The script reports the placement spread and the latency of
+# the aggregated /cluster/servers fan-out.
+
+TOKEN = 'bench-token'
+FAKE_JAR = b'PK\x05\x06' + b'\x00' * 18
+
+
+class PaperStub(http.server.BaseHTTPRequestHandler):
+    digest = hashlib.sha256(FAKE_JAR).hexdigest()
+    routes = {
+        '/projects/paper': {'versions': ['1.21']},
+        '/projects/paper/versions/1.21/builds': {'builds': [
+            {'build': 1, 'downloads': {'application': {'name': 'paper-1.21-1.jar', 'sha256': digest}}},
+        ]},
+    }
+
+    def do_GET(self):
+        if self.path.endswith('.jar'):
+            body, kind = FAKE_JAR, 'application/java-archive'
+        elif self.path in self.routes:
+            body, kind = json.dumps(self.routes[self.path]).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def launch(base, port, env, log_name):
+    os.makedirs(base, exist_ok=True)
+    log = open(os.path.join(base, log_name), 'w')
+    env = dict(env, PANEL_BASE_DIR=base, PANEL_PORT=str(port), PANEL_HOST='127.0.0.1')
+    return subprocess.Popen([sys.executable, PANEL], cwd=base, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local multi-agent cluster check')
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--servers', type=int, default=6)
+    parser.add_argument('--memory', type=int, default=512, help='MB of heap per server')
+    parser.add_argument('--queries', type=int, default=200, help='/cluster/servers requests to time')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='panel-cluster-')
+    stub = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PaperStub)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    env = dict(os.environ, PATH=stub_bin(root) + os.pathsep + os.environ.get('PATH', ''),
+               PAPER_API_URL=f'http://127.0.0.1:{stub.server_port}', PANEL_AGENT_TOKEN=TOKEN)
+    env.pop('PANEL_WORKERS', None)
+
+    agents = {f'node{i}': args.port + 1 + i for i in range(args.agents)}
+    procs = [launch(os.path.join(root, name), port, dict(env, PANEL_MODE='agent'), 'agent.log')
+             for name, port in agents.items()]
+    spec = ','.join(f'{name}=http://127.0.0.1:{port}' for name, port in agents.items())
+    procs.append(launch(os.path.join(root, 'central'), args.port, dict(env, PANEL_AGENTS=spec), 'central.log'))
+    conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+    try:
+        def cluster_up():
+            status, data = request(conn, 'GET', '/cluster/nodes')
+            return status == 200 and all(n.get('online') for n in json.loads(data)['nodes'].values())
+
+        wait_until(cluster_up, 30, 'the agents and the central panel')
+
+        placed = {}
+        for i in range(args.servers):
+            name = f'event-{i:02d}'
+            status, data = request(conn, 'POST', '/cluster/server/create', {'name': name, 'memory': args.memory})
+            result = json.loads(data)
+            if status != 202:
+                raise SystemExit(f"Create of {name} failed: {result}")
+            placed[name] = (result['node'], result['job']['id'])
+
+        def job_done(node, job_id):
+            job = json.loads(request(conn, 'GET', f'/cluster/node/{node}/jobs/{job_id}')[1])
+            if job['state'] == 'failed':
+                raise SystemExit(f"Job {job_id} on {node} failed: {job['error']}")
+            return job['state'] == 'done'
+
+        for name, (node, job_id) in placed.items():
+            wait_until(lambda: job_done(node, job_id), 60, f'{name} to be created')
+            status, data = request(conn, 'POST', f'/cluster/node/{node}/server/control', {'name': name, 'action': 'start'})
+            if status != 202:
+                raise SystemExit(f"Start of {name} failed: {data.decode()}")
+
+        def all_running():
+            servers = json.loads(request(conn, 'GET', '/cluster/servers')[1])['servers']
+            return sum(s['status'] == 'running' for s in servers) == args.servers
+
+        wait_until(all_running, 60, 'every server to run')
+
+        latencies = []
+        for _ in range(args.queries):
+            t0 = time.perf_counter()
+            status, _data = request(conn, 'GET', '/cluster/servers')
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                raise SystemExit(f"/cluster/servers returned {status}")
+        summary = json.loads(request(conn, 'GET', '/cluster/servers')[1])
+
+        spread = {}
+        for name, (node, _job) in placed.items():
+            spread.setdefault(node, []).append(name)
+        print(f"{args.agents} agents, {args.servers} servers of {args.memory} MB")
+        for node in agents:
+            info = summary['nodes'][node]
+            print(f"  {node}: {len(spread.get(node, []))} placed, agent round trip "
+                  f"{info.get('latency_ms')} ms, schedulable {info['memory']['schedulable'] / 2 ** 30:.1f} GiB")
+        print(f"/cluster/servers over {args.queries} requests: "
+              f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+    finally:
+        conn.close()
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+        for proc in procs:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for name in agents:
+            stop_servers(os.path.join(root, name))
+        stub.shutdown()
+        if args.keep:
+            print(f"Kept {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
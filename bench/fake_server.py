@@ -0,0 +1,44 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+# Stand-in for a Minecraft server, launched by the panel through start.sh
+# under a binary named `java` so the metrics sampler finds it. It appends
+# timestamped lines to logs/latest.log at BENCH_LOG_RATE lines per second
+# (the t= field lets clients measure console delivery lag) and logs every
+# console command it reads from stdin.
+
+
+def main():
+    rate = float(os.environ.get('BENCH_LOG_RATE', 5))
+    os.makedirs('logs', exist_ok=True)
+    log = open(os.path.join('logs', 'latest.log'), 'a', buffering=1)
+    lock = threading.Lock()
+    stopping = threading.Event()
+
+    def write(message):
+        with lock:
+            log.write(f"[{time.strftime('%H:%M:%S')}] [Server thread/INFO]: {message}\n")
+
+    def console():
+        for line in sys.stdin:
+            command = line.strip()
+            write(f"Console command: {command}")
+            if command == 'stop':
+                stopping.set()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    threading.Thread(target=console, daemon=True).start()
+    write('Done (0.100s)! For help, type "help"')
+    tick = 0
+    interval = 1 / rate if rate > 0 else 3600
+    while not stopping.wait(interval):
+        tick += 1
+        write(f"tick {tick} t={time.time():.6f}")
+    write('Stopping server')
+
+
+if __name__ == '__main__':
+    main()
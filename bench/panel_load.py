@@ -0,0 +1,419 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Load test for panel.py that runs offline.
+#
+#     python bench/panel_load.py --servers 10 --tabs 50 --duration 20
+#
+# It builds a throwaway PANEL_BASE_DIR with M fake servers. Each fake
+# server is bench/fake_server.py, run as `java`, and writes synthetic log
+# lines. The script starts the panel against that directory and starts
+# every server through the API. It then runs one phase per traffic shape:
+#
+#   poll      N tabs on the original index.html pattern: every second,
+#             GET /servers, /server/console/<name> and /server/status/<name>
+#   <path>    the same N tabs hitting one of those endpoints alone, so CPU
+#             and RSS can be attributed to it
+#   events    with --sse, N tabs on the current page's /events stream,
+#             measuring how long a log line takes to reach the browser
+#
+# For each endpoint it reports requests, rps and p50/p99 latency, plus the
+# panel's CPU and peak RSS during the phase. --save writes the results as
+# JSON; --baseline compares against a saved run and exits 1 on regressions.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PANEL = os.path.join(os.path.dirname(HERE), 'panel.py')
+FAKE_SERVER = os.path.join(HERE, 'fake_server.py')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# Differences below this are noise, whatever the relative change
+MIN_REGRESSION_MS = 1.0
+
+POLL_ENDPOINTS = ('/servers', '/server/console/{name}', '/server/status/{name}')
+
+
+def stub_bin(base):
+    # A `java` that ignores its JVM arguments and runs the fake server (the
+    # metrics sampler looks for a process whose comm is "java"), and a
+    # `screen` with no sessions; only `screen -ls` is still called
+    bin_dir = os.path.join(base, 'bin')
+    os.makedirs(bin_dir)
+    java = os.path.join(bin_dir, 'java')
+    with open(java, 'w') as f:
+        f.write(f'#!{sys.executable}\nimport runpy\nrunpy.run_path({FAKE_SERVER!r}, run_name="__main__")\n')
+    screen = os.path.join(bin_dir, 'screen')
+    with open(screen, 'w') as f:
+        f.write('#!/bin/sh\necho "No Sockets found"\nexit 1\n')
+    for path in (java, screen):
+        os.chmod(path, 0o755)
+    return bin_dir
+
+
+def build_tree(base, servers, log_rate):
+    bin_dir = stub_bin(base)
+    java = os.path.join(bin_dir, 'java')
+    names = []
+    for i in range(servers):
+        name = f'bench-{i:03d}'
+        server_dir = os.path.join(base, 'servers', name)
+        os.makedirs(os.path.join(server_dir, 'logs'))
+        with open(os.path.join(server_dir, 'start.sh'), 'w') as f:
+            f.write(f'#!/bin/sh\ncd "{server_dir}"\nexec "{java}" -Xmx1G -jar server.jar nogui\n')
+        os.chmod(os.path.join(server_dir, 'start.sh'), 0o755)
+        with open(os.path.join(server_dir, 'server.properties'), 'w') as f:
+            f.write(f'server-port={25565 + i}\nmax-players=20\nmotd=bench {i}\n')
+        names.append(name)
+    env = dict(os.environ, PANEL_BASE_DIR=base, BENCH_LOG_RATE=str(log_rate),
+               PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''))
+    return names, env
+
+
+def request(conn, method, path, body=None):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    except (OSError, http.client.HTTPException):
+        # Leaves the connection reusable; http.client reconnects on the next request
+        conn.close()
+        raise
+
+
+def wait_until(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {what}")
+
+
+def panel_pids(root_pid):
+    # The panel and any worker processes, but not the servers it launched
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        ppid = int(data[data.rindex(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    pids = []
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        if b'panel.py' in cmdline:
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+    return pids
+
+
+def process_usage(pids):
+    cpu = 0.0
+    rss = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        fields = data[data.rindex(b')') + 2:].split()
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss += int(fields[21]) * PAGE_SIZE
+    return cpu, rss
+
+
+class Monitor:
+    # Samples panel CPU time and RSS while a phase runs
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.stop = threading.Event()
+        self.peak_rss = 0
+
+    def __enter__(self):
+        self.start_cpu, _ = process_usage(panel_pids(self.root_pid))
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop.wait(0.5):
+            _cpu, rss = process_usage(panel_pids(self.root_pid))
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        cpu, rss = process_usage(panel_pids(self.root_pid))
+        self.peak_rss = max(self.peak_rss, rss)
+        self.cpu_percent = 100 * (cpu - self.start_cpu) / (time.monotonic() - self.start_time)
+
+
+def poll_tab(port, name, paths, interval, deadline, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        for template in paths:
+            path = template.format(name=name)
+            t0 = time.perf_counter()
+            try:
+                status, _ = request(conn, 'GET', path)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+            elapsed = time.perf_counter() - t0
+            entry = results.setdefault(template, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(elapsed)
+            if not ok:
+                entry['errors'] += 1
+        time.sleep(max(0.0, started + interval - time.monotonic()))
+    conn.close()
+
+
+def sse_tab(port, name, deadline, results):
+    entry = results.setdefault('/events (lag)', {'latencies': [], 'errors': 0})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('GET', f'/events?server={name}')
+        response = conn.getresponse()
+        event = None
+        while time.monotonic() < deadline:
+            try:
+                line = response.fp.readline()
+            except TimeoutError:
+                continue
+            if not line:
+                entry['errors'] += 1
+                break
+            line = line.decode().rstrip('\n')
+            if line.startswith('event: '):
+                event = line[7:]
+            elif line.startswith('data: ') and event == 'console':
+                now = time.time()
+                for text in json.loads(line[6:])['lines']:
+                    if ' t=' in text:
+                        entry['latencies'].append(now - float(text.rsplit(' t=', 1)[1]))
+    except (OSError, http.client.HTTPException):
+        entry['errors'] += 1
+    finally:
+        conn.close()
+
+
+def client_process(port, tabs, mode, paths, interval, duration, output):
+    # One of several load-generating processes, so the client side does not
+    # become the bottleneck; each tab is a thread
+    results = [{} for _ in tabs]
+    deadline = time.monotonic() + duration
+    threads = []
+    for i, name in enumerate(tabs):
+        if mode == 'sse':
+            target, args = sse_tab, (port, name, deadline, results[i])
+        else:
+            target, args = poll_tab, (port, name, paths, interval, deadline, results[i])
+        threads.append(threading.Thread(target=target, args=args, daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(duration + 30)
+    merged = {}
+    for result in results:
+        for key, entry in result.items():
+            target = merged.setdefault(key, {'latencies': [], 'errors': 0})
+            target['latencies'].extend(entry['latencies'])
+            target['errors'] += entry['errors']
+    output.put(merged)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_phase(args, panel_pid, names, phase, mode, paths):
+    tabs = [names[i % len(names)] for i in range(args.tabs)]
+    context = multiprocessing.get_context('fork')
+    output = context.Queue()
+    groups = [tabs[i::args.client_procs] for i in range(args.client_procs)]
+    procs = [
+        context.Process(target=client_process,
+                        args=(args.port, group, mode, paths, args.interval, args.duration, output))
+        for group in groups if group
+    ]
+    with Monitor(panel_pid) as monitor:
+        for proc in procs:
+            proc.start()
+        merged = {}
+        for _ in procs:
+            for key, entry in output.get(timeout=args.duration + 60).items():
+                target = merged.setdefault(key, {'latencies': [], 'errors': 0})
+                target['latencies'].extend(entry['latencies'])
+                target['errors'] += entry['errors']
+        for proc in procs:
+            proc.join()
+    rows = []
+    for key, entry in merged.items():
+        latencies = entry['latencies']
+        rows.append({
+            'phase': phase,
+            'endpoint': key.replace('{name}', '<name>'),
+            'requests': len(latencies),
+            'rps': len(latencies) / args.duration,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            'errors': entry['errors'],
+            'cpu_percent': round(monitor.cpu_percent, 1),
+            'rss_mb': round(monitor.peak_rss / 1024 / 1024, 1),
+        })
+    return rows
+
+
+def print_rows(rows):
+    header = f"{'phase':<24} {'endpoint':<24} {'reqs':>7} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'errs':>5} {'cpu %':>6} {'rss MB':>7}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        p50 = '-' if row['p50_ms'] is None else f"{row['p50_ms']:.2f}"
+        p99 = '-' if row['p99_ms'] is None else f"{row['p99_ms']:.2f}"
+        print(f"{row['phase']:<24} {row['endpoint']:<24} {row['requests']:>7} {row['rps']:>8.1f} "
+              f"{p50:>8} {p99:>8} {row['errors']:>5} {row['cpu_percent']:>6.1f} {row['rss_mb']:>7.1f}")
+
+
+def compare(rows, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {(r['phase'], r['endpoint']): r for r in json.load(f)['results']}
+    regressions = []
+    for row in rows:
+        old = baseline.get((row['phase'], row['endpoint']))
+        if not old:
+            continue
+        for field in ('p50_ms', 'p99_ms'):
+            if old[field] is None or row[field] is None:
+                continue
+            if row[field] > old[field] * (1 + tolerance) and row[field] - old[field] > MIN_REGRESSION_MS:
+                regressions.append(f"{row['phase']} {row['endpoint']} {field}: {old[field]} -> {row[field]}")
+        if row['cpu_percent'] > old['cpu_percent'] * (1 + tolerance) + 1:
+            regressions.append(f"{row['phase']} cpu_percent: {old['cpu_percent']} -> {row['cpu_percent']}")
+        if row['errors'] > old['errors']:
+            regressions.append(f"{row['phase']} {row['endpoint']} errors: {old['errors']} -> {row['errors']}")
+    return sorted(set(regressions))
+
+
+def stop_servers(base):
+    # Servers run in their own sessions and outlive the panel
+    run_dir = os.path.join(base, 'run')
+    if not os.path.isdir(run_dir):
+        return
+    for entry in os.listdir(run_dir):
+        if not entry.endswith('.pid'):
+            continue
+        try:
+            with open(os.path.join(run_dir, entry)) as f:
+                pid = int(f.read().split()[0])
+            os.killpg(pid, signal.SIGKILL)
+        except (OSError, ValueError, IndexError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for panel.py')
+    parser.add_argument('--servers', type=int, default=5, help='fake servers (M)')
+    parser.add_argument('--tabs', type=int, default=20, help='simulated browser tabs (N)')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per phase')
+    parser.add_argument('--interval', type=float, default=1.0, help='poll interval of a tab')
+    parser.add_argument('--log-rate', type=float, default=5, help='log lines per second per server')
+    parser.add_argument('--workers', type=int, default=1, help='PANEL_WORKERS for the panel')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--client-procs', type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)))
+    parser.add_argument('--sse', action='store_true', help='also measure the /events stream')
+    parser.add_argument('--phases', default='all', help='comma list of poll, endpoints, events')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a JSON file from --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary base dir')
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='panel-bench-')
+    names, env = build_tree(base, args.servers, args.log_rate)
+    env.update(PANEL_PORT=str(args.port), PANEL_HOST='127.0.0.1', PANEL_WORKERS=str(args.workers))
+    log = open(os.path.join(base, 'panel.log'), 'w')
+    panel = subprocess.Popen([sys.executable, PANEL], cwd=base, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=10)
+        wait_until(lambda: request(conn, 'GET', '/servers')[0] == 200, 30, 'the panel to listen')
+        for name in names:
+            status, data = request(conn, 'POST', '/server/control', {'name': name, 'action': 'start'})
+            if status != 202:
+                raise SystemExit(f"Could not start {name}: {data.decode()}")
+
+        def all_running():
+            servers = json.loads(request(conn, 'GET', '/servers/status')[1])['servers']
+            return all(servers.get(name, {}).get('status') == 'running' for name in names)
+
+        wait_until(all_running, 60, 'the fake servers to start')
+        conn.close()
+        time.sleep(2)
+
+        wanted = set(args.phases.split(',')) if args.phases != 'all' else {'poll', 'endpoints', 'events'}
+        rows = []
+        if 'poll' in wanted:
+            rows += run_phase(args, panel.pid, names, 'poll', 'poll', POLL_ENDPOINTS)
+        if 'endpoints' in wanted:
+            for path in POLL_ENDPOINTS:
+                rows += run_phase(args, panel.pid, names, path.replace('{name}', '<name>'), 'poll', (path,))
+        if args.sse and 'events' in wanted:
+            rows += run_phase(args, panel.pid, names, 'events', 'sse', ())
+        print(f"{args.servers} servers, {args.tabs} tabs, {args.duration:g}s per phase, "
+              f"{args.workers} worker(s), {args.log_rate:g} log lines/s per server")
+        print_rows(rows)
+
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump({'args': vars(args), 'results': rows}, f, indent=2)
+        if args.baseline:
+            regressions = compare(rows, args.baseline, args.tolerance)
+            for line in regressions:
+                print(f"REGRESSION {line}")
+            if regressions:
+                sys.exit(1)
+    finally:
+        panel.send_signal(signal.SIGTERM)
+        try:
+            panel.wait(10)
+        except subprocess.TimeoutExpired:
+            panel.kill()
+        stop_servers(base)
+        log.close()
+        if args.keep:
+            print(f"Kept {base}")
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from rcon import MAX_RESPONSE_CHARS, RconError, RconPool  # noqa: E402
+
+# Stand-in RCON server and a check of rcon.py against it:
+#
+#     python bench/rcon_standin.py --commands 500
+#
+# The stand-in follows the vanilla server's RconClient: one recv() of up
+# to 1460 bytes per packet, the connection dropped when a read does not
+# hold exactly one packet, long outputs split into MAX_RESPONSE_CHARS
+# character packets and "Unknown request" for unknown packet types. The
+# script sends plain, long-output and wrong-password commands through a
+# RconPool, checks every response and prints commands/sec.
+
+PASSWORD = 'bench'
+READ_SIZE = 1460
+
+
+def reply(conn, request_id, packet_type, body):
+    payload = struct.pack('<ii', request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+    conn.sendall(struct.pack('<i', len(payload)) + payload)
+
+
+def output(command):
+    # `echo <text>` returns the text; `long <n>` returns n characters
+    name, _, arg = command.partition(' ')
+    if name == 'echo':
+        return arg
+    if name == 'long':
+        return ''.join(chr(ord('a') + i % 26) for i in range(int(arg)))
+    return f'Unknown command: {command}'
+
+
+def handle(conn, stats):
+    authed = False
+    with conn:
+        while True:
+            data = conn.recv(READ_SIZE)
+            if len(data) < 14:
+                return
+            (length,) = struct.unpack('<i', data[:4])
+            if length != len(data) - 4:
+                # What vanilla does with several packets in one read
+                stats['dropped'] += 1
+                return
+            request_id, packet_type = struct.unpack('<ii', data[4:12])
+            body = data[12:-2].decode('utf-8')
+            if packet_type == 3:
+                authed = body == PASSWORD
+                reply(conn, request_id if authed else -1, 2, '')
+            elif packet_type == 2 and authed:
+                text = output(body)
+                for start in range(0, max(len(text), 1), MAX_RESPONSE_CHARS):
+                    reply(conn, request_id, 0, text[start:start + MAX_RESPONSE_CHARS])
+            else:
+                reply(conn, request_id, 0, f'Unknown request {packet_type:x}')
+
+
+def serve(listener, stats):
+    while True:
+        conn, _addr = listener.accept()
+        threading.Thread(target=handle, args=(conn, stats), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rcon.py against a stand-in RCON server')
+    parser.add_argument('--commands', type=int, default=500)
+    args = parser.parse_args()
+
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    stats = {'dropped': 0}
+    threading.Thread(target=serve, args=(listener, stats), daemon=True).start()
+    pool = RconPool()
+
+    commands = [f'echo {i}' for i in range(args.commands)]
+    started = time.perf_counter()
+    with pool.client('127.0.0.1', port, PASSWORD) as client:
+        responses = client.commands(commands)
+    elapsed = time.perf_counter() - started
+    assert responses == [str(i) for i in range(args.commands)], 'echo responses out of step'
+
+    # Exactly one full packet, several packets, then a short command after
+    # them on the same pooled connection
+    sizes = [MAX_RESPONSE_CHARS, MAX_RESPONSE_CHARS * 3 + 17, 10]
+    with pool.client('127.0.0.1', port, PASSWORD) as client:
+        responses = client.commands([f'long {n}' for n in sizes] + ['echo after'])
+    assert [len(r) for r in responses[:-1]] == sizes, 'long output not reassembled'
+    assert responses[-1] == 'after', 'response after long output out of step'
+
+    try:
+        with pool.client('127.0.0.1', port, 'wrong'):
+            pass
+        raise AssertionError('wrong password accepted')
+    except RconError:
+        pass
+
+    pool.close_all()
+    assert stats['dropped'] == 0, f"stand-in dropped {stats['dropped']} connections"
+    print(f"{args.commands} commands in {elapsed * 1000:.1f} ms "
+          f"({args.commands / elapsed:.0f}/s), long outputs and auth ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ import discord
 from discord.ext import commands
 
 from .config import Settings
+from .utils import database
 
 
 COGS: Sequence[str] = (
@@ -38,6 +39,8 @@ class ProBot(commands.Bot):
         self.start_time = discord.utils.utcnow()
 
     async def setup_hook(self) -> None:
+        database.init_db()
+        database.db.start()
         for ext in COGS:
             try:
                 await self.load_extension(ext)
@@ -60,6 +63,11 @@ class ProBot(commands.Bot):
         except Exception:
             self.log.exception("Failed to sync application commands")
 
+    async def close(self) -> None:
+        await super().close()
+        await database.db.close()
+        database.close()
+
     async def on_ready(self) -> None:
         self.log.info("Logged in as %s (ID: %s)", self.user, getattr(self.user, "id", "?"))
         await self.change_presence(activity=discord.Game(name="/help | !help"))
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import random
-from typing import Optional
+from typing import Literal, Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from ..utils.database import bump_game_stat, get_game_stats
+from ..utils import leaderboard
+from ..utils.database import MIN_RATED_GAMES, db
 
 
 class RPSView(discord.ui.View):
@@ -122,18 +123,47 @@ class Games(commands.Cog):
         await interaction.response.send_message("Choose your move:", view=view)
         await view.wait()
         if view.result:
-            if view.result == "win":
-                bump_game_stat(interaction.user.id, "rps", "win")
-            elif view.result == "loss":
-                bump_game_stat(interaction.user.id, "rps", "loss")
-            else:
-                bump_game_stat(interaction.user.id, "rps", "draw")
+            await db.bump_game_stat(interaction.user.id, "rps", view.result, interaction.guild_id)
 
     @app_commands.command(name="rpsstats", description="Your RPS stats")
     async def rpsstats(self, interaction: discord.Interaction) -> None:
-        w, l, d = get_game_stats(interaction.user.id, "rps")
+        w, l, d = await db.get_game_stats(interaction.user.id, "rps")
         await interaction.response.send_message(f"Wins: {w} | Losses: {l} | Draws: {d}")
 
+    @app_commands.command(name="leaderboard", description="Top players for a game")
+    @app_commands.describe(
+        game="Game to rank",
+        metric="Rank by total wins or by win rate",
+        scope="This server only, or everyone",
+    )
+    async def leaderboard(
+        self,
+        interaction: discord.Interaction,
+        game: Literal["rps"] = "rps",
+        metric: Literal["wins", "winrate"] = "wins",
+        scope: Literal["server", "global"] = "server",
+    ) -> None:
+        guild_id = interaction.guild_id if scope == "server" else None
+        rows = await leaderboard.top(game, metric, 10, guild_id)
+        you = await leaderboard.rank(interaction.user.id, game, metric, guild_id)
+
+        lines = []
+        for position, (user_id, wins, losses, draws) in enumerate(rows, 1):
+            games = wins + losses + draws
+            value = f"{wins} wins" if metric == "wins" else f"{wins / games:.0%} of {games}"
+            lines.append(f"**{position}.** <@{user_id}> — {value}")
+        where = "this server" if guild_id is not None else "everyone"
+        embed = discord.Embed(
+            title=f"{game.upper()} leaderboard ({'wins' if metric == 'wins' else 'win rate'}, {where})",
+            description="\n".join(lines) or "No ranked players yet.",
+            color=discord.Color.gold(),
+        )
+        if you is not None:
+            embed.set_footer(text=f"Your rank: #{you}")
+        elif metric == "winrate":
+            embed.set_footer(text=f"Play {MIN_RATED_GAMES} games to be ranked by win rate.")
+        await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
     @app_commands.command(name="tictactoe", description="Play TicTacToe vs another player")
     async def tictactoe(self, interaction: discord.Interaction, opponent: discord.Member) -> None:
         if opponent.id == interaction.user.id:
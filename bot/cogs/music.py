@@ -3,8 +3,11 @@ from __future__ import annotations
 import asyncio
 import functools
 import itertools
+import logging
+import time
 from dataclasses import dataclass
 from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
 
 import discord
 from discord import app_commands
@@ -27,7 +30,17 @@ FFMPEG_OPTS = {
 }
 
 
+# The next track is probed and starts buffering this many seconds before
+# the current one is due to end
+PREFETCH_LEAD = 20.0
+# A stream URL that would expire within this margin of the track ending is
+# resolved again before playing
+EXPIRY_MARGIN = 300.0
+# Assumed lifetime of stream URLs that do not carry an expire= parameter
+DEFAULT_URL_TTL = 3600.0
+
 audioloader = yt_dlp.YoutubeDL(YTDL_OPTS)
+log = logging.getLogger("music")
 
 
 @dataclass
@@ -36,6 +49,77 @@ class Track:
     url: str
     webpage_url: str
     requester_id: int
+    duration: Optional[float] = None
+    expires_at: float = 0.0
+
+    def needs_refresh(self) -> bool:
+        return time.time() + (self.duration or 0) + EXPIRY_MARGIN >= self.expires_at
+
+
+def _url_expiry(url: str) -> Optional[float]:
+    # YouTube stream URLs carry their expiry as a unix timestamp
+    try:
+        return float(parse_qs(urlsplit(url).query)["expire"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def extract_track(query: str, requester_id: int) -> Track:
+    # Blocking; run in an executor
+    info = audioloader.extract_info(query, download=False)
+    if "entries" in info:
+        info = info["entries"][0]
+    return Track(
+        title=info.get("title", "Unknown"),
+        url=info["url"],
+        webpage_url=info.get("webpage_url", query),
+        requester_id=requester_id,
+        duration=info.get("duration"),
+        expires_at=_url_expiry(info["url"]) or time.time() + DEFAULT_URL_TTL,
+    )
+
+
+@dataclass
+class Prefetch:
+    track: Track
+    task: asyncio.Task
+    # Set when the track is needed now, cutting short the wait for PREFETCH_LEAD
+    go: asyncio.Event
+
+
+def _cleanup_prefetched(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is None:
+        task.result().cleanup()
+
+
+class TimedSource(discord.AudioSource):
+    # Logs the time to first audio: from the previous track ending (or the
+    # play request) to the first frame handed to the voice connection
+
+    def __init__(self, source: discord.AudioSource, track: Track, since: float, prefetched: bool) -> None:
+        self.source = source
+        self.track = track
+        self.since = since
+        self.prefetched = prefetched
+        self.started = False
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        if data and not self.started:
+            self.started = True
+            log.info(
+                "First audio for %r after %.0f ms (%s)",
+                self.track.title,
+                (time.perf_counter() - self.since) * 1000,
+                "prefetched" if self.prefetched else "cold",
+            )
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
 
 
 class GuildMusic:
@@ -43,6 +127,8 @@ class GuildMusic:
         self.voice_client = voice_client
         self.queue: List[Track] = []
         self.now_playing: Optional[Track] = None
+        self.started_at = 0.0
+        self.prepared: Optional[Prefetch] = None
         self.play_next = asyncio.Event()
 
     def add(self, track: Track) -> None:
@@ -54,6 +140,15 @@ class GuildMusic:
 
     def clear(self) -> None:
         self.queue.clear()
+        self.discard_prepared()
+
+    def discard_prepared(self) -> None:
+        if self.prepared is None:
+            return
+        prefetch, self.prepared = self.prepared, None
+        prefetch.task.cancel()
+        # The probe may finish anyway; its ffmpeg process must not linger
+        prefetch.task.add_done_callback(_cleanup_prefetched)
 
 
 class Music(commands.Cog):
@@ -102,31 +197,67 @@ class Music(commands.Cog):
         voice = await self.ensure_voice(interaction)
         guild_music = self.get_guild_music(interaction.guild_id)  # type: ignore[arg-type]
 
+        requested = time.perf_counter()
         loop = asyncio.get_running_loop()
-
-        def extract() -> Track:
-            info = audioloader.extract_info(query, download=False)
-            if "entries" in info:
-                info = info["entries"][0]
-            return Track(
-                title=info.get("title", "Unknown"),
-                url=info["url"],
-                webpage_url=info.get("webpage_url", query),
-                requester_id=interaction.user.id,
-            )
-
-        track: Track = await loop.run_in_executor(None, extract)
+        track: Track = await loop.run_in_executor(None, extract_track, query, interaction.user.id)
         guild_music.add(track)
 
         await interaction.followup.send(f"Queued: [{track.title}]({track.webpage_url})")
 
         if not voice.is_playing() and not voice.is_paused():
-            await self._play_loop(interaction.guild, voice)
-
-    async def _play_loop(self, guild: discord.Guild | None, voice: discord.VoiceClient) -> None:
+            await self._play_loop(interaction.guild, voice, requested)
+        else:
+            self._prefetch_next(guild_music)
+
+    async def _prepare(self, track: Track, start_at: float, go: asyncio.Event) -> discord.FFmpegOpusAudio:
+        delay = start_at - time.monotonic()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(go.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        if track.needs_refresh():
+            loop = asyncio.get_running_loop()
+            fresh = await loop.run_in_executor(None, extract_track, track.webpage_url, track.requester_id)
+            track.url, track.expires_at = fresh.url, fresh.expires_at
+            track.duration = fresh.duration or track.duration
+        # ffmpeg starts as soon as the source exists and fills its pipe, so
+        # the first frames are buffered before the track is played
+        return await discord.FFmpegOpusAudio.from_probe(track.url, **FFMPEG_OPTS)
+
+    def _prefetch_next(self, gm: GuildMusic) -> None:
+        # Prepares the head of the queue in the background while the current
+        # track plays, starting PREFETCH_LEAD seconds before it should end
+        if not gm.queue or gm.now_playing is None:
+            return
+        track = gm.queue[0]
+        if gm.prepared is not None:
+            if gm.prepared.track is track:
+                return
+            gm.discard_prepared()
+        start_at = gm.started_at + (gm.now_playing.duration or 0) - PREFETCH_LEAD
+        go = asyncio.Event()
+        gm.prepared = Prefetch(track, asyncio.create_task(self._prepare(track, start_at, go)), go)
+
+    async def _take_source(self, gm: GuildMusic, track: Track) -> tuple[discord.FFmpegOpusAudio, bool]:
+        prefetch = gm.prepared
+        if prefetch is not None and prefetch.track is track:
+            gm.prepared = None
+            prefetch.go.set()
+            try:
+                return await prefetch.task, True
+            except Exception:
+                log.warning("Prefetch of %r failed; resolving it again", track.title, exc_info=True)
+        gm.discard_prepared()
+        return await self._prepare(track, 0.0, asyncio.Event()), False
+
+    async def _play_loop(
+        self, guild: discord.Guild | None, voice: discord.VoiceClient, requested: Optional[float] = None
+    ) -> None:
         if guild is None:
             return
         gm = self.get_guild_music(guild.id)
+        since = requested or time.perf_counter()
         while gm.queue:
             track = gm.queue.pop(0)
             gm.now_playing = track
@@ -136,8 +267,10 @@ class Music(commands.Cog):
                     self.bot.dispatch("command_error", err)
                 self.bot.loop.call_soon_threadsafe(gm.play_next.set)
 
-            source = await discord.FFmpegOpusAudio.from_probe(track.url, **FFMPEG_OPTS)
-            voice.play(source, after=after_play)
+            source, prefetched = await self._take_source(gm, track)
+            voice.play(TimedSource(source, track, since, prefetched), after=after_play)
+            gm.started_at = time.monotonic()
+            self._prefetch_next(gm)
             channel = discord.utils.get(guild.text_channels, name="music") or guild.system_channel
             if channel:
                 try:
@@ -146,6 +279,8 @@ class Music(commands.Cog):
                     pass
             await gm.play_next.wait()
             gm.play_next.clear()
+            since = time.perf_counter()
+        gm.discard_prepared()
         gm.now_playing = None
 
     @app_commands.command(name="skip", description="Skip the current song")
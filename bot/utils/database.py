@@ -1,92 +1,436 @@
 from __future__ import annotations
 
-import os
+import asyncio
+import logging
+import queue
 import sqlite3
-from contextlib import contextmanager
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import Any, Callable, Iterable, Optional
 
 DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
 DB_PATH = DATA_DIR / "bot.db"
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv_store (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS game_stats (
+    user_id INTEGER,
+    game TEXT,
+    wins INTEGER DEFAULT 0,
+    losses INTEGER DEFAULT 0,
+    draws INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, game)
+);
+-- Guilds each player has played a game in, for per-guild leaderboards
+CREATE TABLE IF NOT EXISTS guild_players (
+    game TEXT,
+    guild_id INTEGER,
+    user_id INTEGER,
+    PRIMARY KEY (game, guild_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS guild_players_by_user ON guild_players (game, user_id);
+CREATE INDEX IF NOT EXISTS game_stats_by_wins ON game_stats (game, wins DESC, user_id);
+CREATE INDEX IF NOT EXISTS game_stats_by_winrate
+    ON game_stats (game, (CAST(wins AS REAL) / (wins + losses + draws)) DESC, user_id)
+    WHERE wins + losses + draws >= 10;
+"""
+# Games needed before a player is ranked by win rate; must match the
+# game_stats_by_winrate index above
+MIN_RATED_GAMES = 10
+# Leaderboard metrics: (score expression, filter for rows that are ranked)
+METRICS = {
+    "wins": ("wins", ""),
+    "winrate": ("CAST(wins AS REAL) / (wins + losses + draws)", f" AND wins + losses + draws >= {MIN_RATED_GAMES}"),
+}
 
-def _ensure_db() -> None:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS kv_store (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS game_stats (
-                user_id INTEGER,
-                game TEXT,
-                wins INTEGER DEFAULT 0,
-                losses INTEGER DEFAULT 0,
-                draws INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, game)
-            )
-            """
-        )
-        conn.commit()
+# Applied to every connection; journal_mode=WAL is persistent and is set
+# once in init_db()
+_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+_STATEMENT_CACHE = 64
+# Bound parameters per IN (...) query, well under SQLite's limit
+_IN_CHUNK = 500
 
+_RESULT_COLUMNS = {"win": "wins", "loss": "losses", "draw": "draws"}
+# One statement per column, so each stays in the connection's statement cache
+_BUMP_SQL = {
+    result: (
+        f"INSERT INTO game_stats(user_id, game, {col}) VALUES (?, ?, 1) "
+        f"ON CONFLICT(user_id, game) DO UPDATE SET {col} = {col} + 1"
+    )
+    for result, col in _RESULT_COLUMNS.items()
+}
 
-@contextmanager
-def _connect() -> Iterator[sqlite3.Connection]:
-    _ensure_db()
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        yield conn
-    finally:
-        conn.close()
+_SET_VALUE_SQL = "INSERT INTO kv_store(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+_ADD_STATS_SQL = (
+    "INSERT INTO game_stats(user_id, game, wins, losses, draws) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(user_id, game) DO UPDATE SET wins = wins + excluded.wins, "
+    "losses = losses + excluded.losses, draws = draws + excluded.draws"
+)
+_STATS_SQL = "SELECT wins, losses, draws FROM game_stats WHERE user_id = ? AND game = ?"
+_JOIN_GUILD_SQL = "INSERT OR IGNORE INTO guild_players(game, guild_id, user_id) VALUES (?, ?, ?)"
+_PLAYER_GUILDS_SQL = "SELECT guild_id FROM guild_players WHERE game = ? AND user_id = ?"
+
+FLUSH_INTERVAL = 0.5
+# Pending keys that trigger a flush before the interval is up
+FLUSH_PENDING = 1000
+
+log = logging.getLogger("database")
+
+# (user_id, game, (wins, losses, draws), guild_ids)
+StatUpdate = tuple[int, str, tuple[int, int, int], list[int]]
+
+_db_path: Optional[Path] = None
+_lock = threading.RLock()
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+# Bumped by close(), so threads drop connections that were closed under them
+_generation = 0
+
+
+def init_db(path: Optional[Path] = None) -> None:
+    """Create the data directory and schema and switch the file to WAL.
+
+    Runs once per process; later calls are no-ops unless a different path
+    is given.
+    """
+    global _db_path
+    path = Path(path or DB_PATH)
+    with _lock:
+        if _db_path == path:
+            return
+        close()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        _db_path = path
+
+
+def _connection() -> sqlite3.Connection:
+    # One persistent connection per thread: sqlite3 connections must not be
+    # shared across threads, and reusing them keeps the statement cache warm
+    cached = getattr(_local, "conn", None)
+    if cached is not None and cached[0] == _generation:
+        return cached[1]
+    with _lock:
+        if _db_path is None:
+            init_db()
+        conn = sqlite3.connect(_db_path, isolation_level=None, cached_statements=_STATEMENT_CACHE)
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        _connections.append(conn)
+        _local.conn = (_generation, conn)
+    return conn
+
+
+def close() -> None:
+    """Close every connection opened so far (e.g. on shutdown)."""
+    global _generation
+    with _lock:
+        conns = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # Opened by another thread; that thread replaces it on next use
+            pass
 
 
 def get_value(key: str) -> Optional[str]:
-    with _connect() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM kv_store WHERE key=?", (key,))
-        row = cur.fetchone()
-        return row[0] if row else None
+    row = _connection().execute("SELECT value FROM kv_store WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
 
 
 def set_value(key: str, value: str) -> None:
-    with _connect() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO kv_store(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-        conn.commit()
+    _connection().execute(_SET_VALUE_SQL, (key, value))
+
 
+def get_values(keys: Iterable[str]) -> dict[str, str]:
+    """Values for whichever of `keys` exist."""
+    keys = list(keys)
+    found: dict[str, str] = {}
+    conn = _connection()
+    for start in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[start:start + _IN_CHUNK]
+        sql = f"SELECT key, value FROM kv_store WHERE key IN ({','.join('?' * len(chunk))})"
+        found.update(conn.execute(sql, chunk))
+    return found
 
-def bump_game_stat(user_id: int, game: str, result: str) -> None:
-    if result not in ("win", "loss", "draw"):
+
+def set_values(values: dict[str, str]) -> None:
+    conn = _connection()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(_SET_VALUE_SQL, values.items())
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def bump_game_stat(user_id: int, game: str, result: str, guild_id: Optional[int] = None) -> None:
+    if result not in _RESULT_COLUMNS:
         raise ValueError("result must be one of: win, loss, draw")
-    col = {"win": "wins", "loss": "losses", "draw": "draws"}[result]
-    with _connect() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO game_stats(user_id, game, wins, losses, draws) VALUES (?, ?, 0, 0, 0) ON CONFLICT(user_id, game) DO NOTHING",
-            (user_id, game),
-        )
-        cur.execute(f"UPDATE game_stats SET {col} = {col} + 1 WHERE user_id = ? AND game = ?", (user_id, game))
-        conn.commit()
+    conn = _connection()
+    conn.execute(_BUMP_SQL[result], (user_id, game))
+    if guild_id is not None:
+        conn.execute(_JOIN_GUILD_SQL, (game, guild_id, user_id))
 
 
 def get_game_stats(user_id: int, game: str) -> tuple[int, int, int]:
-    with _connect() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT wins, losses, draws FROM game_stats WHERE user_id = ? AND game = ?",
-            (user_id, game),
+    row = _connection().execute(_STATS_SQL, (user_id, game)).fetchone()
+    if row:
+        return int(row[0]), int(row[1]), int(row[2])
+    return 0, 0, 0
+
+
+def _metric(metric: str) -> tuple[str, str]:
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of: {', '.join(METRICS)}")
+    return METRICS[metric]
+
+
+def top_players(
+    game: str, metric: str = "wins", limit: int = 10, guild_id: Optional[int] = None
+) -> list[tuple[int, int, int, int]]:
+    """(user_id, wins, losses, draws) for the best `limit` players, best first."""
+    score, ranked = _metric(metric)
+    if guild_id is None:
+        sql = (
+            f"SELECT user_id, wins, losses, draws FROM game_stats WHERE game = ?{ranked} "
+            f"ORDER BY {score} DESC, user_id LIMIT ?"
+        )
+        args: tuple = (game, limit)
+    else:
+        # CROSS JOIN keeps guild_players as the outer loop: without ANALYZE
+        # SQLite would rather walk the global score index and probe every row
+        sql = (
+            f"SELECT s.user_id, wins, losses, draws FROM guild_players p "
+            f"CROSS JOIN game_stats s ON s.user_id = p.user_id AND s.game = p.game "
+            f"WHERE p.game = ? AND p.guild_id = ?{ranked} ORDER BY {score} DESC, s.user_id LIMIT ?"
         )
-        row = cur.fetchone()
-        if row:
-            return int(row[0]), int(row[1]), int(row[2])
-        return 0, 0, 0
\ No newline at end of file
+        args = (game, guild_id, limit)
+    return [tuple(row) for row in _connection().execute(sql, args)]
+
+
+def player_rank(user_id: int, game: str, metric: str = "wins", guild_id: Optional[int] = None) -> Optional[int]:
+    """1-based rank (ties share a rank), or None if the player is not ranked."""
+    score, ranked = _metric(metric)
+    conn = _connection()
+    if guild_id is None:
+        row = conn.execute(f"SELECT {score} FROM game_stats WHERE user_id = ? AND game = ?{ranked}", (user_id, game)).fetchone()
+        if row is None:
+            return None
+        sql = f"SELECT COUNT(*) FROM game_stats WHERE game = ?{ranked} AND {score} > ?"
+        args: tuple = (game, row[0])
+    else:
+        row = conn.execute(
+            f"SELECT {score} FROM guild_players p CROSS JOIN game_stats s ON s.user_id = p.user_id AND s.game = p.game "
+            f"WHERE p.game = ? AND p.guild_id = ? AND p.user_id = ?{ranked}",
+            (game, guild_id, user_id),
+        ).fetchone()
+        if row is None:
+            return None
+        sql = (
+            f"SELECT COUNT(*) FROM guild_players p CROSS JOIN game_stats s ON s.user_id = p.user_id AND s.game = p.game "
+            f"WHERE p.game = ? AND p.guild_id = ?{ranked} AND {score} > ?"
+        )
+        args = (game, guild_id, row[0])
+    return conn.execute(sql, args).fetchone()[0] + 1
+
+
+class AsyncDatabase:
+    """Non-blocking access for async code, backed by one database thread.
+
+    Writes return at once: set_value keeps the last value per key and
+    bump_game_stat adds to an in-memory delta per (user, game), and the
+    thread flushes both in one transaction every FLUSH_INTERVAL seconds,
+    when FLUSH_PENDING keys are waiting, or on close(). Reads run on the
+    same thread and add whatever has not been flushed yet, so a caller
+    always sees its own writes.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, flush_pending: int = FLUSH_PENDING) -> None:
+        self.flush_interval = flush_interval
+        self.flush_pending = flush_pending
+        self._values: dict[str, str] = {}
+        self._stats: dict[tuple[int, str], list[int]] = {}
+        self._guilds: set[tuple[str, int, int]] = set()
+        self._listeners: list[Callable[[list[StatUpdate]], None]] = []
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="database", daemon=True)
+                self._thread.start()
+
+    def add_listener(self, listener: Callable[[list[StatUpdate]], None]) -> None:
+        """Call `listener` on the database thread after each flush with
+        (user_id, game, (wins, losses, draws), guild_ids) for every player
+        whose stats changed."""
+        self._listeners.append(listener)
+
+    async def run(self, func: Callable[[], Any], flush: bool = False) -> Any:
+        """Run `func` on the database thread, optionally after flushing."""
+        self.start()
+        future: Future = Future()
+        if flush:
+            self._queue.put((lambda: (self._flush(), func())[1], future))
+        else:
+            self._queue.put((func, future))
+        return await asyncio.wrap_future(future)
+
+    def _wake_if_full(self) -> None:
+        if len(self._values) + len(self._stats) >= self.flush_pending:
+            self._queue.put(None)
+
+    async def set_value(self, key: str, value: str) -> None:
+        self.start()
+        with self._lock:
+            self._values[key] = value
+            self._wake_if_full()
+
+    async def get_value(self, key: str) -> Optional[str]:
+        def read() -> Optional[str]:
+            with self._lock:
+                if key in self._values:
+                    return self._values[key]
+            return get_value(key)
+
+        return await self.run(read)
+
+    async def set_values(self, values: dict[str, str]) -> None:
+        self.start()
+        with self._lock:
+            self._values.update(values)
+            self._wake_if_full()
+
+    async def get_values(self, keys: Iterable[str]) -> dict[str, str]:
+        keys = list(keys)
+
+        def read() -> dict[str, str]:
+            found = get_values(keys)
+            with self._lock:
+                found.update((key, self._values[key]) for key in keys if key in self._values)
+            return found
+
+        return await self.run(read)
+
+    async def bump_game_stat(self, user_id: int, game: str, result: str, guild_id: Optional[int] = None) -> None:
+        if result not in _RESULT_COLUMNS:
+            raise ValueError("result must be one of: win, loss, draw")
+        self.start()
+        with self._lock:
+            delta = self._stats.setdefault((user_id, game), [0, 0, 0])
+            delta[("win", "loss", "draw").index(result)] += 1
+            if guild_id is not None:
+                self._guilds.add((game, guild_id, user_id))
+            self._wake_if_full()
+
+    async def get_game_stats(self, user_id: int, game: str) -> tuple[int, int, int]:
+        def read() -> tuple[int, int, int]:
+            # Only this thread flushes, so nothing is between the pending
+            # deltas and the table while it reads
+            wins, losses, draws = get_game_stats(user_id, game)
+            with self._lock:
+                delta = self._stats.get((user_id, game), (0, 0, 0))
+            return wins + delta[0], losses + delta[1], draws + delta[2]
+
+        return await self.run(read)
+
+    async def flush(self) -> None:
+        await self.run(self._flush)
+
+    async def close(self) -> None:
+        if self._thread is None:
+            return
+        await self.flush()
+        self._queue.put(_STOP)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, last_flush + self.flush_interval - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                return
+            if item is not None:
+                func, future = item
+                try:
+                    future.set_result(func())
+                except Exception as exc:
+                    future.set_exception(exc)
+            with self._lock:
+                full = len(self._values) + len(self._stats) >= self.flush_pending
+            if full or time.monotonic() - last_flush >= self.flush_interval:
+                try:
+                    self._flush()
+                except Exception:
+                    log.exception("Database flush failed; will retry")
+                last_flush = time.monotonic()
+
+    def _flush(self) -> None:
+        with self._lock:
+            values, self._values = self._values, {}
+            stats, self._stats = self._stats, {}
+            guilds, self._guilds = self._guilds, set()
+        if not values and not stats and not guilds:
+            return
+        conn = _connection()
+        updates: list[StatUpdate] = []
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(_SET_VALUE_SQL, values.items())
+            conn.executemany(_ADD_STATS_SQL, [(user, game, *delta) for (user, game), delta in stats.items()])
+            conn.executemany(_JOIN_GUILD_SQL, guilds)
+            if self._listeners:
+                for user, game in stats:
+                    totals = conn.execute(_STATS_SQL, (user, game)).fetchone()
+                    guild_ids = [row[0] for row in conn.execute(_PLAYER_GUILDS_SQL, (game, user))]
+                    updates.append((user, game, tuple(totals), guild_ids))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Put the batch back under anything written since
+            with self._lock:
+                self._values = {**values, **self._values}
+                self._guilds |= guilds
+                for key, delta in stats.items():
+                    pending = self._stats.setdefault(key, [0, 0, 0])
+                    for i, count in enumerate(delta):
+                        pending[i] += count
+            raise
+        for listener in self._listeners:
+            try:
+                listener(updates)
+            except Exception:
+                log.exception("Stats listener failed")
+
+
+_STOP = object()
+db = AsyncDatabase()
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from . import database
+from .database import db
+
+DEFAULT_MAX_ENTRIES = 4096
+
+# Cached marker for keys that are not in kv_store, so absent settings are
+# not looked up again on every message
+_MISSING = object()
+
+
+def make_key(*parts: object) -> str:
+    """Namespaced key, e.g. make_key("guild", guild_id, "music_channel")."""
+    return ":".join(str(part) for part in parts)
+
+
+class KVCache:
+    """Read-through cache over kv_store with LRU eviction and optional TTL.
+
+    Hits are answered from memory without awaiting anything. Misses for any
+    number of keys become one query on the database thread. Writes update
+    the cache at once. With write_behind the row is left to the async
+    writer's next batched flush; otherwise set() returns once it is
+    committed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: Optional[float] = None,
+        write_behind: bool = False,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.write_behind = write_behind
+        self._entries: OrderedDict[str, tuple[object, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def _lookup(self, key: str) -> object:
+        # Caller holds the lock. Returns the cached value, _MISSING for a
+        # cached absence, or None when the key has to be loaded.
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: object, fill: bool = False) -> None:
+        # Caller holds the lock. A load (fill=True) never replaces an entry
+        # written while it was in flight.
+        if fill and key in self._entries:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Cached value without loading; for code that cannot await."""
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is None or value is _MISSING else value  # type: ignore[return-value]
+
+    async def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = (await self.get_many([key])).get(key)
+        return default if value is None else value
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, str]:
+        """Values for whichever of `keys` exist."""
+        found: dict[str, str] = {}
+        missing: list[str] = []
+        with self._lock:
+            for key in keys:
+                value = self._lookup(key)
+                if value is None:
+                    missing.append(key)
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    if value is not _MISSING:
+                        found[key] = value  # type: ignore[assignment]
+        if missing:
+            loaded = await db.get_values(missing)
+            with self._lock:
+                for key in missing:
+                    self._store(key, loaded.get(key, _MISSING), fill=True)
+            found.update(loaded)
+        return found
+
+    async def set(self, key: str, value: str) -> None:
+        await self.set_many({key: value})
+
+    async def set_many(self, values: dict[str, str]) -> None:
+        if self.write_behind:
+            await db.set_values(values)
+        else:
+            values = dict(values)
+            # Flush first, so an older coalesced write of the same key
+            # cannot be committed after this one
+            await db.run(lambda: database.set_values(values), flush=True)
+        with self._lock:
+            for key, value in values.items():
+                self._store(key, value)
+
+    def invalidate(self, prefix: Optional[str] = None) -> None:
+        """Drop everything, or every key starting with `prefix`."""
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key.startswith(prefix)]:
+                    del self._entries[key]
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+settings = KVCache()
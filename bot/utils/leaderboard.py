@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from . import database
+from .database import METRICS, MIN_RATED_GAMES, db
+
+# Rows kept per board; more than is ever shown, so a few players dropping
+# out does not force a reload
+CACHE_SIZE = 50
+# Boards kept in memory (global and per-guild, per game and metric)
+MAX_BOARDS = 256
+
+Entry = tuple[int, int, int, int]
+
+
+def score(metric: str, wins: int, losses: int, draws: int) -> Optional[float]:
+    """Same value the SQL ranks by, or None when the player is not ranked."""
+    if metric == "wins":
+        return wins
+    games = wins + losses + draws
+    return wins / games if games >= MIN_RATED_GAMES else None
+
+
+class TopN:
+    """The best `capacity` rows of one leaderboard, best first.
+
+    Invariant: `entries` are exactly the leading rows of the table in rank
+    order. `complete` means the table has no other ranked rows. Updates keep
+    the invariant without touching the database: a player who now sorts
+    ahead of the last cached row is inserted, anyone else is dropped. When
+    too few rows remain the owner reloads the board.
+    """
+
+    def __init__(self, metric: str, rows: list[Entry], capacity: int) -> None:
+        self.metric = metric
+        self.capacity = capacity
+        self.entries = [tuple(row) for row in rows]
+        self.complete = len(self.entries) < capacity
+
+    def key(self, entry: Entry) -> tuple[float, int]:
+        return -score(self.metric, *entry[1:]), entry[0]  # type: ignore[operator]
+
+    def update(self, entry: Entry) -> None:
+        self.entries = [e for e in self.entries if e[0] != entry[0]]
+        if score(self.metric, *entry[1:]) is None:
+            return
+        if self.complete or (self.entries and self.key(entry) < self.key(self.entries[-1])):
+            bisect.insort(self.entries, entry, key=self.key)
+            if len(self.entries) > self.capacity:
+                del self.entries[self.capacity:]
+                self.complete = False
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Rank of a player on the board (ties share a rank), or None when
+        they are not on it. Exact, since every row that outscores a cached
+        row is cached too."""
+        for entry in self.entries:
+            if entry[0] == user_id:
+                best = score(self.metric, *entry[1:])
+                return 1 + sum(1 for e in self.entries if score(self.metric, *e[1:]) > best)  # type: ignore[operator]
+        return None
+
+
+class Leaderboards:
+    def __init__(self, capacity: int = CACHE_SIZE, max_boards: int = MAX_BOARDS) -> None:
+        self.capacity = capacity
+        self.max_boards = max_boards
+        self.boards: OrderedDict[tuple[str, str, Optional[int]], TopN] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def board(self, game: str, metric: str, limit: int, guild_id: Optional[int] = None) -> TopN:
+        # Runs on the database thread
+        key = (game, metric, guild_id)
+        with self.lock:
+            board = self.boards.get(key)
+            if board is not None:
+                self.boards.move_to_end(key)
+        if board is None or (not board.complete and len(board.entries) < limit):
+            rows = database.top_players(game, metric, max(limit, self.capacity), guild_id)
+            board = TopN(metric, rows, max(limit, self.capacity))
+            with self.lock:
+                self.boards[key] = board
+                while len(self.boards) > self.max_boards:
+                    self.boards.popitem(last=False)
+        return board
+
+    def top(self, game: str, metric: str, limit: int, guild_id: Optional[int] = None) -> list[Entry]:
+        return self.board(game, metric, limit, guild_id).entries[:limit]
+
+    def rank(self, user_id: int, game: str, metric: str, guild_id: Optional[int] = None) -> Optional[int]:
+        # Players on the cached board, global or per guild, are ranked from
+        # it; only those below it are counted in the database
+        board = self.board(game, metric, self.capacity, guild_id)
+        with self.lock:
+            found = board.rank(user_id)
+            if found is not None or board.complete:
+                return found
+        return database.player_rank(user_id, game, metric, guild_id)
+
+    def apply(self, updates: list[database.StatUpdate]) -> None:
+        # Flush listener: new totals for every player whose stats changed
+        with self.lock:
+            for user_id, game, totals, guild_ids in updates:
+                for scope in (None, *guild_ids):
+                    for metric in METRICS:
+                        board = self.boards.get((game, metric, scope))
+                        if board is not None:
+                            board.update((user_id, *totals))
+
+
+leaderboards = Leaderboards()
+db.add_listener(leaderboards.apply)
+
+
+async def top(game: str, metric: str = "wins", limit: int = 10, guild_id: Optional[int] = None) -> list[Entry]:
+    """Best players, served from the cache once pending stats are flushed."""
+    return await db.run(lambda: leaderboards.top(game, metric, limit, guild_id), flush=True)
+
+
+async def rank(user_id: int, game: str, metric: str = "wins", guild_id: Optional[int] = None) -> Optional[int]:
+    return await db.run(lambda: leaderboards.rank(user_id, game, metric, guild_id), flush=True)
@@ -0,0 +1,169 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Central side of a multi-host deployment. Every host runs panel.py in agent
+# mode; the central panel keeps a small pool of keep-alive connections per
+# agent, fans status queries out to all of them at once and places new
+# servers on the agent with the most room.
+
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS')
+# Holds placed-but-not-yet-running servers against a node's free memory
+PLACEMENT_HOLD = 120
+
+
+class AgentError(Exception):
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+class AgentClient:
+    def __init__(self, name, url, token=None, pool_size=8, timeout=10):
+        parts = urlsplit(url)
+        self.name = name
+        self.url = url
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.token = token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        while True:
+            conn, reused = self.connection()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                # A pooled connection the agent has since closed; safe to
+                # resend only if the request cannot have had an effect
+                if reused and method in IDEMPOTENT:
+                    continue
+                raise AgentError(f"Agent {self.name} unreachable: {e}")
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+            return response.status, response.getheaders(), data
+
+    def json(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        status, _headers, data = self.request(method, path, body, headers)
+        try:
+            return status, json.loads(data) if data else {}
+        except ValueError:
+            raise AgentError(f"Agent {self.name} sent an invalid response (HTTP {status})")
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Cluster:
+    def __init__(self, agents, token=None, timeout=10):
+        self.agents = {name: AgentClient(name, url, token, timeout=timeout) for name, url in agents.items()}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(32, len(self.agents))),
+                                           thread_name_prefix='panel-cluster')
+        self.holds = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse(spec):
+        # "node1=http://10.0.0.2:8080,node2=http://10.0.0.3:8080"
+        agents = {}
+        for item in (spec or '').split(','):
+            if item.strip():
+                name, _, url = item.strip().partition('=')
+                agents[name.strip()] = url.strip()
+        return agents
+
+    def agent(self, name):
+        agent = self.agents.get(name)
+        if agent is None:
+            raise AgentError(f"Unknown node {name}", 404)
+        return agent
+
+    def fan_out(self, method, path):
+        # Same request to every agent at once; failures are reported per node
+        def call(agent):
+            started = time.perf_counter()
+            try:
+                status, data = agent.json(method, path)
+            except AgentError as e:
+                return {'online': False, 'error': str(e)}
+            if status >= 400:
+                return {'online': True, 'error': data.get('error', f'HTTP {status}')}
+            return {'online': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 2), **data}
+
+        futures = {name: self.executor.submit(call, agent) for name, agent in self.agents.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def nodes(self):
+        return self.fan_out('GET', '/agent/node')
+
+    def held(self, node):
+        now = time.monotonic()
+        with self.lock:
+            holds = [(expires, memory) for expires, memory in self.holds.get(node, []) if expires > now]
+            self.holds[node] = holds
+        return sum(memory for _expires, memory in holds)
+
+    def place(self, memory_mb):
+        # Most free memory (after committed heaps and recent placements)
+        # combined with most idle CPU; nodes that cannot fit the heap are out
+        memory = memory_mb * 1024 * 1024
+        candidates = []
+        for name, node in self.nodes().items():
+            if not node.get('online') or 'memory' not in node:
+                continue
+            free = node['memory']['schedulable'] - self.held(name)
+            if free < memory:
+                continue
+            idle_cpu = max(0.0, 1 - node['load'][0] / node['cpus'])
+            score = (free - memory) / node['memory']['total'] + idle_cpu
+            candidates.append((score, name))
+        if not candidates:
+            raise AgentError(f"No node has {memory_mb} MB free", 503)
+        name = max(candidates)[1]
+        with self.lock:
+            self.holds.setdefault(name, []).append((time.monotonic() + PLACEMENT_HOLD, memory))
+        return name
+
+    def release(self, node, memory_mb):
+        memory = memory_mb * 1024 * 1024
+        with self.lock:
+            holds = self.holds.get(node, [])
+            for i, (_expires, held) in enumerate(holds):
+                if held == memory:
+                    del holds[i]
+                    return
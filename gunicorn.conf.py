@@ -0,0 +1,21 @@
+# Production serving for the panel:
+#
+#     gunicorn -c gunicorn.conf.py panel:app
+#
+# Without gunicorn installed, `PANEL_WORKERS=4 python panel.py` runs the
+# built-in pre-fork server with the same shared state.
+import os
+
+bind = f"{os.environ.get('PANEL_HOST', '0.0.0.0')}:{os.environ.get('PANEL_PORT', '80')}"
+workers = int(os.environ.get('PANEL_WORKERS', os.cpu_count() or 2))
+# Every open /events stream holds a thread for as long as the tab is open
+worker_class = 'gthread'
+threads = int(os.environ.get('PANEL_THREADS', 64))
+# Large upload chunks and downloads must not count as a hung worker
+timeout = 300
+
+
+def post_worker_init(worker):
+    import panel
+
+    panel.start_worker()
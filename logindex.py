@@ -0,0 +1,327 @@
+import gzip
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+# Searchable index over a server's rotated logs (logs/YYYY-MM-DD-N.log.gz).
+# Each archive is decompressed once, as a stream, into blocks of
+# BLOCK_LINES lines. A block is stored zlib-compressed next to its time
+# range, and every distinct token in it gets a posting. A search intersects
+# postings, drops blocks outside the time range and decompresses only the
+# blocks that are left.
+#
+# latest.log is indexed the same way, incrementally: like the log tailer,
+# it keeps the inode and the offset it has read up to, so a search only
+# reads what was written since the last one. Lines short of a full block
+# go into a tail block that the next call replaces.
+
+BLOCK_LINES = 256
+TOKEN_RE = re.compile(r'[a-z0-9_]{2,}')
+ARCHIVE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})-\d+\.log(\.gz)?$')
+TIME_RE = re.compile(r'^\[(\d{2}):(\d{2}):(\d{2})')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER,
+    lines INTEGER
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER,
+    first_line INTEGER,
+    start_ts REAL,
+    end_ts REAL,
+    data BLOB
+);
+CREATE INDEX IF NOT EXISTS blocks_time ON blocks (start_ts, end_ts);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT,
+    block_id INTEGER,
+    PRIMARY KEY (token, block_id)
+) WITHOUT ROWID;
+-- Read position in latest.log; offset is where tail_block starts and the
+-- clock columns are the LineClock state there
+CREATE TABLE IF NOT EXISTS live (
+    file_id INTEGER PRIMARY KEY,
+    dev INTEGER,
+    ino INTEGER,
+    offset INTEGER,
+    lines INTEGER,
+    tail_block INTEGER,
+    session_day REAL,
+    clock_base REAL,
+    clock_last REAL
+);
+"""
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def day_start(name):
+    match = ARCHIVE_RE.match(name)
+    if not match:
+        return None
+    return time.mktime(datetime.strptime(match.group(1), '%Y-%m-%d').timetuple())
+
+
+def session_day(mtime, elapsed):
+    # Midnight of the day a log session started. Its last line was written
+    # at about `mtime`, `elapsed` seconds after that midnight (rollovers
+    # included); rounding to the nearest midnight absorbs DST and trailing
+    # lines without a timestamp.
+    start = datetime.fromtimestamp(mtime - elapsed + (12 * 3600 if elapsed else 0))
+    return time.mktime(start.date().timetuple())
+
+
+class LineClock:
+    # Minecraft log lines only carry [HH:MM:SS]; the date comes from the file
+    # name and rolls over when the clock goes backwards past midnight.
+    # Continuation lines (stack traces) keep the previous timestamp.
+
+    def __init__(self, base, last=None):
+        self.base = base
+        self.last = base if last is None else last
+
+    def stamp(self, line):
+        match = TIME_RE.match(line)
+        if match:
+            h, m, s = (int(x) for x in match.groups())
+            ts = self.base + h * 3600 + m * 60 + s
+            if ts < self.last - 12 * 3600:
+                self.base += 86400
+                ts += 86400
+            self.last = ts
+        return self.last
+
+
+class LogIndex:
+    def __init__(self, logs_dir, db_path):
+        self.logs_dir = logs_dir
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def archives(self):
+        try:
+            with os.scandir(self.logs_dir) as it:
+                return sorted(e.name for e in it if e.is_file() and ARCHIVE_RE.match(e.name))
+        except FileNotFoundError:
+            return []
+
+    def refresh(self):
+        # Index archives that are new or changed since the last call. Rotated
+        # logs never change, so in steady state this is one scandir.
+        indexed = 0
+        with self.lock:
+            conn = self.connect()
+            known = {name: (size, mtime) for name, size, mtime in conn.execute('SELECT name, size, mtime_ns FROM files')}
+            for name in self.archives():
+                st = os.stat(os.path.join(self.logs_dir, name))
+                if known.get(name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                self.index_file(conn, name, st)
+                indexed += 1
+        return indexed
+
+    def index_file(self, conn, name, st):
+        path = os.path.join(self.logs_dir, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with conn:
+            row = conn.execute('SELECT id FROM files WHERE name = ?', (name,)).fetchone()
+            if row:
+                self.drop_file(conn, row[0])
+            file_id = conn.execute(
+                'INSERT INTO files (name, size, mtime_ns, lines) VALUES (?, ?, ?, 0)',
+                (name, st.st_size, st.st_mtime_ns),
+            ).lastrowid
+            clock = LineClock(day_start(name))
+            lines = []
+            start_ts = None
+            count = 0
+            with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    ts = clock.stamp(line)
+                    if start_ts is None:
+                        start_ts = ts
+                    lines.append(line.rstrip('\n'))
+                    if len(lines) >= BLOCK_LINES:
+                        self.add_block(conn, file_id, count, start_ts, ts, lines)
+                        count += len(lines)
+                        lines = []
+                        start_ts = None
+            if lines:
+                self.add_block(conn, file_id, count, start_ts, clock.last, lines)
+                count += len(lines)
+            conn.execute('UPDATE files SET lines = ? WHERE id = ?', (count, file_id))
+
+    def refresh_live(self, path):
+        name = os.path.basename(path)
+        with self.lock:
+            conn = self.connect()
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            row = conn.execute(
+                'SELECT f.id, f.size, l.dev, l.ino, l.offset, l.lines, l.tail_block, l.session_day, '
+                'l.clock_base, l.clock_last FROM files f JOIN live l ON l.file_id = f.id WHERE f.name = ?',
+                (name,),
+            ).fetchone()
+            if row and (st is None or (row[2], row[3]) != (st.st_dev, st.st_ino) or st.st_size < row[1]):
+                # Rotated away (its archive is indexed on its own) or truncated
+                with conn:
+                    self.drop_file(conn, row[0])
+                row = None
+            if st is None or (row and row[1] == st.st_size):
+                return
+            with conn:
+                self.index_live(conn, path, name, st, row)
+
+    def index_live(self, conn, path, name, st, row):
+        if row is None:
+            file_id = conn.execute(
+                'INSERT INTO files (name, size, mtime_ns, lines) VALUES (?, 0, ?, 0)', (name, st.st_mtime_ns)
+            ).lastrowid
+            offset, count, day = 0, 0, None
+            # Stamped relative to day 0 until the session's day is known below
+            clock = LineClock(0)
+        else:
+            file_id, _size, _dev, _ino, offset, count, tail, day, base, last = row
+            clock = LineClock(base, last)
+            if tail is not None:
+                self.drop_blocks(conn, [tail])
+        tail = None
+        lines = []
+        start_ts = None
+        block_offset = offset
+        saved_clock = (clock.base, clock.last)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    # Still being written
+                    break
+                offset += len(raw)
+                line = raw[:-1].decode('utf-8', errors='replace')
+                ts = clock.stamp(line)
+                if start_ts is None:
+                    start_ts = ts
+                lines.append(line)
+                if len(lines) >= BLOCK_LINES:
+                    self.add_block(conn, file_id, count, start_ts, ts, lines)
+                    count += len(lines)
+                    lines = []
+                    start_ts = None
+                    block_offset = offset
+                    saved_clock = (clock.base, clock.last)
+        if lines:
+            tail = self.add_block(conn, file_id, count, start_ts, clock.last, lines)
+        if day is None:
+            day = session_day(st.st_mtime, clock.last)
+            conn.execute('UPDATE blocks SET start_ts = start_ts + ?, end_ts = end_ts + ? WHERE file_id = ?',
+                         (day, day, file_id))
+            saved_clock = (saved_clock[0] + day, saved_clock[1] + day)
+        conn.execute('UPDATE files SET size = ?, mtime_ns = ?, lines = ? WHERE id = ?',
+                     (offset, st.st_mtime_ns, count + len(lines), file_id))
+        conn.execute(
+            'INSERT OR REPLACE INTO live (file_id, dev, ino, offset, lines, tail_block, session_day, clock_base, clock_last) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (file_id, st.st_dev, st.st_ino, block_offset, count, tail, day, *saved_clock),
+        )
+
+    def drop_file(self, conn, file_id):
+        self.drop_blocks(conn, [r[0] for r in conn.execute('SELECT id FROM blocks WHERE file_id = ?', (file_id,))])
+        conn.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        conn.execute('DELETE FROM live WHERE file_id = ?', (file_id,))
+
+    def drop_blocks(self, conn, block_ids):
+        # Postings are keyed by token first, so delete them by the block's
+        # own tokens rather than scanning for its id
+        for block_id in block_ids:
+            data = conn.execute('SELECT data FROM blocks WHERE id = ?', (block_id,)).fetchone()[0]
+            tokens = set(tokenize(zlib.decompress(data).decode('utf-8')))
+            conn.executemany('DELETE FROM postings WHERE token = ? AND block_id = ?',
+                             [(token, block_id) for token in tokens])
+            conn.execute('DELETE FROM blocks WHERE id = ?', (block_id,))
+
+    def add_block(self, conn, file_id, first_line, start_ts, end_ts, lines):
+        text = '\n'.join(lines)
+        block_id = conn.execute(
+            'INSERT INTO blocks (file_id, first_line, start_ts, end_ts, data) VALUES (?, ?, ?, ?, ?)',
+            (file_id, first_line, start_ts, end_ts, zlib.compress(text.encode('utf-8'), 6)),
+        ).lastrowid
+        conn.executemany(
+            'INSERT OR IGNORE INTO postings (token, block_id) VALUES (?, ?)',
+            [(token, block_id) for token in set(tokenize(text))],
+        )
+        return block_id
+
+    def candidate_blocks(self, conn, tokens, start, end):
+        blocks = None
+        # Rarest token first keeps the intersection small
+        counts = sorted((conn.execute('SELECT COUNT(*) FROM postings WHERE token = ?', (t,)).fetchone()[0], t) for t in tokens)
+        for count, token in counts:
+            if not count:
+                return []
+            ids = {r[0] for r in conn.execute('SELECT block_id FROM postings WHERE token = ?', (token,))}
+            blocks = ids if blocks is None else blocks & ids
+            if not blocks:
+                return []
+        query = ('SELECT b.id, f.name, b.first_line, b.start_ts, l.session_day FROM blocks b '
+                 'JOIN files f ON f.id = b.file_id LEFT JOIN live l ON l.file_id = f.id '
+                 'WHERE b.end_ts >= ? AND b.start_ts <= ?')
+        # Newest first; latest.log's blocks are always the newest
+        rows = conn.execute(query + ' ORDER BY b.end_ts DESC, b.id DESC', (start, end))
+        return [row for row in rows if blocks is None or row[0] in blocks]
+
+    def search(self, query, start=None, end=None, limit=200, live_path=None):
+        terms = [t for t in query.lower().split() if t]
+        tokens = sorted({t for term in terms for t in tokenize(term)})
+        # Terms with no indexable token (punctuation, single letters) fall back to substring matching
+        loose = [term for term in terms if not tokenize(term)]
+        start = start if start is not None else 0
+        end = end if end is not None else float('inf')
+
+        def matches(line):
+            lower = line.lower()
+            return set(tokens) <= set(tokenize(lower)) and all(term in lower for term in loose)
+
+        results = []
+        if live_path:
+            self.refresh_live(live_path)
+        self.refresh()
+        with self.lock:
+            conn = self.connect()
+            for block_id, name, first_line, block_start, live_day in self.candidate_blocks(conn, tokens, start, end):
+                if len(results) >= limit:
+                    break
+                data = conn.execute('SELECT data FROM blocks WHERE id = ?', (block_id,)).fetchone()[0]
+                # Resume the file's clock on the day this block started
+                base = day_start(name) if live_day is None else live_day
+                base += 86400 * int((block_start - base) // 86400)
+                clock = LineClock(base, block_start)
+                found = []
+                for offset, line in enumerate(zlib.decompress(data).decode('utf-8').split('\n')):
+                    ts = clock.stamp(line)
+                    if start <= ts <= end and matches(line):
+                        found.append({'file': name, 'line_no': first_line + offset, 'time': ts, 'line': line})
+                results.extend(reversed(found))
+        return results[:limit]
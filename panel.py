@@ -1,48 +1,2449 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from logindex import LogIndex
+from backup import BackupError, BackupStore
+from sharedstate import Leadership, SharedConsoleBuffer, SharedState
+from rcon import RconError, RconPool
+from cluster import AgentError, Cluster
+from scheduler import Scheduler, ScheduleError, SkipRun
 import os
 import subprocess
 import shutil
 import time
 import threading
 import re
+import json
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import signal
+import socket
+import fcntl
+import errno
+import hashlib
+import gzip
+import hmac
+import urllib.request
+import uuid
+import math
+from datetime import datetime
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-app = Flask(__name__)
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+app = Flask(__name__, template_folder='template')
+# All state (servers, pidfiles, caches, indexes, backups) lives under
+# PANEL_BASE_DIR, which defaults to the panel's own directory
+BASE_DIR = os.path.abspath(os.environ.get('PANEL_BASE_DIR') or os.path.dirname(__file__))
 SERVERS_DIR = os.path.join(BASE_DIR, 'servers')
+RUN_DIR = os.path.join(BASE_DIR, 'run')
+JAR_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'jars')
+UPLOADS_DIR = os.path.join(BASE_DIR, 'uploads')
+LOG_INDEX_DIR = os.path.join(BASE_DIR, 'index')
+BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'server-templates')
+SCHEDULES_PATH = os.path.join(BASE_DIR, 'schedules.json')
+STATE_DB = os.path.join(RUN_DIR, 'state.db')
+PAPER_API_URL = os.environ.get('PAPER_API_URL', 'https://api.papermc.io/v2').rstrip('/')
+
+STATUS_POLL_INTERVAL = 1
+STOP_TIMEOUT = 60
+KILL_TIMEOUT = 10
+JOB_WORKERS = int(os.environ.get('PANEL_JOB_WORKERS', 4))
+JOB_HISTORY = 200
+METRICS_INTERVAL = float(os.environ.get('PANEL_METRICS_INTERVAL', 5))
+METRICS_POINTS = int(os.environ.get('PANEL_METRICS_POINTS', 720))
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+LISTING_PAGE_SIZE = 200
+LISTING_CACHE_SIZE = 64
+USAGE_SETTLE = 2
+USAGE_SWEEP_INTERVAL = 600
+USAGE_TOP_DIRS = 50
+PREVIEW_BYTES = 64 * 1024
+PREVIEW_MAX_BYTES = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_TTL = 24 * 3600
+# Refused in uploaded file names, along with control characters
+UPLOAD_NAME_FORBIDDEN = set('/\\<>"')
+STREAM_BLOCK_SIZE = 1024 * 1024
+LOG_SEARCH_LIMIT = 200
+BACKUP_WORKERS = int(os.environ.get('PANEL_BACKUP_WORKERS', os.cpu_count() or 2))
+SAVE_TIMEOUT = 120
+# Scheduled actions allowed to run at the same time across all servers
+SCHEDULE_CONCURRENCY = int(os.environ.get('PANEL_SCHEDULE_CONCURRENCY', 2))
+SCHEDULE_ACTIONS = ('start', 'stop', 'restart', 'backup', 'command')
+CLONE_WORKERS = int(os.environ.get('PANEL_CLONE_WORKERS', 8))
+# Left out of clones and templates: rotated logs and per-run state
+CLONE_SKIP_DIRS = ('logs', 'crash-reports')
+CLONE_SKIP_FILES = ('session.lock', 'uid.dat')
+IMMUTABLE_SUFFIXES = ('.jar',)
+DEFAULT_SERVER_PORT = 25565
+DEFAULT_RCON_PORT = 25575
+INVENTORY_META_TTL = 5
+JAR_LATEST_TTL = 3600
+FICLONE = 0x40049409
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+SSE_KEEPALIVE = 15
+SSE_QUEUE_SIZE = 1000
+SSE_BATCH_LINES = 500
+CONSOLE_BUFFER_LINES = int(os.environ.get('PANEL_CONSOLE_LINES', 200))
+LOG_POLL_INTERVAL = 0.5
+LOG_PREFILL_BYTES = 256 * 1024
+PANEL_HOST = os.environ.get('PANEL_HOST', '0.0.0.0')
+PANEL_PORT = int(os.environ.get('PANEL_PORT', 80))
+PANEL_WORKERS = int(os.environ.get('PANEL_WORKERS', 1))
+# Werkzeug debugger (runs arbitrary code for whoever reaches it); for local
+# development only, and never in agent mode
+PANEL_DEBUG = os.environ.get('PANEL_DEBUG') == '1'
+# agent: this host is managed by a central panel (token required, keep-alive)
+PANEL_MODE = os.environ.get('PANEL_MODE', 'standalone')
+PANEL_AGENT_TOKEN = os.environ.get('PANEL_AGENT_TOKEN')
+# Set on the central panel: "node1=http://host:port,node2=..."
+PANEL_AGENTS = os.environ.get('PANEL_AGENTS', '')
+AGENT_TIMEOUT = float(os.environ.get('PANEL_AGENT_TIMEOUT', 10))
+DEFAULT_SERVER_MEMORY = 1024
+HEAP_RE = re.compile(r'-Xmx(\d+)([kKmMgG]?)')
+HEAP_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+COMPRESS_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_GZIP_LEVEL = 5
+COMPRESS_BROTLI_QUALITY = 4
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript')
+EVENT_POLL_INTERVAL = 0.1
+EVENT_RETENTION = 300
+COMMAND_WRITE_TIMEOUT = 5
+COMMAND_BATCH_LIMIT = 5000
+SCREEN_STUFF_BYTES = 512
+
+# Push stream state. Each open /events connection owns a Subscriber; the
+# tailer and the status watcher publish into every matching queue.
+subscribers = set()
+subscribers_lock = threading.Lock()
+status_wakeup = threading.Event()
+
+# Set by start_worker() when the panel runs as several processes; console
+# buffers, status and events then live in the shared database
+shared = None
+
+
+class ConsoleBuffer:
+    # Fixed-size ring of console lines. Every line gets the next sequence
+    # number, so readers can ask for "everything after seq N" and the
+    # buffer never has to shift or copy its contents.
+
+    def __init__(self, capacity=CONSOLE_BUFFER_LINES):
+        self.capacity = max(1, capacity)
+        self.lines = [None] * self.capacity
+        self.next_seq = 1
+        self.lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        return self.next_seq - 1
+
+    @property
+    def first_seq(self):
+        return max(1, self.next_seq - self.capacity)
+
+    def extend(self, lines):
+        with self.lock:
+            for line in lines:
+                self.lines[self.next_seq % self.capacity] = line
+                self.next_seq += 1
+            return self.last_seq
+
+    def since(self, seq=0):
+        with self.lock:
+            start = max(seq + 1, self.first_seq)
+            return [self.lines[i % self.capacity] for i in range(start, self.next_seq)], self.last_seq
+
 
 console_buffers = {}
+console_buffers_lock = threading.Lock()
+
+
+def get_console_buffer(server_name):
+    # Buffers are kept for the life of the process, so only for real servers
+    buffer = console_buffers.get(server_name)
+    if buffer is None:
+        if server_name not in list_server_names():
+            raise ServerError("Server not found", 404)
+        with console_buffers_lock:
+            buffer = console_buffers.setdefault(
+                server_name, SharedConsoleBuffer(shared, server_name) if shared else ConsoleBuffer()
+            )
+    return buffer
+
 
-def log_console_output(server_name):
-    log_path = os.path.join(SERVERS_DIR, server_name, 'logs', 'latest.log')
+class Subscriber:
+    def __init__(self, server):
+        self.server = server
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.dropped = False
+
+
+def publish(event, data, server=None):
+    if shared:
+        # Every worker's relay_events() picks it up, this one included
+        shared.publish(event, data, server)
+    else:
+        deliver(event, data, server)
+
+
+def deliver(event, data, server=None):
+    with subscribers_lock:
+        targets = list(subscribers)
+    for sub in targets:
+        if server is not None and sub.server != server:
+            continue
+        try:
+            sub.queue.put_nowait((event, data))
+        except queue.Full:
+            # A stalled client is cut off; EventSource reconnects and resyncs
+            sub.dropped = True
+
+
+def append_console(server_name, lines, position=None):
+    # position is the tailer's (inode, offset) after these lines; the shared
+    # buffer stores it with them so a new leader resumes from there
+    try:
+        buffer = get_console_buffer(server_name)
+    except ServerError:
+        # Deleted while its log was being read
+        return
+    seq = buffer.extend(lines, position) if shared else buffer.extend(lines)
+    publish('console', {'server': server_name, 'seq': seq, 'lines': lines}, server=server_name)
+
+
+def relay_events():
+    # Hands events from the shared database to this worker's subscribers
+    last_id = shared.last_event_id()
+    last_trim = time.monotonic()
     while True:
         try:
-            if not os.path.exists(log_path):
-                time.sleep(1)
+            for last_id, event, server, data in shared.events_since(last_id):
+                deliver(event, data, server)
+            if leadership.is_leader and time.monotonic() - last_trim > EVENT_RETENTION / 10:
+                last_trim = time.monotonic()
+                shared.trim_events(EVENT_RETENTION)
+        except Exception as e:
+            print(f"Event relay error: {str(e)}")
+        time.sleep(EVENT_POLL_INTERVAL)
+
+class Inotify:
+    # Minimal ctypes binding for inotify(7). Raises OSError on platforms
+    # without it so callers can fall back to polling.
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, mask, _cookie, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                events.append((wd, mask, os.fsdecode(name)))
+                offset += 16 + length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TailedLog:
+    # Read position in one server's logs/latest.log. Rotation (a new inode
+    # behind the same path) and in-place truncation both restart from 0.
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.path = os.path.join(SERVERS_DIR, server_name, 'logs', 'latest.log')
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+
+    def attach(self, prefill=0, resume=None):
+        # Startup: skip the existing file but hand back its last few lines.
+        # resume is a position() saved by a previous leader; lines before it
+        # were recorded already and are not handed back again.
+        try:
+            st = os.stat(self.path)
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        except FileNotFoundError:
+            return []
+        self.inode = (st.st_dev, st.st_ino)
+        self.offset = st.st_size
+        floor = 0
+        if resume and tuple(resume[0]) == self.inode and resume[1] <= st.st_size:
+            floor = resume[1]
+        if not prefill or st.st_size == floor:
+            return []
+        start = max(floor, st.st_size - LOG_PREFILL_BYTES)
+        tail = os.pread(self.fd, st.st_size - start, start).split(b'\n')
+        if start > floor:
+            # Started mid-line
+            tail = tail[1:]
+        if tail and tail[-1]:
+            self.partial = tail[-1]
+        return [self.decode(line) for line in tail[:-1][-prefill:]]
+
+    def position(self):
+        # End of the last complete line handed out
+        return self.inode, self.offset - len(self.partial)
+
+    def poll(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            lines = self.drain()
+            self.close()
+            return lines
+        lines = []
+        if self.fd is None or self.inode != (st.st_dev, st.st_ino):
+            # Rotated: finish whatever was left in the old file first
+            lines = self.drain()
+            self.close()
+            try:
+                self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+            except FileNotFoundError:
+                return lines
+            self.inode = (st.st_dev, st.st_ino)
+        elif st.st_size < self.offset:
+            self.offset = 0
+            self.partial = b''
+        return lines + self.drain()
+
+    def drain(self):
+        if self.fd is None:
+            return []
+        chunks = [self.partial]
+        while True:
+            chunk = os.pread(self.fd, 64 * 1024, self.offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self.offset += len(chunk)
+        parts = b''.join(chunks).split(b'\n')
+        self.partial = parts.pop()
+        return [self.decode(line) for line in parts]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+
+    @staticmethod
+    def decode(line):
+        return line.decode('utf-8', errors='replace').rstrip()
+
+
+class LogTailer:
+    # One thread tails every servers/*/logs/latest.log. With inotify it only
+    # wakes when something is written; otherwise it stats the files on a
+    # short interval.
+    ROOT_MASK = Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_ONLYDIR
+    SERVER_MASK = Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_ONLYDIR
+    LOGS_MASK = Inotify.IN_MODIFY | Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_MOVED_FROM | Inotify.IN_DELETE
+
+    def __init__(self, on_lines):
+        self.on_lines = on_lines
+        self.logs = {}
+        self.watches = {}
+        self.lock = threading.RLock()
+        self.inotify = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_r, self.wake_w = os.pipe()
+
+    def start(self):
+        try:
+            self.inotify = Inotify()
+            self.add_watch(SERVERS_DIR, 'root', None, self.ROOT_MASK)
+        except OSError as e:
+            print(f"inotify unavailable, polling logs instead: {str(e)}")
+            self.inotify = None
+        for name in list_server_names():
+            self.watch_server(name, prefill=CONSOLE_BUFFER_LINES)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        os.write(self.wake_w, b'x')
+
+    def add_watch(self, path, kind, server_name, mask):
+        if self.inotify is None:
+            return
+        try:
+            wd = self.inotify.add_watch(path, mask)
+        except FileNotFoundError:
+            return
+        self.watches[wd] = (kind, server_name)
+
+    def watch_server(self, server_name, prefill=None):
+        # prefill=None reads a new server's log from the start; a number
+        # attaches at the end of an existing log, keeping that many lines
+        with self.lock:
+            if server_name in self.logs:
+                return
+            log = self.logs[server_name] = TailedLog(server_name)
+            server_dir = os.path.join(SERVERS_DIR, server_name)
+            # Watch the server dir first so a logs/ dir created in between is not missed
+            self.add_watch(server_dir, 'server', server_name, self.SERVER_MASK)
+            self.add_watch(os.path.join(server_dir, 'logs'), 'logs', server_name, self.LOGS_MASK)
+            if prefill is None:
+                lines = log.poll()
+            else:
+                lines = log.attach(prefill, shared.log_position(server_name) if shared else None)
+            if lines:
+                self.on_lines(server_name, lines, log.position())
+
+    def unwatch_server(self, server_name):
+        with self.lock:
+            log = self.logs.pop(server_name, None)
+            if log:
+                log.close()
+            for wd, (_kind, name) in list(self.watches.items()):
+                if name == server_name:
+                    self.watches.pop(wd)
+                    self.inotify.remove_watch(wd)
+
+    def sync(self, server_name):
+        with self.lock:
+            log = self.logs.get(server_name)
+            lines = log.poll() if log else []
+            if lines:
+                self.on_lines(server_name, lines, log.position())
+
+    def sync_all(self):
+        names = set(list_server_names())
+        for name in set(self.logs) - names:
+            self.unwatch_server(name)
+        for name in names:
+            if name in self.logs:
+                self.sync(name)
+            else:
+                self.watch_server(name)
+
+    def handle_events(self, events):
+        dirty = set()
+        for wd, mask, name in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                self.sync_all()
+                continue
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            kind, server_name = self.watches.get(wd, (None, None))
+            if kind == 'root' and mask & Inotify.IN_ISDIR:
+                if name.startswith('.'):
+                    # Staging directories (restores, clones) are not servers
+                    continue
+                if mask & Inotify.IN_CREATE:
+                    self.watch_server(name)
+                elif mask & Inotify.IN_MOVED_TO:
+                    # A directory swapped in (e.g. a restore) brings an old log along
+                    self.watch_server(name, prefill=0)
+                else:
+                    self.unwatch_server(name)
+            elif kind == 'server' and name == 'logs':
+                self.add_watch(os.path.join(SERVERS_DIR, server_name, 'logs'), 'logs', server_name, self.LOGS_MASK)
+                dirty.add(server_name)
+            elif kind == 'logs' and name == 'latest.log':
+                dirty.add(server_name)
+        for server_name in dirty:
+            self.sync(server_name)
+
+    def run(self):
+        if self.inotify is None:
+            while not self.stop_event.wait(LOG_POLL_INTERVAL):
+                try:
+                    self.sync_all()
+                except Exception as e:
+                    print(f"Log error: {str(e)}")
+            return
+        poller = select.poll()
+        poller.register(self.inotify.fileno(), select.POLLIN)
+        poller.register(self.wake_r, select.POLLIN)
+        while not self.stop_event.is_set():
+            poller.poll()
+            try:
+                with self.lock:
+                    self.handle_events(self.inotify.read_events())
+            except Exception as e:
+                print(f"Log error: {str(e)}")
+
+
+def get_screen_sessions():
+    try:
+        output = subprocess.check_output(['screen', '-ls'], stderr=subprocess.STDOUT).decode()
+    except subprocess.CalledProcessError as e:
+        # screen exits non-zero when there are no sessions
+        output = e.output.decode() if e.output else ''
+    except FileNotFoundError:
+        return {}
+    return {name: int(pid) for pid, name in re.findall(r'\t(\d+)\.(\S+)\t', output)}
+
+def list_server_names():
+    return inventory.names()
+
+def read_proc_stat(pid):
+    # Returns (state, starttime in clock ticks) or None if the pid is gone
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            data = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    fields = data[data.rindex(b')') + 2:].split()
+    return fields[0].decode(), int(fields[19])
+
+def boot_time():
+    with open('/proc/stat') as f:
+        for line in f:
+            if line.startswith('btime '):
+                return int(line.split()[1])
+    return 0
+
+
+def read_properties(path):
+    props = {}
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                props[key.strip()] = value.strip()
+    return props
+
+
+def parse_heap(script):
+    # -Xmx in a start script as (value as written, e.g. "2G", bytes), or
+    # None if it sets none. Java honours the last one given.
+    matches = HEAP_RE.findall(script)
+    if not matches:
+        return None
+    digits, unit = matches[-1]
+    return digits + unit, int(digits) * HEAP_UNITS[unit.lower()]
+
+
+class ServerInventory:
+    # Cached listing of servers/. The directory is only rescanned when its
+    # mtime changes, and each server's port/memory settings are re-read at
+    # most every INVENTORY_META_TTL seconds and only if their files changed.
+    # `version` moves whenever anything visible in the listing does.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.server_names = []
+        self.meta = {}
+        self.meta_checked = 0
+        self.version = 0
+
+    def refresh(self):
+        try:
+            mtime = os.stat(SERVERS_DIR).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self.lock:
+            if mtime != self.mtime:
+                self.mtime = mtime
+                names = []
+                if mtime is not None:
+                    with os.scandir(SERVERS_DIR) as it:
+                        names = sorted(e.name for e in it if e.is_dir() and not e.name.startswith('.'))
+                if names != self.server_names:
+                    self.server_names = names
+                    self.version += 1
+                for name in set(self.meta) - set(names):
+                    del self.meta[name]
+            now = time.monotonic()
+            if now - self.meta_checked >= INVENTORY_META_TTL:
+                self.meta_checked = now
+                for name in self.server_names:
+                    self.refresh_meta(name)
+
+    def refresh_meta(self, name):
+        server_dir = os.path.join(SERVERS_DIR, name)
+        paths = (os.path.join(server_dir, 'server.properties'), os.path.join(server_dir, 'start.sh'))
+        key = []
+        for path in paths:
+            try:
+                key.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                key.append(None)
+        cached = self.meta.get(name)
+        if cached and cached[0] == key:
+            return
+        meta = {'port': DEFAULT_SERVER_PORT, 'memory': None}
+        if key[0] is not None:
+            try:
+                meta['port'] = int(read_properties(paths[0]).get('server-port', DEFAULT_SERVER_PORT))
+            except ValueError:
+                pass
+        if key[1] is not None:
+            with open(paths[1], errors='replace') as f:
+                heap = parse_heap(f.read())
+            meta['memory'] = heap[0] if heap else None
+        self.meta[name] = (key, meta)
+        self.version += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.mtime = None
+            self.meta_checked = 0
+
+    def names(self):
+        self.refresh()
+        return list(self.server_names)
+
+    def entries(self):
+        self.refresh()
+        with self.lock:
+            names = list(self.server_names)
+            meta = {name: self.meta.get(name, (None, {}))[1] for name in names}
+        # Status comes from server_infos(), so every worker reports what the
+        # leader recorded rather than its own (idle) supervisor
+        infos = server_infos(names)
+        entries = []
+        for name in names:
+            entry = {'name': name, 'port': meta[name].get('port'), 'memory': meta[name].get('memory')}
+            entry.update(infos[name])
+            entries.append(entry)
+        return entries
+
+    def etag(self):
+        self.refresh()
+        return f'inv-{self.version}-{status_version()}'
+
+
+class ServerError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def check_name(name, kind='server'):
+    # Server and template names become a directory under SERVERS_DIR or
+    # server-templates/, so they must stay a single visible path component
+    if (not isinstance(name, str) or not name or name.startswith('.')
+            or '/' in name or '\\' in name or not name.isprintable()):
+        raise ServerError(f"Invalid {kind} name")
+    return name
+
+
+def clone_file(src, dst, link=True):
+    # Reflink where the filesystem supports it, else hardlink, else copy.
+    # Files a server rewrites must not be hardlinked (link=False), or every
+    # copy would see the change.
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return 'reflink'
+        except OSError:
+            pass
+    if link:
+        os.remove(dst)
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def clone_tree(src, dst, progress=None):
+    # Copies a server directory at a cost that does not grow with the
+    # world where reflinks are available. Without them jars are hardlinked
+    # (they are only ever replaced, never edited) and everything else is
+    # copied. Logs and per-run lock files are left behind.
+    files = []
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel_dir = os.path.relpath(dirpath, src)
+        target = os.path.normpath(os.path.join(dst, rel_dir))
+        os.makedirs(target, exist_ok=True)
+        shutil.copymode(dirpath, target)
+        if rel_dir == '.':
+            dirnames[:] = [d for d in dirnames if d not in CLONE_SKIP_DIRS]
+        # os.walk does not descend into symlinked directories; recreate them
+        for d in [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            dirnames.remove(d)
+            filenames.append(d)
+        files.extend(os.path.normpath(os.path.join(rel_dir, f)) for f in filenames if f not in CLONE_SKIP_FILES)
+
+    def clone(rel):
+        source, target = os.path.join(src, rel), os.path.join(dst, rel)
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), target)
+            return 'symlink', 0, 0
+        size = os.path.getsize(source)
+        method = clone_file(source, target, link=rel.endswith(IMMUTABLE_SUFFIXES))
+        if method != 'hardlink':
+            shutil.copystat(source, target)
+        return method, size, size if method == 'copy' else 0
+
+    result = {'files': len(files), 'bytes': 0, 'bytes_copied': 0,
+              'reflink': 0, 'hardlink': 0, 'copy': 0, 'symlink': 0}
+    with ThreadPoolExecutor(max_workers=CLONE_WORKERS, thread_name_prefix='panel-clone') as pool:
+        for done, (method, size, copied) in enumerate(pool.map(clone, files), 1):
+            result[method] += 1
+            result['bytes'] += size
+            result['bytes_copied'] += copied
+            if progress and (done % 500 == 0 or done == len(files)):
+                progress(done / len(files), f"Cloned {done}/{len(files)} files")
+    return result
+
+
+def write_properties(path, updates):
+    # Rewrites the given keys in place, keeping comments and order, and
+    # appends any that are missing
+    updates = {key: str(value) for key, value in updates.items()}
+    lines = []
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                key = line.split('=', 1)[0].strip() if '=' in line and not line.lstrip().startswith('#') else None
+                if key in updates:
+                    line = f'{key}={updates.pop(key)}\n'
+                lines.append(line)
+    except FileNotFoundError:
+        pass
+    lines.extend(f'{key}={value}\n' for key, value in updates.items())
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    os.replace(tmp, path)
+
+
+port_lock = threading.Lock()
+
+def assign_ports(name, port=None):
+    # Gives a server a game port (and RCON/query ports where enabled) that
+    # no other server uses. Ports are read from disk rather than the
+    # inventory cache, under a lock, so concurrent clones never collide.
+    with port_lock:
+        used = set()
+        for other in os.listdir(SERVERS_DIR):
+            if other == name or other.startswith('.'):
                 continue
-                
-            with open(log_path, 'r') as f:
-                f.seek(0, 2)
+            try:
+                props = read_properties(os.path.join(SERVERS_DIR, other, 'server.properties'))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            ports = [props.get('server-port', DEFAULT_SERVER_PORT)]
+            if props.get('enable-rcon') == 'true':
+                ports.append(props.get('rcon.port', DEFAULT_RCON_PORT))
+            if props.get('enable-query') == 'true':
+                ports.append(props.get('query.port', DEFAULT_SERVER_PORT))
+            for value in ports:
+                try:
+                    used.add(int(value))
+                except ValueError:
+                    pass
+        if port is None:
+            port = DEFAULT_SERVER_PORT
+            while port in used:
+                port += 1
+        elif port in used:
+            raise ServerError(f"Port {port} is already used by another server")
+        path = os.path.join(SERVERS_DIR, name, 'server.properties')
+        updates = {'server-port': port, 'query.port': port}
+        if os.path.exists(path) and read_properties(path).get('enable-rcon') == 'true':
+            rcon_port = DEFAULT_RCON_PORT
+            while rcon_port in used or rcon_port == port:
+                rcon_port += 1
+            updates['rcon.port'] = rcon_port
+        write_properties(path, updates)
+        return updates
+
+
+class JarCache:
+    # Content-addressed store of server jars. Blobs live under
+    # sha256/<digest>.jar and index.json maps project/version/build to a
+    # digest, so each build is downloaded and verified exactly once.
+
+    def __init__(self, root, api_url):
+        self.root = root
+        self.api_url = api_url
+        self.index_path = os.path.join(root, 'index.json')
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.latest = {}
+        self.index = None
+
+    def load_index(self):
+        if self.index is None:
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.index = {}
+        return self.index
+
+    def save_index(self):
+        tmp = f'{self.index_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'sha256', f'{digest}.jar')
+
+    def api(self, path):
+        with urllib.request.urlopen(f'{self.api_url}/{path}', timeout=30) as response:
+            return json.load(response)
+
+    def resolve(self, project, version='latest', build='latest'):
+        key = (project, version, build)
+        cached = self.latest.get(key)
+        if cached and time.monotonic() - cached[0] < JAR_LATEST_TTL:
+            return cached[1]
+        if version == 'latest':
+            version = self.api(f'projects/{project}')['versions'][-1]
+        if build == 'latest':
+            info = self.api(f'projects/{project}/versions/{version}/builds')['builds'][-1]
+        else:
+            info = self.api(f'projects/{project}/versions/{version}/builds/{build}')
+        download = info['downloads']['application']
+        resolved = (version, str(info['build']), download['name'], download['sha256'])
+        self.latest[key] = (time.monotonic(), resolved)
+        return resolved
+
+    def cached_entry(self, project, version, build):
+        # Newest cached build matching the request, for when the API is unreachable
+        with self.lock:
+            entries = [
+                (key, entry) for key, entry in self.load_index().items()
+                if key.startswith(f'{project}/')
+                and version in ('latest', entry['version'])
+                and build in ('latest', entry['build'])
+            ]
+        if not entries:
+            return None
+        _key, entry = max(entries, key=lambda item: item[1]['fetched_at'])
+        return entry
+
+    def fetch(self, project='paper', version='latest', build='latest'):
+        if 'latest' not in (version, build):
+            with self.lock:
+                entry = self.load_index().get(f'{project}/{version}/{build}')
+            if entry and os.path.exists(self.blob_path(entry['sha256'])):
+                return self.blob_path(entry['sha256'])
+        try:
+            version, build, filename, digest = self.resolve(project, version, build)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            entry = self.cached_entry(project, version, build)
+            if entry is None:
+                raise ServerError(f"Failed to resolve {project} {version} build {build}: {e}", 500)
+            return self.blob_path(entry['sha256'])
+
+        key = f'{project}/{version}/{build}'
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # Concurrent creates of the same build wait for one download
+        with key_lock:
+            blob = self.blob_path(digest)
+            if not os.path.exists(blob):
+                url = f'{self.api_url}/projects/{project}/versions/{version}/builds/{build}/downloads/{filename}'
+                self.download(url, blob, digest)
+            with self.lock:
+                index = self.load_index()
+                if key not in index:
+                    index[key] = {'version': version, 'build': build, 'file': filename,
+                                  'sha256': digest, 'fetched_at': time.time()}
+                    self.save_index()
+        return blob
+
+    def download(self, url, blob, digest):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = f'{blob}.{threading.get_ident()}.part'
+        sha = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response, open(tmp, 'wb') as f:
                 while True:
-                    line = f.readline()
-                    if line:
-                        if server_name not in console_buffers:
-                            console_buffers[server_name] = []
-                        console_buffers[server_name].append(line.strip())
-                        if len(console_buffers[server_name]) > 200:
-                            console_buffers[server_name].pop(0)
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    f.write(chunk)
+            if sha.hexdigest() != digest:
+                raise ServerError(f"Checksum mismatch for {url}", 500)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, blob)
+        except OSError as e:
+            raise ServerError(f"Failed to download server jar: {e}", 500)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def install(self, dest, project='paper', version='latest', build='latest'):
+        return clone_file(self.fetch(project, version, build), dest)
+
+
+class ServerProcess:
+    def __init__(self, name, pid, starttime, started_at, proc=None):
+        self.name = name
+        self.pid = pid
+        self.starttime = starttime
+        self.started_at = started_at
+        self.proc = proc
+
+    def alive(self):
+        if self.proc is not None:
+            # waitpid(WNOHANG) for our own children; also reaps them
+            return self.proc.poll() is None
+        stat = read_proc_stat(self.pid)
+        return stat is not None and stat[0] not in ('Z', 'X') and stat[1] == self.starttime
+
+
+class Supervisor:
+    # Owns the process of every server. PIDs are recorded when a server is
+    # launched (and in run/<name>.pid so a restarted panel can re-adopt
+    # them); liveness is a waitpid or a /proc read, never a fork. Servers
+    # read their console from a FIFO (see CommandTransport); sessions
+    # adopted from screen keep working through screen.
+
+    def __init__(self):
+        self.processes = {}
+        self.states = {}
+        self.last_started = {}
+        self.version = 0
+        self.lock = threading.RLock()
+
+    def pidfile(self, name):
+        return os.path.join(RUN_DIR, f'{name}.pid')
+
+    def adopt_existing(self):
+        os.makedirs(RUN_DIR, exist_ok=True)
+        try:
+            with open(os.path.join(RUN_DIR, 'started.json')) as f:
+                self.last_started = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.last_started = {}
+        servers = list_server_names()
+        for name in servers:
+            try:
+                with open(self.pidfile(name)) as f:
+                    pid, starttime = (int(x) for x in f.read().split())
+            except (FileNotFoundError, ValueError):
+                continue
+            self.adopt(name, pid, starttime)
+        # Sessions started before the panel tracked PIDs; one screen -ls at startup
+        missing = [name for name in servers if name not in self.processes]
+        if missing:
+            sessions = get_screen_sessions()
+            for name in missing:
+                if name in sessions:
+                    stat = read_proc_stat(sessions[name])
+                    if stat:
+                        self.adopt(name, sessions[name], stat[1])
+        for name in servers:
+            self.states[name] = self.status(name)
+            self.record(name)
+
+    def adopt(self, name, pid, starttime):
+        record = ServerProcess(name, pid, starttime, boot_time() + starttime / CLOCK_TICKS)
+        if record.alive():
+            self.processes[name] = record
+            self.write_pidfile(record)
+        else:
+            self.remove_pidfile(name)
+
+    def write_pidfile(self, record):
+        with open(self.pidfile(record.name), 'w') as f:
+            f.write(f'{record.pid} {record.starttime}\n')
+
+    def remove_pidfile(self, name):
+        try:
+            os.remove(self.pidfile(name))
+        except FileNotFoundError:
+            pass
+
+    def get(self, name):
+        with self.lock:
+            record = self.processes.get(name)
+            if record is not None and not record.alive():
+                self.forget(name)
+                record = None
+            return record
+
+    def forget(self, name):
+        self.processes.pop(name, None)
+        self.remove_pidfile(name)
+        command_transport.forget(name)
+
+    def pid(self, name):
+        record = self.get(name)
+        return record.pid if record else None
+
+    def status(self, name):
+        return 'running' if self.get(name) else 'stopped'
+
+    def info(self, name):
+        record = self.get(name)
+        return {
+            'status': 'running' if record else 'stopped',
+            'pid': record.pid if record else None,
+            'started_at': record.started_at if record else None,
+            'last_started': self.last_started.get(name),
+        }
+
+    def start(self, name):
+        server_dir = os.path.join(SERVERS_DIR, check_name(name))
+        with self.lock:
+            if self.get(name):
+                raise ServerError("Server already running")
+            fifo = console_fifo(name)
+            if not os.path.exists(fifo):
+                os.mkfifo(fifo, 0o600)
+            # Opened read-write so the server never sees EOF on stdin, even
+            # while no panel holds the write end
+            stdin = os.open(fifo, os.O_RDWR)
+            try:
+                with open(os.path.join(RUN_DIR, f'{name}.out'), 'ab') as out:
+                    proc = subprocess.Popen(
+                        [os.path.join(server_dir, 'start.sh')],
+                        cwd=server_dir,
+                        stdin=stdin,
+                        stdout=out,
+                        stderr=subprocess.STDOUT,
+                        start_new_session=True,
+                    )
+            finally:
+                os.close(stdin)
+            stat = read_proc_stat(proc.pid)
+            record = ServerProcess(name, proc.pid, stat[1] if stat else 0, time.time(), proc)
+            self.processes[name] = record
+            self.write_pidfile(record)
+            self.last_started[name] = record.started_at
+            with open(os.path.join(RUN_DIR, 'started.json'), 'w') as f:
+                json.dump(self.last_started, f)
+            self.version += 1
+        self.check(name)
+        return record
+
+    def stop(self, name, timeout=None):
+        # SIGTERM, and with a timeout wait for the exit and escalate to SIGKILL.
+        # Returns True if the server had to be killed.
+        record = self.get(check_name(name))
+        if not record:
+            raise ServerError("Server not running")
+        self.signal(record, signal.SIGTERM)
+        if timeout is None or self.wait(name, timeout):
+            return False
+        try:
+            self.signal(record, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if not self.wait(name, KILL_TIMEOUT):
+            raise ServerError(f"Server {name} did not exit after SIGKILL", 500)
+        return True
+
+    def signal(self, record, sig):
+        # Servers run in their own session, so the whole group (start.sh and
+        # the java it spawned) gets the signal
+        try:
+            os.killpg(record.pid, sig)
+        except ProcessLookupError:
+            os.kill(record.pid, sig)
+
+    def wait(self, name, timeout):
+        deadline = time.monotonic() + timeout
+        while self.get(name):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        self.check(name)
+        return True
+
+    def check(self, name):
+        status = self.status(name)
+        if self.states.get(name) != status:
+            self.states[name] = status
+            self.version += 1
+            self.record(name)
+            publish('status', {'server': name, 'status': status})
+
+    def record(self, name):
+        if shared:
+            shared.set_status(name, self.info(name))
+
+    def statuses(self, names):
+        return {name: self.status(name) for name in names}
+
+
+def status_version():
+    return shared.status_version() if shared else supervisor.version
+
+
+def server_infos(names):
+    # Only the leader supervises processes; other workers read what it recorded
+    if not shared:
+        return {name: supervisor.info(name) for name in names}
+    recorded = shared.statuses()
+    stopped = {'status': 'stopped', 'pid': None, 'started_at': None, 'last_started': None}
+    return {name: recorded.get(name, stopped) for name in names}
+
+
+def watch_servers():
+    # Publishes server-list and status changes. Liveness comes from the
+    # supervisor, and the directory is only listed when its mtime moves.
+    last_servers = None
+    while True:
+        try:
+            servers = inventory.names()
+            if servers != last_servers:
+                last_servers = servers
+                publish('servers', {'servers': servers})
+            for name in servers:
+                supervisor.check(name)
+        except Exception as e:
+            print(f"Status watcher error: {str(e)}")
+        status_wakeup.wait(STATUS_POLL_INTERVAL)
+        status_wakeup.clear()
+
+class Job:
+    def __init__(self, kind, server, func):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.server = server
+        self.func = func
+        self.state = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def update(self, progress=None, message=None):
+        if progress is not None:
+            self.progress = progress
+        if message is not None:
+            self.message = message
+        publish('job', self.to_dict())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'server': self.server,
+            'state': self.state,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    # Bounded pool for slow work (downloads, process spawns, waiting for a
+    # server to exit). Jobs for the same server run strictly in submission
+    # order, so a stop and a restart can never race each other.
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='panel-job')
+        self.jobs = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, server, func):
+        job = Job(kind, server, func)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.state in ('queued', 'running'):
+                    break
+                self.jobs.popitem(last=False)
+            if server is not None and server in self.pending:
+                self.pending[server].append(job)
+            else:
+                if server is not None:
+                    self.pending[server] = deque()
+                self.executor.submit(self.run, job)
+        publish('job', job.to_dict())
+        return job
+
+    def run(self, job):
+        job.state = 'running'
+        job.started_at = time.time()
+        job.update()
+        try:
+            job.result = job.func(job)
+            job.state = 'done'
+            job.progress = 1.0
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.update()
+            job.finished.set()
+            if job.server is not None:
+                with self.lock:
+                    waiting = self.pending[job.server]
+                    if waiting:
+                        self.executor.submit(self.run, waiting.popleft())
                     else:
-                        time.sleep(0.1)
+                        del self.pending[job.server]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, server=None):
+        with self.lock:
+            return [job for job in self.jobs.values() if server is None or job.server == server]
+
+
+def run_control(name, action, job):
+    if action in ('stop', 'restart') and supervisor.get(name):
+        job.update(0.1, f"Stopping {name}")
+        if supervisor.stop(name, timeout=STOP_TIMEOUT):
+            job.update(0.5, f"{name} ignored SIGTERM for {STOP_TIMEOUT}s and was killed")
+    elif action == 'stop':
+        raise ServerError("Server not running")
+    if action in ('start', 'restart'):
+        job.update(0.6, f"Starting {name}")
+        record = supervisor.start(name)
+        return {'pid': record.pid}
+
+
+def provision_server(name, version, build, job, memory=DEFAULT_SERVER_MEMORY):
+    server_dir = os.path.join(SERVERS_DIR, name)
+    try:
+        job.update(0.1, f"Fetching {version} build {build}")
+        method = jar_cache.install(os.path.join(server_dir, 'server.jar'), version=version, build=build)
+
+        job.update(0.8, "Writing start script")
+        start_script = os.path.join(server_dir, 'start.sh')
+        with open(start_script, 'w') as f:
+            f.write(f'''#!/bin/bash
+cd "{server_dir}"
+java -Xmx{memory}M -jar server.jar nogui
+''')
+        os.chmod(start_script, 0o755)
+    except Exception:
+        shutil.rmtree(server_dir, ignore_errors=True)
+        inventory.invalidate()
+        status_wakeup.set()
+        raise
+
+    inventory.invalidate()
+    log_tailer.watch_server(name)
+    return {'jar': method}
+
+
+def rewrite_start_script(server_dir, old_dir):
+    # start.sh carries the absolute path of the directory it was written for
+    path = os.path.join(server_dir, 'start.sh')
+    try:
+        with open(path) as f:
+            script = f.read()
+    except FileNotFoundError:
+        return
+    if old_dir in script:
+        with open(path, 'w') as f:
+            f.write(script.replace(old_dir, server_dir))
+
+
+def clone_server(name, source_dir, job, port=None):
+    # Provisions a server from another server or a template. Only the tree
+    # is cloned, so nothing is downloaded or generated again.
+    server_dir = os.path.join(SERVERS_DIR, name)
+    try:
+        result = clone_tree(source_dir, server_dir,
+                            progress=lambda p, message: job.update(0.05 + 0.85 * p, message))
+        job.update(0.95, "Assigning ports")
+        rewrite_start_script(server_dir, source_dir)
+        result['ports'] = assign_ports(name, port)
+    except Exception:
+        shutil.rmtree(server_dir, ignore_errors=True)
+        inventory.invalidate()
+        status_wakeup.set()
+        raise
+
+    inventory.invalidate()
+    status_wakeup.set()
+    log_tailer.watch_server(name)
+    return result
+
+
+class TemplateStore:
+    # Named server trees under server-templates/, each with a <name>.json
+    # beside it. A template is taken from an existing server and new
+    # servers are cloned from it, so its jars, plugins and pregenerated
+    # world are shared instead of being fetched and generated per server.
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, check_name(name, 'template'))
+
+    def get(self, name):
+        path = self.path(name)
+        if not os.path.isdir(path):
+            raise ServerError("Template not found", 404)
+        try:
+            with open(f'{path}.json') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'name': name}
+
+    def list(self):
+        try:
+            names = sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return []
+        return [self.get(name) for name in names
+                if not name.startswith('.') and os.path.isdir(os.path.join(self.root, name))]
+
+    def create(self, name, server, job):
+        path = self.path(name)
+        if os.path.exists(path):
+            raise ServerError("Template already exists")
+        source_dir = os.path.join(SERVERS_DIR, server)
+        staging = os.path.join(self.root, f'.{name}.tmp')
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with saves_paused(server, job):
+                job.update(0.05, f"Copying {server}")
+                result = clone_tree(source_dir, staging,
+                                    progress=lambda p, message: job.update(0.05 + 0.9 * p, message))
+            os.rename(staging, path)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        rewrite_start_script(path, source_dir)
+        meta = {'name': name, 'source': server, 'created_at': time.time(),
+                'files': result['files'], 'bytes': result['bytes']}
+        with open(f'{path}.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+        return dict(meta, **result)
+
+    def delete(self, name):
+        path = self.path(name)
+        self.get(name)
+        # Renamed first so the template disappears at once, even while a
+        # large tree is still being removed
+        doomed = os.path.join(self.root, f'.{name}.{uuid.uuid4().hex}.deleted')
+        os.rename(path, doomed)
+        try:
+            os.remove(f'{path}.json')
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(doomed, ignore_errors=True)
+
+
+class MetricSeries:
+    # Fixed-size columnar ring of samples for one server. Every column is an
+    # array('d'), so an hour of 5s samples is a few dozen KB.
+    FIELDS = ('ts', 'cpu', 'rss', 'threads', 'fds', 'tps', 'mspt', 'lag_ms')
+
+    def __init__(self, capacity=METRICS_POINTS):
+        self.capacity = capacity
+        self.columns = {field: array('d', [math.nan]) * capacity for field in self.FIELDS}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, sample):
+        with self.lock:
+            index = self.count % self.capacity
+            for field, column in self.columns.items():
+                value = sample.get(field)
+                column[index] = math.nan if value is None else value
+            self.count += 1
+
+    def since(self, ts):
+        with self.lock:
+            start = max(0, self.count - self.capacity)
+            indexes = [i % self.capacity for i in range(start, self.count)]
+            indexes = [i for i in indexes if self.columns['ts'][i] >= ts]
+            return {
+                field: [None if math.isnan(column[i]) else column[i] for i in indexes]
+                for field, column in self.columns.items()
+            }
+
+    def latest(self):
+        with self.lock:
+            if not self.count:
+                return None
+            index = (self.count - 1) % self.capacity
+            return {field: None if math.isnan(column[index]) else column[index]
+                    for field, column in self.columns.items()}
+
+
+class MetricsSampler:
+    # Samples CPU time, RSS, threads and open fds of every running server's
+    # java process from /proc on one thread, and picks TPS / tick-time /
+    # lag figures out of the console lines the log tailer already reads.
+    TPS_RE = re.compile(r'TPS from last 1m, 5m, 15m: (.*)')
+    MSPT_HEADER = 'Server tick times (avg/min/max)'
+    NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+    LAG_RE = re.compile(r"Can't keep up!.*?Running (\d+)ms")
+    COLOR_RE = re.compile(r'\u00a7.')
+
+    def __init__(self):
+        self.series = {}
+        self.java_pids = {}
+        self.last_cpu = {}
+        self.console = {}
+        self.lock = threading.Lock()
+
+    def get_series(self, name):
+        with self.lock:
+            return self.series.setdefault(name, MetricSeries())
+
+    def observe_lines(self, name, lines):
+        state = self.console.setdefault(name, {'tps': None, 'mspt': None, 'lag_ms': None, 'mspt_next': False})
+        for line in lines:
+            if state['mspt_next']:
+                state['mspt_next'] = False
+                numbers = self.NUMBER_RE.findall(self.COLOR_RE.sub('', line.rsplit(':', 1)[-1]))
+                if numbers:
+                    state['mspt'] = float(numbers[0])
+                continue
+            if self.MSPT_HEADER in line:
+                state['mspt_next'] = True
+                continue
+            match = self.TPS_RE.search(line)
+            if match:
+                numbers = self.NUMBER_RE.findall(self.COLOR_RE.sub('', match.group(1)))
+                if numbers:
+                    state['tps'] = float(numbers[0])
+                continue
+            match = self.LAG_RE.search(line)
+            if match:
+                state['lag_ms'] = max(state['lag_ms'] or 0, float(match.group(1)))
+
+    def find_java(self, root_pid):
+        try:
+            with open(f'/proc/{root_pid}/comm', 'rb') as f:
+                if f.read().strip() == b'java':
+                    return root_pid
+        except OSError:
+            return None
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat', 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            comm = data[data.index(b'(') + 1:data.rindex(b')')]
+            ppid = int(data[data.rindex(b')') + 2:].split()[1])
+            children.setdefault(ppid, []).append((int(entry), comm))
+        stack = [root_pid]
+        while stack:
+            for pid, comm in children.get(stack.pop(), []):
+                if comm == b'java':
+                    return pid
+                stack.append(pid)
+        return None
+
+    def read_process(self, pid):
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            data = f.read()
+        if data[data.index(b'(') + 1:data.rindex(b')')] != b'java':
+            raise ProcessLookupError(pid)
+        fields = data[data.rindex(b')') + 2:].split()
+        return {
+            'cpu_ticks': int(fields[11]) + int(fields[12]),
+            'threads': int(fields[17]),
+            'rss': int(fields[21]) * PAGE_SIZE,
+            'fds': len(os.listdir(f'/proc/{pid}/fd')),
+        }
+
+    def sample(self, name, root_pid, now):
+        pid = self.java_pids.get(name)
+        try:
+            if pid is None:
+                raise ProcessLookupError
+            proc = self.read_process(pid)
+        except (OSError, ValueError):
+            pid = self.java_pids[name] = self.find_java(root_pid)
+            self.last_cpu.pop(name, None)
+            if pid is None:
+                return
+            proc = self.read_process(pid)
+        sample = {'ts': now, 'threads': proc['threads'], 'rss': proc['rss'], 'fds': proc['fds']}
+        last = self.last_cpu.get(name)
+        if last and now > last[0]:
+            sample['cpu'] = (proc['cpu_ticks'] - last[1]) / CLOCK_TICKS / (now - last[0]) * 100
+        self.last_cpu[name] = (now, proc['cpu_ticks'])
+        state = self.console.get(name)
+        if state:
+            sample.update(tps=state['tps'], mspt=state['mspt'], lag_ms=state['lag_ms'])
+            state['lag_ms'] = None
+        self.get_series(name).add(sample)
+
+    def run(self):
+        while True:
+            time.sleep(METRICS_INTERVAL)
+            now = time.time()
+            for name in list_server_names():
+                record = supervisor.get(name)
+                if record is None:
+                    self.java_pids.pop(name, None)
+                    self.last_cpu.pop(name, None)
+                    self.console.pop(name, None)
+                    continue
+                try:
+                    self.sample(name, record.pid, now)
+                except Exception as e:
+                    print(f"Metrics error for {name}: {str(e)}")
+
+
+def on_console_lines(server_name, lines, position=None):
+    append_console(server_name, lines, position)
+    metrics.observe_lines(server_name, lines)
+
+
+def resolve_server_path(server_name, rel_path=''):
+    # Maps a path from the file manager onto the server directory, refusing
+    # anything (.., absolute paths, symlinks) that escapes it
+    if server_name not in list_server_names():
+        raise ServerError("Server not found", 404)
+    root = os.path.realpath(os.path.join(SERVERS_DIR, server_name))
+    target = os.path.realpath(os.path.join(root, (rel_path or '').lstrip('/')))
+    if os.path.commonpath([root, target]) != root:
+        raise ServerError("Invalid path", 400)
+    return root, target
+
+
+class DirUsage:
+    __slots__ = ('parent', 'mtime_ns', 'version', 'wd', 'children',
+                 'own_size', 'own_disk', 'own_files', 'size', 'disk', 'files')
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.mtime_ns = None
+        self.version = 0
+        self.wd = None
+        self.children = set()
+        self.own_size = self.own_disk = self.own_files = 0
+        self.size = self.disk = self.files = 0
+
+    def to_dict(self):
+        return {'size': self.size, 'disk': self.disk, 'files': self.files}
+
+
+class DiskUsageIndex:
+    # Per-directory size totals for everything under servers/. Each
+    # directory is scanned once (its own files plus the totals of its
+    # subdirectories); after that, only directories that inotify reports
+    # as changed are re-read, and the difference is added to their
+    # ancestors. Minecraft grows region files in place without touching
+    # the directory mtime, so writes are watched too. Without inotify (or
+    # past the watch limit) changed directories are found by mtime when
+    # queried, and a slow background sweep re-reads file sizes.
+    MASK = (Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_CREATE | Inotify.IN_DELETE
+            | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_ONLYDIR)
+
+    def __init__(self, root):
+        # Real path, to match what resolve_server_path() hands out
+        self.root = os.path.realpath(root)
+        self.dirs = {}
+        self.watches = {}
+        self.dirty = set()
+        self.inotify = None
+        self.polling = True
+        self.ready = False
+        self.lock = threading.RLock()
+
+    def start(self):
+        try:
+            self.inotify = Inotify()
+            self.polling = False
+        except OSError as e:
+            print(f"inotify unavailable, checking disk usage by mtime instead: {str(e)}")
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def watch(self, path, node):
+        if self.inotify is None or self.polling:
+            return
+        try:
+            node.wd = self.inotify.add_watch(path, self.MASK)
+            self.watches[node.wd] = path
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # Out of inotify watches; mtime checks cover the rest
+                print(f"inotify watch limit reached, checking disk usage by mtime: {str(e)}")
+                self.polling = True
+
+    def read_dir(self, path, node):
+        # Re-reads one directory's own files; returns its subdirectory names
+        own_size = own_disk = own_files = 0
+        subdirs = set()
+        node.mtime_ns = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            for entry in it:
+                if path == self.root and entry.name.startswith('.'):
+                    # Restore and clone staging directories
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.name)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                own_size += st.st_size
+                own_disk += st.st_blocks * 512
+                own_files += 1
+        node.own_size, node.own_disk, node.own_files = own_size, own_disk, own_files
+        node.version += 1
+        return subdirs
+
+    def scan(self, path, parent):
+        # Indexes a whole subtree, depth first without recursion
+        top = DirUsage(parent)
+        order = []
+        stack = [(path, top)]
+        while stack:
+            dir_path, node = stack.pop()
+            self.dirs[dir_path] = node
+            self.watch(dir_path, node)
+            try:
+                node.children = self.read_dir(dir_path, node)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                node.children = set()
+            order.append((dir_path, node))
+            for name in node.children:
+                stack.append((os.path.join(dir_path, name), DirUsage(dir_path)))
+        for dir_path, node in reversed(order):
+            node.size, node.disk, node.files = node.own_size, node.own_disk, node.own_files
+            for name in node.children:
+                child = self.dirs.get(os.path.join(dir_path, name))
+                if child is not None:
+                    node.size += child.size
+                    node.disk += child.disk
+                    node.files += child.files
+        return top
+
+    def ensure(self, server_name):
+        # Servers are indexed one at a time at startup; a query for one
+        # that has not been reached yet indexes it right away
+        path = os.path.join(self.root, server_name)
+        with self.lock:
+            root = self.dirs.get(self.root)
+            if path in self.dirs or root is None or server_name not in root.children:
+                return
+            node = self.scan(path, self.root)
+            self.propagate(self.root, node.size, node.disk, node.files)
+
+    def drop(self, path):
+        # Forgets a subtree; returns the node that was removed
+        top = self.dirs.get(path)
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            node = self.dirs.pop(dir_path, None)
+            if node is None:
+                continue
+            if node.wd is not None and self.watches.pop(node.wd, None) is not None:
+                self.inotify.remove_watch(node.wd)
+            stack.extend(os.path.join(dir_path, name) for name in node.children)
+        return top
+
+    def propagate(self, path, size, disk, files):
+        while path is not None:
+            node = self.dirs.get(path)
+            if node is None:
+                return
+            node.size += size
+            node.disk += disk
+            node.files += files
+            path = node.parent
+
+    def refresh(self, path):
+        node = self.dirs.get(path)
+        if node is None:
+            return
+        old = (node.own_size, node.own_disk, node.own_files)
+        try:
+            subdirs = self.read_dir(path, node)
+        except (FileNotFoundError, NotADirectoryError):
+            # Gone; refreshing the parent removes it
+            return
+        self.propagate(path, node.own_size - old[0], node.own_disk - old[1], node.own_files - old[2])
+        for name in node.children - subdirs:
+            gone = self.drop(os.path.join(path, name))
+            if gone is not None:
+                self.propagate(path, -gone.size, -gone.disk, -gone.files)
+        added = subdirs - node.children
+        node.children = subdirs
+        for name in added:
+            if path == self.root and not self.ready:
+                # The startup pass will get to it
+                continue
+            child = self.scan(os.path.join(path, name), path)
+            self.propagate(path, child.size, child.disk, child.files)
+
+    def flush(self):
+        with self.lock:
+            if self.inotify is not None:
+                self.read_events()
+            dirty, self.dirty = self.dirty, set()
+        # Parents first, so a removed subtree is not re-read piecemeal. The
+        # lock is taken per directory so a long sweep does not stall queries.
+        for path in sorted(dirty, key=len):
+            with self.lock:
+                self.refresh(path)
+
+    def read_events(self):
+        for wd, mask, _name in self.inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                self.dirty.update(self.dirs)
+                continue
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            path = self.watches.get(wd)
+            if path is not None:
+                self.dirty.add(path)
+
+    def check_mtimes(self, path):
+        # Polling mode: directories whose mtime moved gained or lost entries
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            node = self.dirs.get(dir_path)
+            if node is None:
+                continue
+            try:
+                if os.stat(dir_path).st_mtime_ns != node.mtime_ns:
+                    self.dirty.add(dir_path)
+            except FileNotFoundError:
+                if node.parent is not None:
+                    self.dirty.add(node.parent)
+                continue
+            stack.extend(os.path.join(dir_path, name) for name in node.children)
+
+    def get(self, path):
+        # The directory's node, brought up to date first
+        rel = os.path.relpath(path, self.root)
+        if rel != '.':
+            self.ensure(rel.split(os.sep)[0])
+        with self.lock:
+            if self.polling:
+                self.check_mtimes(path)
+        self.flush()
+        return self.dirs.get(path)
+
+    def peek(self, path):
+        # Cached totals without touching the disk; None if not indexed yet
+        node = self.dirs.get(path)
+        return node.to_dict() if node is not None else None
+
+    def version(self, path):
+        node = self.dirs.get(path)
+        return node.version if node is not None else None
+
+    def usage(self, path, limit=USAGE_TOP_DIRS):
+        node = self.get(path)
+        if node is None:
+            return None
+        with self.lock:
+            children = []
+            for name in node.children:
+                child = self.dirs.get(os.path.join(path, name))
+                if child is not None:
+                    children.append({'name': name, **child.to_dict()})
+            result = {**node.to_dict(), 'own_files': node.own_files, 'own_disk': node.own_disk}
+        children.sort(key=lambda c: c['disk'], reverse=True)
+        return {**result, 'dirs': children[:limit], 'total_dirs': len(children)}
+
+    def run(self):
+        with self.lock:
+            root = self.dirs[self.root] = DirUsage(None)
+            self.watch(self.root, root)
+            root.children = self.read_dir(self.root, root)
+        while True:
+            with self.lock:
+                pending = sorted(n for n in root.children if os.path.join(self.root, n) not in self.dirs)
+                if not pending:
+                    self.ready = True
+                    break
+            for name in pending:
+                self.ensure(name)
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                if not self.polling:
+                    # Region files are written in bursts; let them settle
+                    select.select([self.inotify.fileno()], [], [])
+                    time.sleep(USAGE_SETTLE)
+                elif time.monotonic() - last_sweep >= USAGE_SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    with self.lock:
+                        self.dirty.update(self.dirs)
+                else:
+                    time.sleep(USAGE_SETTLE)
+                    if self.inotify is None:
+                        continue
+                self.flush()
+            except Exception as e:
+                print(f"Disk usage error: {str(e)}")
+
+
+class DirectoryListings:
+    # Small LRU of sorted directory listings keyed by the directory's mtime.
+    # Only names and types are cached (both free from scandir); sizes are
+    # stat'ed for the requested page alone, so paging through a region/
+    # directory with thousands of files never stats all of them. Sorting by
+    # size or mtime has to stat the whole directory (never the tree below
+    # it: directory sizes come from the disk usage index), and that result
+    # is kept until the index sees the directory change.
+
+    def __init__(self, size=LISTING_CACHE_SIZE):
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entries(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached and cached[0] == mtime:
+                self.cache.move_to_end(path)
+                return cached[1]
+        with os.scandir(path) as it:
+            entries = [(entry.name, entry.is_dir()) for entry in it]
+        entries.sort(key=lambda item: (not item[1], item[0].lower()))
+        self.remember(path, (mtime, entries))
+        return entries
+
+    def remember(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def describe(self, path, name, is_dir):
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            return None
+        if is_dir:
+            usage = disk_usage.peek(os.path.join(path, name))
+            size = usage['size'] if usage else None
+        else:
+            size = st.st_size
+        return {'name': name, 'is_dir': is_dir, 'size': size, 'mtime': st.st_mtime}
+
+    def described(self, path):
+        version = (os.stat(path).st_mtime_ns, disk_usage.version(path))
+        key = ('described', path)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and cached[0] == version and version[1] is not None:
+                self.cache.move_to_end(key)
+                return cached[1]
+        described = [d for d in (self.describe(path, name, is_dir) for name, is_dir in self.entries(path)) if d]
+        self.remember(key, (version, described))
+        return described
+
+    def page(self, path, offset, limit, sort='name', descending=False):
+        if sort in ('size', 'mtime'):
+            entries = sorted(self.described(path), key=lambda d: d[sort] or 0, reverse=descending)
+            return entries[offset:offset + limit], len(entries)
+        entries = self.entries(path)
+        if descending:
+            # Directories stay on top
+            entries = [e for e in entries if e[1]][::-1] + [e for e in entries if not e[1]][::-1]
+        contents = [d for d in (self.describe(path, name, is_dir) for name, is_dir in entries[offset:offset + limit]) if d]
+        return contents, len(entries)
+
+
+class Upload:
+    def __init__(self, upload_id, server, path, name, size, sha256=None, created_at=None):
+        self.id = upload_id
+        self.server = server
+        self.path = path
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.created_at = created_at or time.time()
+        self.hasher = None
+        self.hashed = 0
+        self.lock = threading.Lock()
+
+    @property
+    def part_path(self):
+        return os.path.join(UPLOADS_DIR, f'{self.id}.part')
+
+    @property
+    def meta_path(self):
+        return os.path.join(UPLOADS_DIR, f'{self.id}.json')
+
+    def received(self):
+        try:
+            return os.stat(self.part_path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'server': self.server,
+            'path': self.path,
+            'name': self.name,
+            'size': self.size,
+            'received': self.received(),
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+        }
+
+    def catch_up_hash(self):
+        # The running checksum lives in memory; after a panel restart it is
+        # rebuilt once from what is already on disk
+        if self.hasher is None:
+            self.hasher = hashlib.sha256()
+            self.hashed = 0
+        received = self.received()
+        if self.hashed < received:
+            with open(self.part_path, 'rb') as f:
+                f.seek(self.hashed)
+                while self.hashed < received:
+                    block = f.read(min(STREAM_BLOCK_SIZE, received - self.hashed))
+                    if not block:
+                        break
+                    self.hasher.update(block)
+                    self.hashed += len(block)
+
+
+class UploadManager:
+    # Chunked, resumable uploads. Chunks stream straight into
+    # uploads/<id>.part at the offset the client claims (which must match
+    # what is already on disk), and the finished file is renamed into the
+    # server directory only once every byte is there and verified.
+
+    def __init__(self):
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def create(self, server, path, name, size, sha256=None):
+        if (not name or name in ('.', '..') or not name.isprintable()
+                or UPLOAD_NAME_FORBIDDEN.intersection(name)):
+            raise ServerError("Invalid file name")
+        _root, target_dir = resolve_server_path(server, path)
+        if not os.path.isdir(target_dir):
+            raise ServerError("Upload directory does not exist", 404)
+        if size is None or size < 0:
+            raise ServerError("File size is required")
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        self.expire()
+        upload = Upload(uuid.uuid4().hex, server, path or '', name, size, (sha256 or '').lower() or None)
+        open(upload.part_path, 'wb').close()
+        with open(upload.meta_path, 'w') as f:
+            json.dump({'server': server, 'path': upload.path, 'name': name, 'size': size,
+                       'sha256': upload.sha256, 'created_at': upload.created_at}, f)
+        with self.lock:
+            self.uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id, server=None):
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+            raise ServerError("Upload not found", 404)
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                try:
+                    with open(os.path.join(UPLOADS_DIR, f'{upload_id}.json')) as f:
+                        meta = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    raise ServerError("Upload not found", 404)
+                upload = self.uploads[upload_id] = Upload(upload_id, **meta)
+        if server is not None and upload.server != server:
+            raise ServerError("Upload not found", 404)
+        return upload
+
+    def write_chunk(self, upload, offset, stream, length, chunk_sha256=None):
+        if length is None:
+            raise ServerError("Content-Length is required", 411)
+        if length > UPLOAD_MAX_CHUNK_SIZE:
+            raise ServerError("Chunk too large", 413)
+        if not upload.lock.acquire(blocking=False):
+            raise ServerError("Another chunk for this upload is in progress", 409)
+        try:
+            received = upload.received()
+            if offset != received:
+                raise ServerError(f"Expected offset {received}", 409)
+            if offset + length > upload.size:
+                raise ServerError("Chunk runs past the declared file size", 400)
+            upload.catch_up_hash()
+            chunk_hash = hashlib.sha256()
+            hasher = upload.hasher.copy()
+            written = 0
+            with open(upload.part_path, 'r+b') as f:
+                f.seek(offset)
+                try:
+                    while written < length:
+                        block = stream.read(min(STREAM_BLOCK_SIZE, length - written))
+                        if not block:
+                            break
+                        f.write(block)
+                        hasher.update(block)
+                        chunk_hash.update(block)
+                        written += len(block)
+                    bad_checksum = chunk_sha256 and chunk_hash.hexdigest() != chunk_sha256.lower()
+                    if written != length or bad_checksum:
+                        # Drop the partial chunk so the client can resend it from `offset`
+                        f.truncate(offset)
+                        raise ServerError("Chunk checksum mismatch" if bad_checksum else "Chunk was cut short", 400)
+                except OSError:
+                    f.truncate(offset)
+                    raise
+            upload.hasher = hasher
+            upload.hashed = offset + written
+            return upload.hashed
+        finally:
+            upload.lock.release()
+
+    def complete(self, upload, overwrite=False):
+        with upload.lock:
+            if upload.received() != upload.size:
+                raise ServerError(f"Upload incomplete: {upload.received()} of {upload.size} bytes", 409)
+            upload.catch_up_hash()
+            digest = upload.hasher.hexdigest()
+            if upload.sha256 and digest != upload.sha256:
+                raise ServerError("File checksum mismatch", 400)
+            _root, target_dir = resolve_server_path(upload.server, upload.path)
+            target = os.path.join(target_dir, upload.name)
+            if os.path.lexists(target):
+                if not os.path.isfile(target) or os.path.islink(target):
+                    raise ServerError("A directory or other non-file already has that name", 409)
+                if not overwrite:
+                    raise ServerError("File already exists", 409)
+            try:
+                os.replace(upload.part_path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # uploads/ is on another filesystem: copy next to the target,
+                # then swap it in
+                tmp = os.path.join(target_dir, f'.{upload.id}.part')
+                try:
+                    shutil.copyfile(upload.part_path, tmp)
+                    os.replace(tmp, target)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+            self.discard(upload)
+            return {'path': os.path.join(upload.path, upload.name), 'size': upload.size, 'sha256': digest}
+
+    def discard(self, upload):
+        with self.lock:
+            self.uploads.pop(upload.id, None)
+        for path in (upload.part_path, upload.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        # Idle time counts from the last chunk written (the .part mtime), so a
+        # slow upload that is still moving is never removed under the client
+        cutoff = time.time() - UPLOAD_TTL
+        mtimes = {}
+        with os.scandir(UPLOADS_DIR) as it:
+            for entry in it:
+                upload_id, ext = os.path.splitext(entry.name)
+                if ext in ('.json', '.part'):
+                    mtimes[upload_id] = max(mtimes.get(upload_id, 0), entry.stat().st_mtime)
+        for upload_id, mtime in mtimes.items():
+            if mtime >= cutoff:
+                continue
+            try:
+                upload = self.get(upload_id)
+            except ServerError:
+                continue
+            # Not while a chunk is being written
+            if upload.lock.acquire(blocking=False):
+                try:
+                    self.discard(upload)
+                finally:
+                    upload.lock.release()
+
+
+log_indexes = {}
+log_indexes_lock = threading.Lock()
+
+
+def get_log_index(server_name):
+    with log_indexes_lock:
+        index = log_indexes.get(server_name)
+        if index is None:
+            index = log_indexes[server_name] = LogIndex(
+                os.path.join(SERVERS_DIR, server_name, 'logs'),
+                os.path.join(LOG_INDEX_DIR, f'{server_name}.db'),
+            )
+        return index
+
+
+def index_all_logs():
+    # Catch up on archives rotated while the panel was down; searches pick
+    # up anything newer on demand
+    for name in list_server_names():
+        try:
+            get_log_index(name).refresh()
         except Exception as e:
-            print(f"Log error: {str(e)}")
-            time.sleep(1)
+            print(f"Log index error for {name}: {str(e)}")
+
 
-def get_screen_pid(server_name):
+def parse_time(value):
+    if not value:
+        return None
     try:
-        output = subprocess.check_output(['screen', '-ls'], stderr=subprocess.STDOUT).decode()
-        match = re.search(r'\t(\d+)\.%s\t' % server_name, output)
-        return match.group(1) if match else None
-    except subprocess.CalledProcessError:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ServerError(f"Invalid time: {value}")
+
+
+def parse_int(value, default, minimum=0, maximum=None):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    value = max(minimum, value)
+    return min(value, maximum) if maximum is not None else value
+
+
+def console_fifo(name):
+    return os.path.join(RUN_DIR, f'{name}.in')
+
+
+class CommandTransport:
+    # Delivers console commands without forking per command. Servers the
+    # panel launched read stdin from run/<name>.in, and the panel keeps one
+    # write end per server open; a batch is a single write. RCON (when the
+    # server enables it) returns each command's output and uses pooled
+    # connections. Sessions adopted from screen fall back to screen -X stuff.
+
+    def __init__(self):
+        self.writers = {}
+        self.lock = threading.Lock()
+        self.rcon = RconPool()
+
+    def stdin_writer(self, name, pid):
+        with self.lock:
+            writer = self.writers.get(name)
+            if writer and writer[0] == pid:
+                return writer[1]
+            if writer:
+                os.close(writer[1])
+                del self.writers[name]
+            fifo = console_fifo(name)
+            try:
+                # Only use the FIFO if it really is this process's stdin
+                if os.stat(f'/proc/{pid}/fd/0').st_ino != os.stat(fifo).st_ino:
+                    return None
+                fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                return None
+            self.writers[name] = (pid, fd)
+            return fd
+
+    def forget(self, name):
+        with self.lock:
+            writer = self.writers.pop(name, None)
+        if writer:
+            os.close(writer[1])
+
+    def write_stdin(self, name, fd, commands):
+        data = ''.join(f'{command}\n' for command in commands).encode('utf-8')
+        deadline = time.monotonic() + COMMAND_WRITE_TIMEOUT
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(fd, view):]
+            except BlockingIOError:
+                # The server is not reading; wait for room in the pipe
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([], [fd], [], remaining)[1]:
+                    raise ServerError(f"Server {name} is not reading its console", 503)
+            except OSError as e:
+                self.forget(name)
+                raise ServerError(f"Console pipe of {name} failed: {e}", 500)
+
+    def rcon_settings(self, name):
+        try:
+            props = read_properties(os.path.join(SERVERS_DIR, name, 'server.properties'))
+        except OSError:
+            return None
+        if props.get('enable-rcon') != 'true' or not props.get('rcon.password'):
+            return None
+        try:
+            port = int(props.get('rcon.port') or DEFAULT_RCON_PORT)
+        except ValueError:
+            return None
+        return '127.0.0.1', port, props['rcon.password']
+
+    def send(self, name, commands, transport='auto'):
+        # Returns (transport used, responses or None)
+        record = supervisor.get(check_name(name))
+        if not record:
+            raise ServerError("Server not running")
+        if transport in ('auto', 'stdin'):
+            fd = self.stdin_writer(name, record.pid)
+            if fd is not None:
+                self.write_stdin(name, fd, commands)
+                return 'stdin', None
+            if transport == 'stdin':
+                raise ServerError(f"Server {name} was not started with a console pipe")
+        if transport in ('auto', 'rcon'):
+            settings = self.rcon_settings(name)
+            if settings is not None:
+                try:
+                    with self.rcon.client(*settings) as client:
+                        return 'rcon', client.commands(commands)
+                except RconError as e:
+                    raise ServerError(str(e), 502)
+            if transport == 'rcon':
+                raise ServerError(f"RCON is not enabled for {name}")
+        if transport not in ('auto', 'screen'):
+            raise ServerError(f"Unknown transport {transport}")
+        self.stuff_screen(name, record.pid, commands)
+        return 'screen', None
+
+    def stuff_screen(self, name, pid, commands):
+        # One screen call per SCREEN_STUFF_BYTES of commands rather than per command
+        batch = ''
+        for command in commands:
+            if batch and len(batch) + len(command) >= SCREEN_STUFF_BYTES:
+                self.stuff(name, pid, batch)
+                batch = ''
+            batch += f'{command}\n'
+        if batch:
+            self.stuff(name, pid, batch)
+
+    def stuff(self, name, pid, text):
+        try:
+            subprocess.run(['screen', '-S', f'{pid}.{name}', '-X', 'stuff', text], check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ServerError(f"No console available for {name}: {e}", 500)
+
+
+def send_command(name, command):
+    return command_transport.send(name, [command])
+
+
+def wait_for_console(name, pattern, after_seq, timeout):
+    buffer = get_console_buffer(name)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lines, after_seq = buffer.since(after_seq)
+        if any(pattern in line for line in lines):
+            return True
+        time.sleep(0.2)
+    return False
+
+
+@contextmanager
+def saves_paused(name, job):
+    # save-off / save-all flush ... save-on around a read of a running
+    # server, so the world on disk is consistent and stays put meanwhile
+    running = supervisor.get(name) is not None
+    try:
+        if running:
+            job.update(0.02, "Flushing the world to disk")
+            seq = get_console_buffer(name).last_seq
+            send_command(name, 'save-off')
+            send_command(name, 'save-all flush')
+            if not wait_for_console(name, 'Saved the game', seq, SAVE_TIMEOUT):
+                raise ServerError(f"Server {name} did not confirm save-all within {SAVE_TIMEOUT}s", 500)
+        yield
+    finally:
+        if running and supervisor.get(name):
+            send_command(name, 'save-on')
+
+
+def backup_server(name, job):
+    with saves_paused(name, job):
+        job.update(0.05, "Taking snapshot")
+        return backups.snapshot(name, os.path.join(SERVERS_DIR, name),
+                                progress=lambda p, message: job.update(0.05 + 0.9 * p, message))
+
+
+def restore_server(name, snapshot_id, job):
+    if supervisor.get(name):
+        raise ServerError("Stop the server before restoring a snapshot")
+    job.update(0.0, f"Restoring {snapshot_id}")
+    result = backups.restore(name, snapshot_id, os.path.join(SERVERS_DIR, name),
+                             progress=lambda p, message: job.update(p, message))
+    inventory.invalidate()
+    return result
+
+
+def run_scheduled(task):
+    # Runs on one of the scheduler's workers and holds it until the job is
+    # over; that is what bounds how many scheduled actions run at once. The
+    # job goes through the normal queue, so it also waits its turn behind
+    # anything already queued for the server.
+    name, action = task['server'], task['action']
+    if name not in list_server_names():
+        raise SkipRun("Server no longer exists")
+    running = supervisor.get(name) is not None
+    if action in ('stop', 'restart', 'command') and not running:
+        raise SkipRun("Server not running")
+    if action == 'start' and running:
+        raise SkipRun("Server already running")
+    if action == 'backup':
+        job = jobs.submit('backup', name, lambda job: backup_server(name, job))
+    elif action == 'command':
+        job = jobs.submit('command', name, lambda job: dict(zip(
+            ('transport', 'responses'), command_transport.send(name, task['commands']))))
+    else:
+        job = jobs.submit(action, name, lambda job: run_control(name, action, job))
+    job.finished.wait()
+    if job.state == 'failed':
+        raise ServerError(job.error, 500)
+    return {'job': job.id, 'result': job.result}
+
+
+def format_sse(event, data, event_id=None):
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def parse_seq(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+def conditional(etag, build):
+    # 304 when the client already holds this version. `etag` comes from
+    # version counters, so an unchanged poll neither builds nor hashes a
+    # body. Compressed copies carry the encoding as a suffix.
+    for tag in (etag, *(f'{etag}-{encoding}' for encoding in COMPRESS_ENCODINGS)):
+        if request.if_none_match.contains(tag):
+            response = Response(status=304)
+            response.set_etag(tag)
+            break
+    else:
+        response = build()
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+@app.after_request
+def compress_response(response):
+    # Streams (SSE) and file responses pass through untouched
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+# Endpoints any worker can answer from the filesystem or the shared database.
+# Everything else needs the supervisor, jobs or in-memory caches of the leader.
+SHARED_ENDPOINTS = {
+    'static', 'home', 'list_servers', 'events', 'server_status', 'servers_status',
+    'file_manager', 'file_download', 'file_preview', 'server_backups', 'get_console',
+}
+
+@app.before_request
+def check_agent_token():
+    # Agents are driven by the central panel only
+    if PANEL_MODE != 'agent' or not PANEL_AGENT_TOKEN:
         return None
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied, f'Bearer {PANEL_AGENT_TOKEN}'):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+@app.before_request
+def forward_to_leader():
+    if not shared or leadership.is_leader or request.endpoint in SHARED_ENDPOINTS:
+        return None
+    # Upload chunks can be large, so the body is streamed through as-is
+    length = request.content_length
+    chunked = request.headers.get('Transfer-Encoding', '').lower() == 'chunked'
+    try:
+        status, headers, body = leadership.forward(
+            request.method, request.full_path, request.headers.items(),
+            request.stream if length or chunked else None, length,
+        )
+    except OSError as e:
+        return jsonify({"error": f"Leader unavailable: {e}"}), 503
+    return Response(body, status=status, headers=headers)
 
 @app.route('/')
 def home():
@@ -50,8 +2451,76 @@ def home():
 
 @app.route('/servers', methods=['GET'])
 def list_servers():
-    servers = [d for d in os.listdir(SERVERS_DIR) if os.path.isdir(os.path.join(SERVERS_DIR, d))]
-    return jsonify({"servers": servers})
+    def build():
+        entries = inventory.entries()
+        return jsonify({"servers": [e['name'] for e in entries], "inventory": entries})
+
+    return conditional(inventory.etag(), build)
+
+@app.route('/events')
+def events():
+    server = request.args.get('server') or None
+    if server is not None and server not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    # EventSource resends the last console seq it saw when it reconnects
+    since = parse_seq(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    sub = Subscriber(server)
+    with subscribers_lock:
+        subscribers.add(sub)
+
+    def stream():
+        try:
+            servers = list_server_names()
+            lines, sent_seq = get_console_buffer(server).since(since or 0) if server else ([], 0)
+            snapshot = {
+                'servers': servers,
+                'status': {name: info['status'] for name, info in server_infos(servers).items()},
+                'console': lines,
+                'seq': sent_seq,
+                'since': since,
+            }
+            yield format_sse('snapshot', snapshot, event_id=sent_seq if server else None)
+            while not sub.dropped:
+                try:
+                    event, data = sub.queue.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event != 'console':
+                    yield format_sse(event, data)
+                    continue
+                # Fold everything already queued into one console event so a
+                # chatty startup costs one write per wakeup, not one per line.
+                # Lines already covered by the snapshot are skipped by seq.
+                lines = []
+                pending = []
+                item = (event, data)
+                while True:
+                    if item[0] != 'console':
+                        pending.append(item)
+                    elif item[1]['seq'] > sent_seq:
+                        # Batches carry the seq of their last line
+                        fresh = item[1]['seq'] - sent_seq
+                        lines.extend(item[1]['lines'][-fresh:])
+                        sent_seq = item[1]['seq']
+                    if len(lines) >= SSE_BATCH_LINES:
+                        break
+                    try:
+                        item = sub.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if lines:
+                    yield format_sse('console', {'server': server, 'seq': sent_seq, 'lines': lines}, event_id=sent_seq)
+                for event, data in pending:
+                    yield format_sse(event, data)
+        finally:
+            with subscribers_lock:
+                subscribers.discard(sub)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/server/create', methods=['POST'])
 def server_create():
@@ -60,38 +2529,51 @@ def server_create():
         name = data.get('name')
         if not name:
             return jsonify({"error": "Server name is required"}), 400
+        check_name(name)
 
         server_dir = os.path.join(SERVERS_DIR, name)
+        # Reserve the name now; the download and setup run as a job
         os.makedirs(server_dir, exist_ok=False)
+        inventory.invalidate()
+        status_wakeup.set()
 
-        jar_path = os.path.join(server_dir, 'server.jar')
-        subprocess.run([
-            'wget', '-q', '-O', jar_path,
-            'https://papermc.io/api/v2/projects/paper/versions/latest/builds/latest/downloads/paper-latest.jar'
-        ], check=True)
+        if data.get('template'):
+            try:
+                source_dir = templates.path(data['template'])
+                templates.get(data['template'])
+            except ServerError:
+                os.rmdir(server_dir)
+                inventory.invalidate()
+                raise
+            port = parse_int(data.get('port'), None, 1)
+            job = jobs.submit('create', name, lambda job: clone_server(name, source_dir, job, port))
+            return jsonify({"message": f"Server {name} is being created from {data['template']}",
+                            "job": job.to_dict()}), 202
 
-        start_script = os.path.join(server_dir, 'start.sh')
-        with open(start_script, 'w') as f:
-            f.write(f'''#!/bin/bash
-cd "{server_dir}"
-java -Xmx1G -jar server.jar nogui
-''')
-        os.chmod(start_script, 0o755)
+        version = data.get('version') or 'latest'
+        build = str(data.get('build') or 'latest')
+        memory = parse_int(data.get('memory'), DEFAULT_SERVER_MEMORY, 256)
+        job = jobs.submit('create', name, lambda job: provision_server(name, version, build, job, memory))
+        return jsonify({"message": f"Server {name} is being created", "job": job.to_dict()}), 202
 
-        threading.Thread(target=log_console_output, args=(name,), daemon=True).start()
-        return jsonify({"message": f"Server {name} created"})
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
 
     except FileExistsError:
         return jsonify({"error": "Server already exists"}), 400
-    except subprocess.CalledProcessError:
-        shutil.rmtree(server_dir, ignore_errors=True)
-        return jsonify({"error": "Failed to download server jar"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/server/status/<name>')
 def server_status(name):
-    return jsonify({'status': 'running' if get_screen_pid(name) else 'stopped'})
+    return conditional(f'st-{status_version()}',
+                       lambda: jsonify({'status': server_infos([name])[name]['status']}))
+
+@app.route('/servers/status')
+def servers_status():
+    names = list_server_names()
+    return conditional(f'sts-{inventory.etag()}-{status_version()}',
+                       lambda: jsonify({'servers': server_infos(names)}))
 
 @app.route('/server/control', methods=['POST'])
 def server_control():
@@ -103,72 +2585,612 @@ def server_control():
         if not name or not action:
             return jsonify({"error": "Missing parameters"}), 400
 
-        server_dir = os.path.join(SERVERS_DIR, name)
-        if not os.path.exists(server_dir):
+        check_name(name)
+        if name not in list_server_names():
             return jsonify({"error": "Server not found"}), 404
 
-        pid = get_screen_pid(name)
-        
-        if action == "start":
-            if pid:
-                return jsonify({"error": "Server already running"}), 400
-            subprocess.Popen(
-                ['screen', '-dmS', name, os.path.join(server_dir, 'start.sh')],
-                cwd=server_dir
-            )
-            return jsonify({"message": f"Server {name} started"})
-
-        elif action == "stop":
-            if not pid:
-                return jsonify({"error": "Server not running"}), 400
-            subprocess.run(['kill', pid], check=True)
-            return jsonify({"message": f"Server {name} stopped"})
-
-        elif action == "restart":
-            if pid:
-                subprocess.run(['kill', pid], check=True)
-            subprocess.Popen(
-                ['screen', '-dmS', name, os.path.join(server_dir, 'start.sh')],
-                cwd=server_dir
-            )
-            return jsonify({"message": f"Server {name} restarted"})
+        if action not in ("start", "stop", "restart"):
+            return jsonify({"error": "Invalid action"}), 400
 
-        return jsonify({"error": "Invalid action"}), 400
+        job = jobs.submit(action, name, lambda job: run_control(name, action, job))
+        return jsonify({"message": f"Server {name} {action} queued", "job": job.to_dict()}), 202
 
-    except subprocess.CalledProcessError as e:
-        return jsonify({"error": str(e)}), 500
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/server/metrics/<name>')
+def server_metrics(name):
+    try:
+        window = float(request.args.get('range', 900))
+    except ValueError:
+        return jsonify({"error": "range must be a number of seconds"}), 400
+    series = metrics.series.get(name)
+    samples = series.since(time.time() - window) if series else {field: [] for field in MetricSeries.FIELDS}
+    return jsonify({'server': name, 'interval': METRICS_INTERVAL, 'samples': samples})
+
+@app.route('/servers/metrics')
+def servers_metrics():
+    latest = {}
+    for name in list_server_names():
+        series = metrics.series.get(name)
+        latest[name] = series.latest() if series else None
+    return jsonify({'servers': latest})
+
+@app.route('/files')
+def file_manager():
+    return render_template('file_manager.html')
+
+@app.route('/file/list/<server>')
+def file_list(server):
+    try:
+        root, path = resolve_server_path(server, request.args.get('path'))
+        if not os.path.isdir(path):
+            return jsonify({"error": "Not a directory"}), 400
+        offset = parse_int(request.args.get('offset'), 0)
+        limit = parse_int(request.args.get('limit'), LISTING_PAGE_SIZE, 1, 1000)
+        sort = request.args.get('sort', 'name')
+        if sort not in ('name', 'size', 'mtime'):
+            return jsonify({"error": "sort must be name, size or mtime"}), 400
+        descending = request.args.get('order') == 'desc'
+        contents, total = listings.page(path, offset, limit, sort, descending)
+        rel_path = os.path.relpath(path, root)
+        return jsonify({
+            'path': '' if rel_path == '.' else rel_path,
+            'contents': contents,
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+        })
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    except FileNotFoundError:
+        return jsonify({"error": "Path not found"}), 404
+
+@app.route('/server/usage/<name>')
+def server_usage(name):
+    try:
+        root, path = resolve_server_path(name, request.args.get('path'))
+        if not os.path.isdir(path):
+            return jsonify({"error": "Not a directory"}), 400
+        limit = parse_int(request.args.get('limit'), USAGE_TOP_DIRS, 1, 1000)
+        usage = disk_usage.usage(path, limit)
+        if usage is None:
+            return jsonify({"error": "Path not found"}), 404
+        rel_path = os.path.relpath(path, root)
+        return jsonify({'server': name, 'path': '' if rel_path == '.' else rel_path, **usage})
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+def read_meminfo():
+    info = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            info[key] = int(value.split()[0]) * 1024
+    return info
+
+def server_heap(name):
+    # Bytes of -Xmx in the server's start.sh, or None if it sets none
+    try:
+        with open(os.path.join(SERVERS_DIR, name, 'start.sh'), errors='replace') as f:
+            heap = parse_heap(f.read())
+    except OSError:
+        return None
+    return heap[1] if heap else None
+
+@app.route('/agent/node')
+def agent_node():
+    # Everything the central panel needs about this host in one round trip:
+    # server status plus the resources placement decides on
+    servers = server_infos(list_server_names())
+    meminfo = read_meminfo()
+    # Running JVMs grow towards their -Xmx; the part not resident yet is
+    # still spoken for
+    committed = 0
+    for name, info in servers.items():
+        if info['status'] != 'running':
+            continue
+        heap = server_heap(name) or DEFAULT_SERVER_MEMORY * 1024 * 1024
+        series = metrics.series.get(name)
+        latest = series.latest() if series else None
+        rss = (latest or {}).get('rss') or 0
+        committed += max(0, heap - int(rss))
+    disk = shutil.disk_usage(SERVERS_DIR)
+    return jsonify({
+        'node': socket.gethostname(),
+        'cpus': os.cpu_count() or 1,
+        'load': os.getloadavg(),
+        'memory': {
+            'total': meminfo['MemTotal'],
+            'available': meminfo['MemAvailable'],
+            'committed': committed,
+            'schedulable': max(0, meminfo['MemAvailable'] - committed),
+        },
+        'disk': {'total': disk.total, 'free': disk.free},
+        'servers': servers,
+    })
+
+@app.route('/cluster/nodes')
+def cluster_nodes():
+    if cluster is None:
+        return jsonify({"error": "No agents configured (PANEL_AGENTS)"}), 404
+    return jsonify({'nodes': cluster.nodes()})
+
+@app.route('/cluster/servers')
+def cluster_servers():
+    if cluster is None:
+        return jsonify({"error": "No agents configured (PANEL_AGENTS)"}), 404
+    nodes = cluster.nodes()
+    return jsonify({
+        'servers': [
+            {'node': node, 'name': name, **info}
+            for node, summary in nodes.items() for name, info in summary.get('servers', {}).items()
+        ],
+        'nodes': {node: {k: v for k, v in summary.items() if k != 'servers'} for node, summary in nodes.items()},
+    })
+
+@app.route('/cluster/server/create', methods=['POST'])
+def cluster_create():
+    if cluster is None:
+        return jsonify({"error": "No agents configured (PANEL_AGENTS)"}), 404
+    data = request.get_json()
+    memory = parse_int(data.get('memory'), DEFAULT_SERVER_MEMORY, 256)
+    try:
+        node = data.get('node')
+        placed = not node
+        if placed:
+            node = cluster.place(memory)
+        status, result = cluster.agent(node).json('POST', '/server/create', {**data, 'memory': memory})
+    except AgentError as e:
+        return jsonify({"error": str(e)}), e.status
+    if status >= 400 and placed:
+        cluster.release(node, memory)
+    return jsonify({**result, 'node': node}), status
+
+@app.route('/cluster/node/<node>/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def cluster_proxy(node, path):
+    # Any agent endpoint (control, console, status, jobs, files) through
+    # the pooled connection; streams such as /events are not proxied
+    if cluster is None:
+        return jsonify({"error": "No agents configured (PANEL_AGENTS)"}), 404
+    if path == 'events':
+        return jsonify({"error": "Connect to the agent for event streams"}), 400
+    query = request.query_string.decode()
+    headers = {key: request.headers[key] for key in ('Content-Type', 'If-None-Match', 'Range') if key in request.headers}
+    try:
+        status, response_headers, body = cluster.agent(node).request(
+            request.method, f"/{path}{'?' + query if query else ''}", request.get_data() or None, headers
+        )
+    except AgentError as e:
+        return jsonify({"error": str(e)}), e.status
+    skip = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'server', 'date'}
+    return Response(body, status=status, headers=[(k, v) for k, v in response_headers if k.lower() not in skip])
+
+@app.route('/file/download/<server>')
+def file_download(server):
+    try:
+        _root, path = resolve_server_path(server, request.args.get('path'))
+        if not os.path.isfile(path):
+            return jsonify({"error": "Not a file"}), 400
+        # conditional=True gives ETag/If-Modified-Since and Range support; the
+        # body is a file wrapper the WSGI server can hand to sendfile
+        return send_file(path, conditional=True, as_attachment=True,
+                         download_name=os.path.basename(path), max_age=0)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/file/preview/<server>')
+def file_preview(server):
+    try:
+        _root, path = resolve_server_path(server, request.args.get('path'))
+        if not os.path.isfile(path):
+            return jsonify({"error": "Not a file"}), 400
+        limit = parse_int(request.args.get('bytes'), PREVIEW_BYTES, 1, PREVIEW_MAX_BYTES)
+        with open(path, 'rb') as f:
+            data = f.read(limit)
+            size = os.fstat(f.fileno()).st_size
+        return jsonify({
+            'content': data.decode('utf-8', errors='replace'),
+            'size': size,
+            'truncated': size > len(data),
+        })
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/file/upload/<server>', methods=['POST'])
+def upload_create(server):
+    try:
+        data = request.get_json()
+        upload = uploads.create(
+            server,
+            data.get('path'),
+            data.get('name'),
+            parse_int(data.get('size'), None),
+            data.get('sha256'),
+        )
+        return jsonify(upload.to_dict()), 201
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/file/upload/<server>/<upload_id>', methods=['GET'])
+def upload_status(server, upload_id):
+    try:
+        return jsonify(uploads.get(upload_id, server).to_dict())
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/file/upload/<server>/<upload_id>', methods=['PUT'])
+def upload_chunk(server, upload_id):
+    try:
+        upload = uploads.get(upload_id, server)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    offset = parse_int(request.args.get('offset'), None)
+    if offset is None:
+        return jsonify({"error": "offset is required", "received": upload.received()}), 400
+    try:
+        received = uploads.write_chunk(
+            upload, offset, request.stream, request.content_length,
+            request.headers.get('X-Chunk-Sha256'),
+        )
+        return jsonify({'received': received, 'size': upload.size})
+    except ServerError as e:
+        # The client resumes from `received` whatever went wrong
+        return jsonify({"error": str(e), "received": upload.received()}), e.status
+
+@app.route('/file/upload/<server>/<upload_id>/complete', methods=['POST'])
+def upload_complete(server, upload_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        result = uploads.complete(uploads.get(upload_id, server), overwrite=bool(data.get('overwrite')))
+        return jsonify(result)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/file/upload/<server>/<upload_id>', methods=['DELETE'])
+def upload_abort(server, upload_id):
+    try:
+        uploads.discard(uploads.get(upload_id, server))
+        return jsonify({"message": "Upload cancelled"})
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/server/logs/<name>/search')
+def search_logs(name):
+    try:
+        if name not in list_server_names():
+            return jsonify({"error": "Server not found"}), 404
+        started = time.perf_counter()
+        results = get_log_index(name).search(
+            request.args.get('q', ''),
+            start=parse_time(request.args.get('from')),
+            end=parse_time(request.args.get('to')),
+            limit=parse_int(request.args.get('limit'), LOG_SEARCH_LIMIT, 1, 5000),
+            live_path=os.path.join(SERVERS_DIR, name, 'logs', 'latest.log'),
+        )
+        return jsonify({'results': results, 'took_ms': round((time.perf_counter() - started) * 1000, 2)})
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/server/backup', methods=['POST'])
+def server_backup():
+    data = request.get_json()
+    name = data.get('name')
+    if name not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    job = jobs.submit('backup', name, lambda job: backup_server(name, job))
+    return jsonify({"message": f"Backup of {name} queued", "job": job.to_dict()}), 202
+
+@app.route('/server/backups/<name>')
+def server_backups(name):
+    if name not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    return jsonify({'snapshots': backups.list(name)})
+
+@app.route('/server/backups/<name>/<snapshot_id>', methods=['DELETE'])
+def server_backup_delete(name, snapshot_id):
+    try:
+        backups.load(name, snapshot_id)
+    except BackupError as e:
+        return jsonify({"error": str(e)}), 404
+    job = jobs.submit('backup-delete', name, lambda job: backups.delete(name, snapshot_id))
+    return jsonify({"message": f"Deleting snapshot {snapshot_id}", "job": job.to_dict()}), 202
+
+@app.route('/server/restore', methods=['POST'])
+def server_restore():
+    data = request.get_json()
+    name = data.get('name')
+    snapshot_id = data.get('snapshot')
+    if name not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    try:
+        backups.load(name, snapshot_id)
+    except BackupError as e:
+        return jsonify({"error": str(e)}), 404
+    job = jobs.submit('restore', name, lambda job: restore_server(name, snapshot_id, job))
+    return jsonify({"message": f"Restore of {name} to {snapshot_id} queued", "job": job.to_dict()}), 202
+
+@app.route('/server/clone', methods=['POST'])
+def server_clone():
+    data = request.get_json()
+    source = data.get('source')
+    name = data.get('name')
+    if source not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    try:
+        check_name(name)
+        os.makedirs(os.path.join(SERVERS_DIR, name), exist_ok=False)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    except FileExistsError:
+        return jsonify({"error": "Server already exists"}), 400
+    inventory.invalidate()
+    status_wakeup.set()
+    source_dir = os.path.join(SERVERS_DIR, source)
+    port = parse_int(data.get('port'), None, 1)
+
+    def run(job):
+        with saves_paused(source, job):
+            return clone_server(name, source_dir, job, port)
+
+    job = jobs.submit('clone', name, run)
+    return jsonify({"message": f"Cloning {source} to {name}", "job": job.to_dict()}), 202
+
+@app.route('/templates')
+def list_templates():
+    return jsonify({'templates': templates.list()})
+
+@app.route('/template/create', methods=['POST'])
+def template_create():
+    data = request.get_json()
+    name = data.get('name')
+    server = data.get('server')
+    if server not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    try:
+        if os.path.exists(templates.path(name)):
+            return jsonify({"error": "Template already exists"}), 400
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    job = jobs.submit('template', server, lambda job: templates.create(name, server, job))
+    return jsonify({"message": f"Template {name} is being taken from {server}", "job": job.to_dict()}), 202
+
+@app.route('/template/<name>', methods=['DELETE'])
+def template_delete(name):
+    try:
+        templates.get(name)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    job = jobs.submit('template-delete', None, lambda job: templates.delete(name))
+    return jsonify({"message": f"Deleting template {name}", "job": job.to_dict()}), 202
+
+def schedule_options(data):
+    options = {}
+    if 'commands' in data or 'command' in data:
+        commands = data.get('commands') or [data.get('command')]
+        if not all(isinstance(c, str) and c and '\n' not in c for c in commands):
+            raise ServerError("Commands must be non-empty single-line strings")
+        options['commands'] = commands
+    if 'enabled' in data:
+        options['enabled'] = bool(data['enabled'])
+    if 'cron' in data:
+        options['cron'] = data['cron']
+    return options
+
+@app.route('/schedules')
+def list_schedules():
+    return jsonify({'schedules': scheduler.list(request.args.get('server'))})
+
+@app.route('/schedules/upcoming')
+def upcoming_schedules():
+    limit = parse_int(request.args.get('limit'), 50, 1, 500)
+    return jsonify({'upcoming': scheduler.upcoming(limit, request.args.get('server'))})
+
+@app.route('/schedules/history')
+def schedule_history():
+    limit = parse_int(request.args.get('limit'), 50, 1, 500)
+    return jsonify({'history': scheduler.recent(limit, request.args.get('server'))})
+
+@app.route('/schedule/create', methods=['POST'])
+def schedule_create():
+    data = request.get_json()
+    server = data.get('server')
+    action = data.get('action')
+    if server not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    if action not in SCHEDULE_ACTIONS:
+        return jsonify({"error": f"Action must be one of {', '.join(SCHEDULE_ACTIONS)}"}), 400
+    try:
+        options = schedule_options(data)
+        if action == 'command' and not options.get('commands'):
+            return jsonify({"error": "Missing commands"}), 400
+        options.pop('cron', None)
+        task = scheduler.add(server, action, data.get('cron'), **options)
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    except ScheduleError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": f"Scheduled {action} for {server}", "schedule": task})
+
+@app.route('/schedule/<task_id>', methods=['POST'])
+def schedule_update(task_id):
+    if not any(task['id'] == task_id for task in scheduler.list()):
+        return jsonify({"error": "Schedule not found"}), 404
+    try:
+        task = scheduler.update(task_id, **schedule_options(request.get_json()))
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
+    except ScheduleError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"schedule": task})
+
+@app.route('/schedule/<task_id>', methods=['DELETE'])
+def schedule_delete(task_id):
+    try:
+        scheduler.remove(task_id)
+    except ScheduleError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "Schedule removed"})
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify({'jobs': [job.to_dict() for job in jobs.list(request.args.get('server'))]})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/server/console/<name>')
 def get_console(name):
-    return jsonify({'output': console_buffers.get(name, [])})
+    if name not in list_server_names():
+        return jsonify({"error": "Server not found"}), 404
+    since = parse_seq(request.args.get('since')) or 0
+    buffer = get_console_buffer(name) if shared else console_buffers.get(name)
+    if buffer is None:
+        return conditional('con-0', lambda: jsonify({'output': [], 'seq': 0}))
+    # The URL carries `since`, so the buffer's bounds identify the response
+    first_seq, last_seq = shared.console_bounds(name) if shared else (buffer.first_seq, buffer.last_seq)
+
+    def build():
+        lines, seq = buffer.since(since)
+        return jsonify({'output': lines, 'seq': seq, 'truncated': since + 1 < first_seq})
+
+    return conditional(f'con-{first_seq}-{last_seq}', build)
 
 @app.route('/server/console', methods=['POST'])
 def server_console():
     try:
         data = request.get_json()
         name = data.get('name')
-        command = data.get('command')
-        
-        if not name or not command:
+        # A single command, or a batch sent in order over one transport
+        batch = data.get('commands') or ([data['command']] if data.get('command') else None)
+
+        if not name or not batch:
             return jsonify({"error": "Missing parameters"}), 400
+        if not isinstance(batch, list) or not all(isinstance(c, str) and c and '\n' not in c for c in batch):
+            return jsonify({"error": "Commands must be non-empty single-line strings"}), 400
+        if len(batch) > COMMAND_BATCH_LIMIT:
+            return jsonify({"error": f"At most {COMMAND_BATCH_LIMIT} commands per request"}), 400
 
-        pid = get_screen_pid(name)
-        if not pid:
-            return jsonify({"error": "Server not running"}), 400
+        transport, responses = command_transport.send(name, batch, data.get('transport') or 'auto')
+        result = {"message": "Command sent" if len(batch) == 1 else f"{len(batch)} commands sent", "transport": transport}
+        if responses is not None:
+            result['responses'] = responses
+        return jsonify(result)
 
-        subprocess.run(
-            ['screen', '-S', f'{pid}.{name}', '-X', 'stuff', f'{command}\n'],
-            check=True
-        )
-        return jsonify({"message": "Command sent"})
-
-    except subprocess.CalledProcessError as e:
-        return jsonify({"error": str(e)}), 500
+    except ServerError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-if __name__ == "__main__":
+inventory = ServerInventory()
+jar_cache = JarCache(JAR_CACHE_DIR, PAPER_API_URL)
+jobs = JobQueue(JOB_WORKERS)
+metrics = MetricsSampler()
+listings = DirectoryListings()
+disk_usage = DiskUsageIndex(SERVERS_DIR)
+uploads = UploadManager()
+backups = BackupStore(BACKUP_DIR, BACKUP_WORKERS)
+templates = TemplateStore(TEMPLATES_DIR)
+scheduler = Scheduler(SCHEDULES_PATH, run_scheduled, SCHEDULE_CONCURRENCY)
+log_tailer = LogTailer(on_console_lines)
+supervisor = Supervisor()
+command_transport = CommandTransport()
+cluster = Cluster(Cluster.parse(PANEL_AGENTS), PANEL_AGENT_TOKEN, AGENT_TIMEOUT) if PANEL_AGENTS else None
+leadership = Leadership(os.path.join(RUN_DIR, 'leader.lock'), os.path.join(RUN_DIR, 'leader.sock'))
+
+def start_services():
     os.makedirs(SERVERS_DIR, exist_ok=True)
-    app.run(host='0.0.0.0', port=80, debug=True)
+    supervisor.adopt_existing()
+    log_tailer.start()
+    disk_usage.start()
+    scheduler.start()
+    threading.Thread(target=watch_servers, daemon=True).start()
+    threading.Thread(target=metrics.run, daemon=True).start()
+    threading.Thread(target=index_all_logs, daemon=True).start()
+
+def start_worker():
+    # Called in each worker process of a multi-process deployment (the
+    # pre-fork server below, or gunicorn via gunicorn.conf.py)
+    global shared
+    os.makedirs(RUN_DIR, exist_ok=True)
+    shared = SharedState(STATE_DB, CONSOLE_BUFFER_LINES)
+
+    def on_elected():
+        print(f"Worker {os.getpid()} is the leader")
+        start_services()
+        leadership.serve(app)
+
+    leadership.start(on_elected)
+    threading.Thread(target=relay_events, daemon=True).start()
+
+def serve_workers(host, port, workers):
+    # Pre-fork server: the listening socket is opened once and every worker
+    # accepts on it. Workers that exit are replaced.
+    from werkzeug.serving import make_server
+
+    listener = socket.create_server((host, port), backlog=512)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                start_worker()
+                make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            finally:
+                os._exit(1)
+        children.add(pid)
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, _status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            time.sleep(1)
+            spawn()
+
+if __name__ == "__main__":
+    if PANEL_MODE == 'agent':
+        if not PANEL_AGENT_TOKEN:
+            print("Warning: agent mode without PANEL_AGENT_TOKEN accepts commands from anyone")
+        # Lets the central panel keep its pooled connections open
+        from werkzeug.serving import WSGIRequestHandler
+        WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+        if PANEL_DEBUG:
+            print("Ignoring PANEL_DEBUG: the debugger is not served in agent mode")
+            PANEL_DEBUG = False
+    if PANEL_WORKERS > 1:
+        serve_workers(PANEL_HOST, PANEL_PORT, PANEL_WORKERS)
+    else:
+        start_services()
+        # The reloader re-imports this module in a child process, which would
+        # start a second supervisor, tailer and job queue
+        app.run(host=PANEL_HOST, port=PANEL_PORT, debug=PANEL_DEBUG, use_reloader=False)
@@ -0,0 +1,186 @@
+import itertools
+import socket
+import struct
+import threading
+from contextlib import contextmanager
+
+# Minimal Source RCON client, as spoken by Minecraft servers with
+# enable-rcon=true. The vanilla server takes one packet per socket read and
+# drops the connection when a read holds anything else, so commands go one
+# at a time: write a packet, read its reply, then send the next. The
+# connection is kept open and reused, so the cost per command is a round
+# trip rather than a connect and login.
+
+SERVERDATA_RESPONSE_VALUE = 0
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_AUTH = 3
+# Requests larger than this are rejected by the vanilla server
+MAX_COMMAND_BYTES = 1446
+# Long outputs are split into packets of at most this many characters
+MAX_RESPONSE_CHARS = 4096
+
+
+class RconError(Exception):
+    pass
+
+
+class RconClient:
+    def __init__(self, host, port, password, timeout=5):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.ids = itertools.count(1)
+        self.buffer = bytearray()
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise RconError(f"Cannot connect to RCON on {self.host}:{self.port}: {e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        request_id = self.next_id()
+        self.sock.sendall(self.packet(request_id, SERVERDATA_AUTH, self.password))
+        while True:
+            packet_id, packet_type, _body = self.read_packet()
+            # Some servers send an empty response value before the auth response
+            if packet_type == SERVERDATA_AUTH_RESPONSE:
+                if packet_id == -1:
+                    self.close()
+                    raise RconError("RCON authentication failed")
+                return self
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+                self.buffer.clear()
+
+    def alive(self):
+        # An idle connection the server has closed reads as EOF
+        if self.sock is None:
+            return False
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def next_id(self):
+        request_id = next(self.ids)
+        if request_id >= 2 ** 31 - 1:
+            self.ids = itertools.count(1)
+        return request_id
+
+    def packet(self, request_id, packet_type, body):
+        payload = struct.pack('<ii', request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+        return struct.pack('<i', len(payload)) + payload
+
+    def recv_exact(self, size):
+        while len(self.buffer) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise RconError("RCON connection closed")
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_packet(self):
+        try:
+            (length,) = struct.unpack('<i', self.recv_exact(4))
+            data = self.recv_exact(length)
+        except OSError as e:
+            self.close()
+            raise RconError(f"RCON read failed: {e}")
+        packet_id, packet_type = struct.unpack('<ii', data[:8])
+        return packet_id, packet_type, data[8:-2].decode('utf-8', errors='replace')
+
+    def command(self, command):
+        return self.commands([command])[0]
+
+    def commands(self, commands):
+        for command in commands:
+            if len(command.encode('utf-8')) > MAX_COMMAND_BYTES:
+                raise RconError(f"Command longer than {MAX_COMMAND_BYTES} bytes")
+        if self.sock is None:
+            self.connect()
+        return [self.run(command) for command in commands]
+
+    def send(self, request_id, packet_type, body):
+        try:
+            self.sock.sendall(self.packet(request_id, packet_type, body))
+        except OSError as e:
+            self.close()
+            raise RconError(f"RCON write failed: {e}")
+
+    def run(self, command):
+        request_id = self.next_id()
+        self.send(request_id, SERVERDATA_EXECCOMMAND, command)
+        parts = []
+        while True:
+            packet_id, _packet_type, body = self.read_packet()
+            if packet_id == request_id:
+                parts.append(body)
+                break
+        if len(body) < MAX_RESPONSE_CHARS:
+            return body
+        # A full-size packet may be the first of several. The server writes
+        # them all before reading again, so a packet of an unknown type sent
+        # now is answered (with an error) only after the last of them.
+        sentinel = self.next_id()
+        self.send(sentinel, SERVERDATA_RESPONSE_VALUE, '')
+        while True:
+            packet_id, _packet_type, body = self.read_packet()
+            if packet_id == sentinel:
+                return ''.join(parts)
+            if packet_id == request_id:
+                parts.append(body)
+
+
+class RconPool:
+    # Authenticated connections kept open per (host, port, password)
+
+    def __init__(self, size=2, timeout=5):
+        self.size = size
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def client(self, host, port, password):
+        key = (host, port, password)
+        client = None
+        with self.lock:
+            clients = self.idle.get(key, [])
+            while clients and client is None:
+                client = clients.pop()
+                if not client.alive():
+                    client.close()
+                    client = None
+        if client is None:
+            client = RconClient(host, port, password, self.timeout).connect()
+        try:
+            yield client
+        except BaseException:
+            # The stream may be out of step with its ids now; never reuse it
+            client.close()
+            raise
+        with self.lock:
+            clients = self.idle.setdefault(key, [])
+            if len(clients) < self.size:
+                clients.append(client)
+                return
+        client.close()
+
+    def close_all(self):
+        with self.lock:
+            clients = [c for group in self.idle.values() for c in group]
+            self.idle.clear()
+        for client in clients:
+            client.close()
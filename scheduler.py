@@ -0,0 +1,248 @@
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Cron-style schedules for panel actions (restarts, backups, console
+# commands). One thread sleeps on a heap of next-fire times; due tasks are
+# handed to a small pool whose size is the number allowed to run at once,
+# so forty servers on "0 4 * * *" are worked through a few at a time
+# instead of all restarting in the same second. Schedules are kept in a
+# JSON file; run history is in memory only.
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+MONTH_NAMES = {name: i for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+DAY_NAMES = {name: i for i, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+# Far enough for any valid expression (Feb 29 on a Monday recurs within 28 years)
+SEARCH_YEARS = 30
+
+
+class ScheduleError(Exception):
+    pass
+
+
+class SkipRun(Exception):
+    # Raised by the run callback when a task has nothing to do this time
+    pass
+
+
+def parse_field(text, low, high, names=None):
+    def value(token):
+        token = token.lower()
+        if names and token in names:
+            return names[token]
+        try:
+            return int(token)
+        except ValueError:
+            raise ScheduleError(f"Invalid value {token!r}")
+
+    values = set()
+    for part in text.split(','):
+        base, _, step = part.partition('/')
+        if base == '*':
+            start, end = low, high
+        elif '-' in base:
+            start, end = (value(token) for token in base.split('-', 1))
+        else:
+            start = value(base)
+            end = high if step else start
+        step = value(step) if step else 1
+        if step < 1 or start > end or start < low or end > high:
+            raise ScheduleError(f"Invalid field {text!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    # minute hour day-of-month month day-of-week, with the usual *, lists,
+    # ranges, steps, names and @daily-style macros. As in Vixie cron, a
+    # restricted day-of-month and day-of-week match when either does.
+
+    def __init__(self, expression):
+        self.expression = (expression or '').strip()
+        fields = MACROS.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise ScheduleError(f"Expected 5 cron fields, got {self.expression!r}")
+        self.minutes = parse_field(fields[0], 0, 59)
+        self.hours = parse_field(fields[1], 0, 23)
+        self.days = parse_field(fields[2], 1, 31)
+        self.months = parse_field(fields[3], 1, 12, MONTH_NAMES)
+        # 7 is Sunday too
+        self.weekdays = {day % 7 for day in parse_field(fields[4], 0, 7, DAY_NAMES)}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, ts):
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt.replace(year=dt.year + SEARCH_YEARS, day=1)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ScheduleError(f"{self.expression!r} never fires")
+
+
+class Scheduler:
+    def __init__(self, path, run, concurrency=2, history=200):
+        self.path = path
+        # run(task) does the work and returns a JSON-able result
+        self.run = run
+        self.tasks = {}
+        self.heap = []
+        self.history = deque(maxlen=history)
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='panel-schedule')
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                tasks = json.load(f)
+        except (FileNotFoundError, ValueError):
+            tasks = []
+        for task in tasks:
+            self.tasks[task['id']] = task
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(list(self.tasks.values()), f, indent=2)
+        os.replace(tmp, self.path)
+
+    def schedule(self, task, now):
+        # Stale heap entries are skipped when popped: they no longer match
+        # the task's next_run
+        task['next_run'] = None
+        if task.get('enabled', True):
+            try:
+                task['next_run'] = CronSchedule(task['cron']).next_after(now)
+            except ScheduleError:
+                return
+            heapq.heappush(self.heap, (task['next_run'], task['id']))
+
+    def start(self):
+        with self.condition:
+            now = time.time()
+            for task in self.tasks.values():
+                self.schedule(task, now)
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def loop(self):
+        with self.condition:
+            while True:
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    due, task_id = heapq.heappop(self.heap)
+                    task = self.tasks.get(task_id)
+                    if task is None or task.get('next_run') != due:
+                        continue
+                    # Computed from now, so a long suspend does not replay
+                    # every missed occurrence
+                    self.schedule(task, now)
+                    self.executor.submit(self.fire, dict(task), due)
+                self.condition.wait(self.heap[0][0] - now if self.heap else None)
+
+    def fire(self, task, due):
+        entry = {'task': task['id'], 'server': task['server'], 'action': task['action'],
+                 'due': due, 'started_at': time.time(), 'finished_at': None,
+                 'state': 'running', 'result': None, 'error': None}
+        with self.condition:
+            self.history.append(entry)
+        try:
+            entry['result'] = self.run(task)
+            entry['state'] = 'done'
+        except SkipRun as e:
+            entry['state'] = 'skipped'
+            entry['error'] = str(e)
+        except Exception as e:
+            entry['state'] = 'failed'
+            entry['error'] = str(e)
+        entry['finished_at'] = time.time()
+        with self.condition:
+            current = self.tasks.get(task['id'])
+            if current is not None:
+                current['last_run'] = entry['started_at']
+                current['last_state'] = entry['state']
+                self.save()
+
+    def add(self, server, action, cron, **options):
+        # Also rejects expressions that parse but can never fire
+        CronSchedule(cron).next_after(time.time())
+        task = {'id': uuid.uuid4().hex[:12], 'server': server, 'action': action, 'cron': cron,
+                'enabled': True, 'created_at': time.time(), 'last_run': None, 'last_state': None, **options}
+        with self.condition:
+            self.tasks[task['id']] = task
+            self.schedule(task, time.time())
+            self.save()
+            self.condition.notify()
+            return dict(task)
+
+    def update(self, task_id, **changes):
+        if 'cron' in changes:
+            CronSchedule(changes['cron']).next_after(time.time())
+        with self.condition:
+            task = self.tasks.get(task_id)
+            if task is None:
+                raise ScheduleError("Schedule not found")
+            task.update(changes)
+            self.schedule(task, time.time())
+            self.save()
+            self.condition.notify()
+            return dict(task)
+
+    def remove(self, task_id):
+        with self.condition:
+            if self.tasks.pop(task_id, None) is None:
+                raise ScheduleError("Schedule not found")
+            self.save()
+
+    def list(self, server=None):
+        with self.condition:
+            return [dict(task) for task in self.tasks.values() if server is None or task['server'] == server]
+
+    def upcoming(self, limit=50, server=None):
+        # The next `limit` firings across all tasks, in order
+        firings = []
+        for task in self.list(server):
+            if task['next_run'] is None:
+                continue
+            cron = CronSchedule(task['cron'])
+            at = task['next_run']
+            for _ in range(limit):
+                firings.append({'at': at, 'task': task['id'], 'server': task['server'], 'action': task['action']})
+                at = cron.next_after(at)
+        firings.sort(key=lambda firing: firing['at'])
+        return firings[:limit]
+
+    def recent(self, limit=50, server=None):
+        with self.condition:
+            entries = [dict(e) for e in self.history if server is None or e['server'] == server]
+        return entries[::-1][:limit]
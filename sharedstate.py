@@ -0,0 +1,257 @@
+import fcntl
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# State shared between panel worker processes.
+#
+# Exactly one worker is the leader: it holds an flock on run/leader.lock and
+# runs everything that owns processes or in-memory state (supervisor, log
+# tailer, jobs, metrics). It records console lines, server status and
+# published events in a SQLite database in WAL mode, so every worker can
+# serve consoles, status and the event stream from the same data. Requests
+# that need the leader's in-memory state are forwarded to it over a unix
+# socket. When the leader dies the kernel drops its lock and a waiting
+# worker takes over.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS console (
+    server TEXT,
+    seq INTEGER,
+    line TEXT,
+    PRIMARY KEY (server, seq)
+) WITHOUT ROWID;
+-- How far the leader's tailer has read each latest.log, written with the
+-- console lines it produced
+CREATE TABLE IF NOT EXISTS log_positions (
+    server TEXT PRIMARY KEY,
+    dev INTEGER,
+    ino INTEGER,
+    offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS status (
+    server TEXT PRIMARY KEY,
+    info TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT,
+    server TEXT,
+    data TEXT,
+    created REAL
+);
+"""
+
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'host', 'upgrade'}
+# Read and write size when relaying bodies to and from the leader
+FORWARD_BLOCK = 64 * 1024
+
+
+class SharedState:
+    def __init__(self, path, console_lines):
+        self.path = path
+        self.console_lines = max(1, console_lines)
+        self.idle = []
+        self.lock = threading.Lock()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        # Request threads come and go, so connections are pooled rather than
+        # kept per thread
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                self.idle.append(conn)
+
+    def append_console(self, server, lines, position=None):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                last = conn.execute('SELECT MAX(seq) FROM console WHERE server = ?', (server,)).fetchone()[0] or 0
+                conn.executemany(
+                    'INSERT INTO console (server, seq, line) VALUES (?, ?, ?)',
+                    [(server, last + i, line) for i, line in enumerate(lines, 1)],
+                )
+                last += len(lines)
+                conn.execute('DELETE FROM console WHERE server = ? AND seq <= ?', (server, last - self.console_lines))
+                if position and position[0]:
+                    (dev, ino), offset = position
+                    conn.execute(
+                        'INSERT OR REPLACE INTO log_positions (server, dev, ino, offset) VALUES (?, ?, ?, ?)',
+                        (server, dev, ino, offset),
+                    )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return last
+
+    def log_position(self, server):
+        with self.connection() as conn:
+            row = conn.execute('SELECT dev, ino, offset FROM log_positions WHERE server = ?', (server,)).fetchone()
+        return ((row[0], row[1]), row[2]) if row else None
+
+    def console_since(self, server, seq):
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT seq, line FROM console WHERE server = ? AND seq > ? ORDER BY seq', (server, seq)
+            ).fetchall()
+            if rows:
+                return [line for _seq, line in rows], rows[-1][0]
+            return [], conn.execute('SELECT MAX(seq) FROM console WHERE server = ?', (server,)).fetchone()[0] or 0
+
+    def console_bounds(self, server):
+        with self.connection() as conn:
+            first, last = conn.execute('SELECT MIN(seq), MAX(seq) FROM console WHERE server = ?', (server,)).fetchone()
+        return first or 1, last or 0
+
+    def set_status(self, server, info):
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO status (server, info, updated) VALUES (?, ?, ?)',
+                (server, json.dumps(info), time.time()),
+            )
+
+    def status_version(self):
+        # Changes whenever any status row is written; cheaper than reading them
+        with self.connection() as conn:
+            count, updated = conn.execute('SELECT COUNT(*), MAX(updated) FROM status').fetchone()
+        return f'{count}.{updated or 0}'
+
+    def statuses(self):
+        with self.connection() as conn:
+            return {server: json.loads(info) for server, info in conn.execute('SELECT server, info FROM status')}
+
+    def publish(self, event, data, server=None):
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO events (event, server, data, created) VALUES (?, ?, ?, ?)',
+                (event, server, json.dumps(data), time.time()),
+            )
+
+    def last_event_id(self):
+        with self.connection() as conn:
+            return conn.execute('SELECT MAX(id) FROM events').fetchone()[0] or 0
+
+    def events_since(self, event_id):
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT id, event, server, data FROM events WHERE id > ? ORDER BY id', (event_id,)
+            ).fetchall()
+        return [(row_id, event, server, json.loads(data)) for row_id, event, server, data in rows]
+
+    def trim_events(self, max_age):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM events WHERE created < ?', (time.time() - max_age,))
+
+
+class SharedConsoleBuffer:
+    # Same interface as ConsoleBuffer, backed by the shared database
+
+    def __init__(self, state, server):
+        self.state = state
+        self.server = server
+
+    @property
+    def last_seq(self):
+        return self.state.console_bounds(self.server)[1]
+
+    @property
+    def first_seq(self):
+        return self.state.console_bounds(self.server)[0]
+
+    def extend(self, lines, position=None):
+        return self.state.append_console(self.server, lines, position)
+
+    def since(self, seq=0):
+        return self.state.console_since(self.server, seq)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout, blocksize=FORWARD_BLOCK)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Leadership:
+    def __init__(self, lock_path, socket_path, timeout=120):
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.is_leader = False
+        self.lock_fd = None
+        self.server = None
+
+    def start(self, on_elected):
+        def wait():
+            self.lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            # Blocks until the current leader exits
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            self.is_leader = True
+            on_elected()
+
+        threading.Thread(target=wait, daemon=True).start()
+
+    def serve(self, app):
+        from werkzeug.serving import make_server
+
+        # Holding the lock means any socket left behind belongs to a dead leader
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self.server = make_server(f'unix://{self.socket_path}', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def forward(self, method, path, headers, body=None, length=None):
+        # Relays in blocks both ways: `body` is a file-like request stream
+        # (sent chunked when `length` is unknown) and the response body comes
+        # back as an iterator, so upload chunks and large responses are never
+        # held whole by the forwarding worker
+        headers = {key: value for key, value in headers if key.lower() not in HOP_HEADERS}
+        if body is not None and length is not None:
+            headers['Content-Length'] = str(length)
+        conn = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+        response_headers = [
+            (key, value) for key, value in response.getheaders() if key.lower() not in HOP_HEADERS
+        ]
+        if response.length is not None:
+            response_headers.append(('Content-Length', str(response.length)))
+
+        def relay():
+            try:
+                while True:
+                    block = response.read(FORWARD_BLOCK)
+                    if not block:
+                        break
+                    yield block
+            finally:
+                conn.close()
+
+        return response.status, response_headers, relay()